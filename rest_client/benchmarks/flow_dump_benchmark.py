@@ -0,0 +1,110 @@
+"""
+Micro-benchmark for flow table dump handling. Compares the old quadratic flow list
+assembly against OFResponseSwitchFlows.get_flows and the streaming iter_flows decoder
+for dumps of up to 100k flow entries, and Flowmod.add_action against the old
+copy-on-append action list.
+
+Run from the rest_client directory:
+    python -m benchmarks.flow_dump_benchmark
+"""
+
+import json                         as json
+import time                         as time
+import argparse                     as argparse
+
+import nw_control.of_rest_client    as of
+import nw_control.flowmod           as fm
+
+FLOW_COUNTS     = [1000, 10000, 25000, 50000, 100000]
+SWITCH_COUNT    = 1000
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.status_code = 200
+
+    def json(self):
+        return json.loads(self.text)
+
+def build_flow_dump_text(flow_count, switch_count):
+    flows_per_switch = max(1, flow_count // switch_count)
+    flow_dump = {}
+    for flow_idx in range(flow_count):
+        dpid = str(flow_idx // flows_per_switch)
+        flow_dump.setdefault(dpid, []).append(
+                { "priority"        : 20
+                , "cookie"          : flow_idx % 4
+                , "table_id"        : 100
+                , "idle_timeout"    : 240
+                , "hard_timeout"    : 0
+                , "byte_count"      : flow_idx
+                , "packet_count"    : flow_idx
+                , "match"           : { "dl_type"   : 2048
+                                      , "nw_dst"    : "10.0.%d.%d" % (flow_idx // 256 % 256, flow_idx % 256)
+                                      }
+                , "actions"         : ["OUTPUT:%d" % (flow_idx % 4 + 1)]
+                })
+    return json.dumps(flow_dump)
+
+def quadratic_get_flows(flow_dump):
+    flow_list = []
+    for sw_flows in flow_dump.values():
+        flow_list = flow_list + sw_flows
+    return flow_list
+
+def quadratic_add_actions(action_count):
+    actions = []
+    action = fm.Action(fm.ActionTypes.Output, {'port' : 1})
+    for _ in range(action_count):
+        actions = actions + [action.get_dict()]
+    return actions
+
+def linear_add_actions(action_count):
+    flow_mod = fm.Flowmod(1)
+    action = fm.Action(fm.ActionTypes.Output, {'port' : 1})
+    for _ in range(action_count):
+        flow_mod.add_action(action)
+    return flow_mod.actions
+
+def time_it(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def run_benchmark(flow_counts, switch_count):
+    print("%8s %14s %14s %14s %14s %14s %14s" % ("flows", "old get_flows", "get_flows", 
+        "iter_flows", "iter(cookie)", "old add_action", "add_action"))
+    for flow_count in flow_counts:
+        text = build_flow_dump_text(flow_count, switch_count)
+
+        def new_get_flows():
+            of.OFResponseSwitchFlows.parse_json(_FakeResponse(text)).get_flows()
+
+        def streamed():
+            for _ in of.OFResponseSwitchFlows.parse_json(_FakeResponse(text)).iter_flows():
+                pass
+
+        def streamed_with_filter():
+            response = of.OFResponseSwitchFlows.parse_json(_FakeResponse(text))
+            for _ in response.iter_flows(cookie=1, table_id=100):
+                pass
+
+        print("%8d %13.4fs %13.4fs %13.4fs %13.4fs %13.4fs %13.4fs" % 
+                ( flow_count
+                , time_it(lambda: quadratic_get_flows(json.loads(text)))
+                , time_it(new_get_flows)
+                , time_it(streamed)
+                , time_it(streamed_with_filter)
+                , time_it(lambda: quadratic_add_actions(flow_count // 10))
+                , time_it(lambda: linear_add_actions(flow_count // 10))
+                ))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--switches", type=int, default=SWITCH_COUNT)
+    parser.add_argument("--flows", type=int, nargs="+", default=FLOW_COUNTS)
+    args = parser.parse_args()
+    run_benchmark(args.flows, args.switches)
+
+if __name__ == "__main__":
+    main()
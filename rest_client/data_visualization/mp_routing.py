@@ -14,6 +14,7 @@ import random                       as rand
 import mp_routing.vle_trial                     as vle_trial
 import data_visualization.params                as cfg
 import data_visualization.helpers               as helpers
+import nw_control.link_utilization              as link_utilization
 import traffic_analysis.core_taps               as core_taps
 import traffic_analysis.heterogeneous_links     as heterogeneous_links
 
@@ -71,72 +72,36 @@ def compute_link_utilization(byte_count_in_time_period, time_period):
 #                            , linkUtilization
 #                            }
 def compute_link_utilization_over_time(utilization_results):
-    zipped_descriptions = zip(utilization_results, utilization_results[1:])
+    counter_matrix = link_utilization.LinkCounterMatrix.from_snapshots(utilization_results)
+    byte_count_diffs, valid = counter_matrix.get_deltas(link_utilization.ByteCounter.SENT,
+            require_both=True)
+    link_utils = compute_link_utilization(byte_count_diffs, 10)
     utilization_descriptions = []
-    for previous_count_descriptions, current_count_descriptions in zipped_descriptions:
-        byte_count_diff = (current_count_descriptions["bytesSent"] -
-                previous_count_descriptions["bytesSent"])
-        packet_count_diff = (current_count_descriptions["packetsSent"] -
-                previous_count_descriptions["bytesSent"])
-        link_utilization = compute_link_utilization(byte_count_diff, 10)
+    for time_idx, link_idx in zip(*np.nonzero(valid)):
+        source_dpid, destination_dpid = counter_matrix.link_ids[link_idx]
         utilization_description = { "sourceSwitchId"        : source_dpid
                                   , "destinationSwitchId"   : destination_dpid
-                                  , "linkUtilization"       : link_utilization
+                                  , "linkUtilization"       : float(link_utils[time_idx, link_idx])
                                   }
         utilization_descriptions.append(utilization_description)
     return utilization_descriptions
 
 def generate_average_link_utilization_plot(utilization_results):
     link_utilization_over_time = compute_link_utilization_over_time(utilization_results)
-    average_link_utilizations = {}
+    link_utilizations = defaultdict(list)
     for utilization_description in link_utilization_over_time:
         source_dpid = utilization_description["sourceSwitchId"]
         destination_dpid = utilization_description["destinationSwitchId"]
-        link_utilization
-
-def compute_initial_byte_counts(byte_counts_per_time_period):
-    return byte_counts_per_time_period[0]
-
-def subtract_counts(count_a, count_b):
-    diff = defaultdict(dict)
-    for s, t in count_a.items():
-        for d, b in t.items():
-            try:
-                diff[s][d] = b - count_b[s][d]
-            except KeyError:
-                print("Key error")
-                continue
-
-    # return {s: {d: b - count_b[s][d] for d, b in t.items()} for s, t in count_a.items()}
-    return diff
-
-def compute_utilization_from_byte_counts(byte_count, link_capacity):
-    return {s: {d: b / link_capacity for d, b in t.items()} for s, t in byte_count.items()}
+        link_utilizations[source_dpid, destination_dpid].append(
+                utilization_description["linkUtilization"])
+    average_link_utilizations = {link_id: mean(utils) 
+            for link_id, utils in link_utilizations.items()}
+    return average_link_utilizations
 
 # return {source_id: destination_id: utilization} forall source_id, destination_id
 def compute_network_util_over_time(util_results):
-    byte_counts_per_time_period = []
-    for link_util_dict in util_results:
-        # Each results_list represents a snapshot of the network at a point in time.
-        results_list = link_util_dict
-        # Each results_set represents a particular link in the network at a given time.
-        byte_counts = defaultdict(dict)
-        for results_set in results_list:
-            # Arbitrarily use the source counts, collect them first
-            source_switch = results_set["sourceSwitchId"]
-            destination_switch = results_set["destinationSwitchId"]
-            byte_counts[source_switch][destination_switch] = results_set["bytesSent"] + results_set["bytesReceived"]
-        byte_counts_per_time_period.append(byte_counts)
-    
-    util_in_time_period = []
-    initial_byte_counts = compute_initial_byte_counts(byte_counts_per_time_period)
-    for last_count, current_count in zip(byte_counts_per_time_period, byte_counts_per_time_period[1:]):
-        differential_count = subtract_counts(current_count, last_count)
-        link_utilization_snapshot = compute_utilization_from_byte_counts(differential_count, 10)
-        util_in_time_period.append(link_utilization_snapshot)
-
-    pp.pprint(util_in_time_period)
-    return util_in_time_period
+    return link_utilization.compute_directed_link_rates(util_results,
+            link_utilization.ByteCounter.TOTAL, 1 / 10)
 
 def graph_link_utilization(link_utilization_data):
     link_ids = [(s, d) for s, t in link_utilization_data[0].items() for d in t.keys()]
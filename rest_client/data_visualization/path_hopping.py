@@ -15,6 +15,7 @@ import operator                     as op
 import data_visualization.params                as cfg
 import data_visualization.helpers               as helpers
 import path_hopping.flow_allocation             as flow_allocation
+import nw_control.link_utilization              as link_utilization
 
 from collections                    import defaultdict
 from functools                      import reduce
@@ -45,47 +46,8 @@ def compute_byte_counts_per_time_period(util_results):
         m_t: source_id -> destination_id -> byte_count
     for all monitoring periods, t.
     """
-    def compute_initial_byte_counts(byte_counts_per_time_period):
-        return byte_counts_per_time_period[0]
-
-    def subtract_counts(count_a, count_b):
-        diff = defaultdict(dict)
-        for s, t in count_a.items():
-            for d, b in t.items():
-                try:
-                    diff[s][d] = b - count_b[s][d]
-                except KeyError:
-                    print("Key error")
-                    continue
-
-        # return {s: {d: b - count_b[s][d] for d, b in t.items()} for s, t in count_a.items()}
-        return diff
-
-    def compute_utilization_from_byte_counts(byte_count, link_capacity):
-        return {s: {d: b / link_capacity for d, b in t.items()} for s, t in byte_count.items()}
-
-    byte_counts_per_time_period = []
-    for link_util_dict in util_results:
-        # Each results_list represents a snapshot of the network at a point in time.
-        results_list = link_util_dict
-        # Each results_set represents a particular link in the network at a given time.
-        byte_counts = defaultdict(dict)
-        for results_set in results_list:
-            # Arbitrarily use the source counts, collect them first
-            source_switch = results_set["sourceSwitchId"]
-            destination_switch = results_set["destinationSwitchId"]
-            byte_counts[source_switch][destination_switch] = (results_set["bytesSent"] + 
-                    results_set["bytesReceived"])
-        byte_counts_per_time_period.append(byte_counts)
-    
-    util_in_time_period = []
-    initial_byte_counts = compute_initial_byte_counts(byte_counts_per_time_period)
-    for last_count, current_count in zip(byte_counts_per_time_period, byte_counts_per_time_period[1:]):
-        differential_count = subtract_counts(current_count, last_count)
-        link_utilization_snapshot = compute_utilization_from_byte_counts(differential_count, 1)
-        util_in_time_period.append(link_utilization_snapshot)
-
-    return util_in_time_period
+    return link_utilization.compute_directed_link_rates(util_results,
+            link_utilization.ByteCounter.TOTAL, 1.0)
 
 def compute_mean_network_utilization(network_utilization):
     """
@@ -95,9 +95,14 @@ def collect_end_host_results(hosts):
             sender_results = host.get_sender_results()
         except ValueError:
             sender_results = None
+        try:
+            receiver_stats = host.get_receiver_stats()
+        except ValueError:
+            receiver_stats = None
             
-        results_dict = { "receiver" : receiver_results
-                       , "sender"   : sender_results
+        results_dict = { "receiver"         : receiver_results
+                       , "receiver-stats"   : receiver_stats
+                       , "sender"           : sender_results
                        }
         results_map[host_id] = results_dict
     return results_map
@@ -130,14 +135,6 @@ def destroy_all_mininet_hosts(hosts):
     for host in hosts.values():
         host.disconnect()
 
-def remove_all_flows(flow_tokens):
-    for flow_token in flow_tokens:
-        try:
-            onos_route_adder.uninstall_flow(flow_token)
-        except Exception as ex:
-            print("Failed to remove flow with token %s." % flow_token)
-            print(ex)
-
 def conduct_mininet_trial(results_repository, schema_vars, the_trial_provider, the_trial):
     hosts                           = {}
     flow_allocation_seed_number     = the_trial.get_parameter("seed-number")
@@ -155,12 +152,12 @@ def conduct_mininet_trial(results_repository, schema_vars, the_trial_provider, t
             # print(f"PID of server on host with IP {host.host_ip} is {host.server_proc.pid}")
         
         k_matrix = [0.0]*len(flows)
+        flow_jsons = []
         for flow_id, flow in enumerate(flows):
             source, destination_node, flow_tx_rate_list = (flow.source_node, flow.destination_node, 
                     flow.flow_tx_rate)
             flow_json, tag_values_for_flow = simple_paths_to_flow_json(flow.paths, tag_values, id_to_dpid)
-            flow_token = onos_route_adder.install_flow(flow_json)
-            flow_tokens.add(flow_token)
+            flow_jsons.append(flow_json)
 
             # k_matrix is the splitting ratio
             # tag_values indicate which DSCP tag to use for the path. I think we want a K-matrix that looks
@@ -180,6 +177,7 @@ def conduct_mininet_trial(results_repository, schema_vars, the_trial_provider, t
 
             # print(f"Flow source node: {flow.source_node}. Flow destination node: {flow.destination_node}")
             # print(f"Flow source IP: {hosts[flow.source_node].host_ip}, Flow destination IP: {hosts[flow.destination_node].host_ip}")
+        onos_route_adder.install_all_flows(flow_jsons, flow_tokens)
 
         for flow_id, background_flow in enumerate(the_trial.get_parameter("background-traffic-flow-set")):
             source, destination, flow_tx_rate_list = (background_flow.source_node, 
@@ -250,7 +248,7 @@ def conduct_mininet_trial(results_repository, schema_vars, the_trial_provider, t
         traceback.print_tb(exc_traceback, limit=10, file=sys.stdout)
     finally:
         destroy_all_mininet_hosts(hosts)
-        remove_all_flows(flow_tokens)
+        onos_route_adder.remove_all_flows(flow_tokens)
     
 def main():
     results_repository = ResultsRepository.create_repository(tuiti_config.base_repository_path,
@@ -440,7 +438,7 @@ def conduct_test_mininet_trial(results_reposity, the_trial):
         traceback.print_tb(exc_traceback, limit=10, file=sys.stdout)
     finally:
         destroy_all_mininet_hosts(hosts)
-        remove_all_flows(flow_tokens)
+        onos_route_adder.remove_all_flows(flow_tokens)
     
 if __name__ == "__main__":
     main()
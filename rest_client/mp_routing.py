@@ -37,8 +37,9 @@ def collect_end_host_results(hosts):
     results_map = {}
     for host_id, host in hosts.items():
         receiver_results, sender_results = host.retrieve_end_host_results()
-        results_dict = { "receiver"     : receiver_results
-                       , "sender"       : sender_results
+        results_dict = { "receiver"         : receiver_results
+                       , "receiver-stats"   : host.retrieve_receiver_stats()
+                       , "sender"           : sender_results
                        }
         results_map[host_id] = results_dict
     return results_map
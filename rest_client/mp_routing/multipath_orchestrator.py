@@ -1,28 +1,47 @@
 
 import threading        as thread
 import paramiko         as ssh
+import random           as rand
+import time             as time
+import numpy            as np
 
 import mp_routing.file_parsing      as fp
 import nw_control.host_mapper       as hm
 import nw_control.util              as util
 import nw_control.of_rest_client    as of
 import nw_control.flowmod           as fm
+import nw_control.flow_reconciler   as flow_reconciler
 
-from functools      import reduce
-from collections    import defaultdict
+from functools              import reduce
+from collections            import defaultdict
+from concurrent.futures     import ThreadPoolExecutor
 
 # Horrible debugging practice
 
 class MPRouteAdder:
+
+    # Flow table that every route is installed in.
+    ROUTE_TABLE_ID = 100
     
     def __init__( self
                 , of_proc
                 , mapper
-                , route_provider ):
+                , route_provider
+                , cookie = None ):
         self._route_provider = route_provider
         self.installed_routes = defaultdict(list)
         self.of_proc = of_proc
         self._mapper = mapper
+        # Every flowmod installed by this route adder is stamped with cookie so that
+        # all of them can be removed from a switch with a single masked delete.
+        self.cookie = cookie if cookie is not None else MPRouteAdder.allocate_cookie()
+
+    @staticmethod
+    def allocate_cookie():
+        """
+        Returns a random, non-zero 64 bit cookie to identify the flows of one trial.
+        """
+        return rand.getrandbits(63) + 1
 
     @staticmethod
     def calculate_dscp_value(flow_num):
@@ -37,19 +56,51 @@ class MPRouteAdder:
         # Get a copy of the adjacency matrix
         adj_mat = self.of_proc.get_topo_links().get_adj_mat()
         route_count = 0
+        flow_mods = []
         
         for path_id, route in routes:
             dscp_val = MPRouteAdder.calculate_dscp_value(path_id)
-            self.install_route(route, adj_mat, dscp_val)
+            flow_mods.extend(self._build_route_flow_mods(route, adj_mat, dscp_val))
             route_count += 1
+        self._push_flow_mods(flow_mods)
         print('Installed %d routes on physical network.' % route_count)
 
+    def reconcile_routes(self):
+        """
+        Install the routes from the route provider by diffing them against the flows
+        that are already installed with this route adder's cookie. Only missing flows
+        are pushed and only flows that are no longer part of the route set are deleted.
+        To carry routes over between trials, construct each trial's route adder with
+        the cookie of the previous one.
+        """
+        routes = self._route_provider.get_routes()
+        adj_mat = self.of_proc.get_topo_links().get_adj_mat()
+        flow_mods = []
+        for path_id, route in routes:
+            dscp_val = MPRouteAdder.calculate_dscp_value(path_id)
+            flow_mods.extend(self._build_route_flow_mods(route, adj_mat, dscp_val))
+
+        reconciler = flow_reconciler.FlowReconciler(self.of_proc, self.cookie)
+        reconcile_result = reconciler.reconcile(flow_mods)
+        print(str(reconcile_result))
+        failures = reconcile_result.get_failures()
+        if failures:
+            raise IOError('Failed to reconcile %d of %d flowmods. First failure: %s' %
+                    (len(failures), reconcile_result.get_operation_count(), str(failures[0])))
+        self.installed_routes.clear()
+        for dpid, flow_mod in flow_mods:
+            self.installed_routes[dpid].append(flow_mod)
+        return reconcile_result
+
     # Looking back on how this is turning out, it would have been better to inject
     # an actual instnace of some class to interact with the controller, thus indirecting
     # the consumers of that interface from its implementation. Can't really test
     # this route adding code conviniently without an actual controller and network 
     # setup.
     def install_route(self, route, adj_mat, dscp_val):
+        self._push_flow_mods(self._build_route_flow_mods(route, adj_mat, dscp_val))
+
+    def _build_route_flow_mods(self, route, adj_mat, dscp_val):
         pairs = [(src, dst) for (src,dst) in zip(route, route[1:])]
         src_sw = route[0]
         dst_sw = route[-1]
@@ -59,6 +110,7 @@ class MPRouteAdder:
         src_ip = self._mapper.resolve_hostname(self._mapper.map_sw_to_host(src_sw))
         dst_ip = self._mapper.resolve_hostname(self._mapper.map_sw_to_host(dst_sw))
 
+        flow_mods = []
         for (src, dst) in pairs:
             # Determine output port
             src_dpid = int(self._mapper.map_sw_to_dpid(src))
@@ -69,8 +121,6 @@ class MPRouteAdder:
                 print('Found no link: %s -> %s' % (src, dst))
                 continue
 
-            # Determine the actual DPID of the switch
-            sw_dpid = self._mapper.map_sw_to_dpid(src)
             # Construct the correct match criteria. 
             match = fm.Match(fm.MatchTypes.eth_type, 2048) # Math on EthType of IP
             match.add_criteria(fm.MatchTypes.ipv4_src, src_ip)
@@ -80,20 +130,49 @@ class MPRouteAdder:
             # TODO: Add filter criteria based on L4 Address (Port number)
 
             # Construct the flowmod.
-            flow_mod = fm.Flowmod(src_dpid, idle_timeout=240, table_id=100, priority=20) # Timeout is only for testing.
+            flow_mod = fm.Flowmod(src_dpid, cookie=self.cookie, idle_timeout=240,
+                    table_id=MPRouteAdder.ROUTE_TABLE_ID, priority=20) # Timeout is only for testing.
             flow_mod.add_match(match)
             flow_mod.add_action(fm.Action(fm.ActionTypes.Output, { 'port' : out_port }))
+            flow_mods.append((src_dpid, flow_mod))
+        return flow_mods
 
-            # Update the switch.
-            self.of_proc.push_flow_mod(src_dpid, flow_mod)
-            
-            # Save the route so it can be removed later
-            self.installed_routes[sw_dpid].append(flow_mod)
+    def _push_flow_mods(self, flow_mods):
+        push_result = self.of_proc.push_flow_mods(flow_mods)
+        for status in push_result:
+            if status.succeeded:
+                # Save the route so it can be removed later
+                self.installed_routes[status.dpid].append(status.flow_mod)
+        print(str(push_result))
+        failures = push_result.get_failures()
+        if failures:
+            raise IOError('Failed to push %d of %d flowmods. First failure: %s' %
+                    (len(failures), len(push_result), str(failures[0])))
+        return push_result
 
-    def remove_routes(self):
-        for sw_dpid, route_list in self.installed_routes.items():
-            for route in route_list:
-                self.of_proc.remove_flow(sw_dpid, route)
+    def remove_routes(self, verify=False):
+        """
+        Remove every installed route with one cookie-masked delete per switch. If verify
+        is set the flow tables are read back afterwards to check that no flows with this
+        route adder's cookie remain.
+        """
+        dpids = list(self.installed_routes.keys())
+        remove_result = self.of_proc.remove_flows_by_cookie(dpids, self.cookie,
+                table_id=MPRouteAdder.ROUTE_TABLE_ID)
+        failures = remove_result.get_failures()
+        if failures:
+            raise IOError('Failed to remove routes from %d of %d switches. First failure: %s' %
+                    (len(failures), len(remove_result), str(failures[0])))
+
+        if verify:
+            remaining_flows = self.of_proc.get_flows_by_cookie(dpids, self.cookie)
+            remaining_flows = {dpid: flows for dpid, flows in remaining_flows.items() if flows}
+            if remaining_flows:
+                raise IOError('%d flows remain on switches %s after removing routes.' %
+                        (sum(len(flows) for flows in remaining_flows.values()), 
+                            sorted(remaining_flows.keys())))
+        self.installed_routes.clear()
+        return remove_result
 
     def get_src_dst_pairs(self):
         routes = self._route_provider.get_routes()
@@ -112,50 +191,218 @@ class MPRouteAdder:
 
 
 class MPStatMonitor:
+    """
+    Class: MPStatMonitor
+    Purpose: Polls the port counters of a set of switches on a fixed-rate schedule.
+    The switches are polled concurrently over the shared session pool and each sample
+    is written to a preallocated ring buffer holding the most recent history_length 
+    samples. Along with the counters, each sample records the time at which it was 
+    scheduled, the time the responses were received and the port durations reported
+    by the switches, so that drift and missed deadlines can be reported.
+
+    The port stats replies of the controller's REST API carry no timestamp, so the time
+    at which the counters were read is approximated by the port durations, which are
+    read from the switch along with the counters. Subtracting the durations of two
+    samples of a port gives the time between the counter reads on the switch's clock,
+    free of the controller and REST latency included in sample_times.
+    """
+
+    HISTORY_LENGTH          = 8640
+    MAX_PARALLEL_REQUESTS   = 16
 
     def __init__( self
                 , controller_ip
                 , controller_port
                 , mon_dpids
-                , mon_period=10.0 ):
+                , mon_period=10.0
+                , history_length=HISTORY_LENGTH
+                , max_parallel=MAX_PARALLEL_REQUESTS
+                , session_pool=None ):
         self._controller_ip = controller_ip
         self._controller_port = controller_port
-        self._rx_stats_list = defaultdict(list)
-        self._tx_stats_list = defaultdict(list)
         self._mon_period = mon_period
+        self._mon_dpids = list(mon_dpids)
+        self._history_length = history_length
+        self._max_parallel = max(1, min(max_parallel, len(self._mon_dpids)))
+        self._session_pool = session_pool or of.get_session_pool()
         self._stop_event = thread.Event()
-        self._mon_dpids = mon_dpids
-        self._update_stat_lists()
+        self._lock = thread.Lock()
+        self._poll_thread = None
+        self._executor = None
+
+        self._port_index = {}
+        self._port_ids = []
+        self._sample_count = 0
+        self._missed_deadlines = 0
+        self._failed_requests = 0
+        self._scheduled_times = np.zeros(history_length, dtype=np.float64)
+        self._sample_times = np.zeros(history_length, dtype=np.float64)
+        self._allocate_port_columns(0)
+
+        with ThreadPoolExecutor(max_workers=self._max_parallel) as executor:
+            self._executor = executor
+            self._update_stat_lists(time.monotonic())
+        self._executor = None
+
+    def _allocate_port_columns(self, port_count):
+        """
+        Grow the ring buffer to hold port_count ports, preserving existing samples.
+        """
+        def grow(arr, fill_value):
+            if arr is None:
+                return np.full((self._history_length, port_count), fill_value, dtype=type(fill_value))
+            extra_cols = port_count - arr.shape[1]
+            return np.pad(arr, ((0, 0), (0, extra_cols)), constant_values=fill_value)
+
+        self._rx_packets = grow(getattr(self, '_rx_packets', None), np.int64(0))
+        self._tx_packets = grow(getattr(self, '_tx_packets', None), np.int64(0))
+        self._port_durations = grow(getattr(self, '_port_durations', None), np.float64(np.nan))
+        self._valid = grow(getattr(self, '_valid', None), np.bool_(False))
 
     def _request_port_stats(self, dpid):
         req = of.GetPortStats(dpid, self._controller_ip, self._controller_port)
+        req.session_pool = self._session_pool
         resp = req.get_response()
         tx_pkts = resp.get_tx_packets()
         rx_pkts = resp.get_rx_packets()
-        return (rx_pkts, tx_pkts)
+        durations = resp.get_port_durations()
+        return (rx_pkts, tx_pkts, durations)
+
+    def _update_stat_lists(self, scheduled_time):
+        futures = [(dpid, self._executor.submit(self._request_port_stats, dpid)) 
+                for dpid in self._mon_dpids]
+        responses = []
+        for dpid, future in futures:
+            try:
+                responses.append((dpid, future.result()))
+            except Exception as ex:
+                print('Failed to retrieve port stats for DPID %s: %s' % (str(dpid), str(ex)))
+                self._failed_requests += 1
+        sample_time = time.monotonic()
+
+        with self._lock:
+            new_ports = [(dpid, port_no) for dpid, (rx_pkts, _, _) in responses 
+                    for port_no in rx_pkts if (dpid, port_no) not in self._port_index]
+            for port_id in new_ports:
+                self._port_index[port_id] = len(self._port_ids)
+                self._port_ids.append(port_id)
+            if new_ports:
+                self._allocate_port_columns(len(self._port_ids))
 
-    def _update_stat_lists(self):
-        for dpid in self._mon_dpids:
-            rx_pkts, tx_pkts = self._request_port_stats(dpid)
-            for port_no, count in tx_pkts.items():
-                self._tx_stats_list[(dpid, port_no)].append(count)
-            for port_no, count in rx_pkts.items():
-                self._rx_stats_list[(dpid, port_no)].append(count)
+            slot = self._sample_count % self._history_length
+            self._scheduled_times[slot] = scheduled_time
+            self._sample_times[slot] = sample_time
+            self._valid[slot] = False
+            for dpid, (rx_pkts, tx_pkts, durations) in responses:
+                for port_no, count in rx_pkts.items():
+                    col = self._port_index[(dpid, port_no)]
+                    self._rx_packets[slot, col] = count
+                    self._tx_packets[slot, col] = tx_pkts.get(port_no, 0)
+                    self._port_durations[slot, col] = durations.get(port_no, np.nan)
+                    self._valid[slot, col] = True
+            self._sample_count += 1
 
     def start_monitor(self):
-        thread.Timer(self._mon_period, MPStatMonitor._retrieve_stats, [self]).start()
+        if self._poll_thread is not None:
+            raise ValueError('Monitor is already running.')
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self._max_parallel)
+        self._poll_thread = thread.Thread(target=self._poll_loop, daemon=True)
+        self._poll_thread.start()
 
     def stop_monitor(self):
+        if self._poll_thread is None:
+            raise ValueError('Monitor was not running.')
         self._stop_event.set()
-        while self._stop_event.isSet():
-            pass
+        self._poll_thread.join()
+        self._poll_thread = None
+        self._executor.shutdown()
+        self._executor = None
 
-    def _retrieve_stats(self):
-        self._update_stat_lists()
-        if not self._stop_event.isSet():
-            self.start_monitor()
-        else:
-            self._stop_event.clear()
+    def _poll_loop(self):
+        # Deadlines are fixed multiples of the period from the start time so that the
+        # time spent polling does not accumulate into the sample interval.
+        start_time = time.monotonic()
+        poll_idx = 1
+        while not self._stop_event.wait(max(0.0, 
+                start_time + poll_idx * self._mon_period - time.monotonic())):
+            scheduled_time = start_time + poll_idx * self._mon_period
+            self._update_stat_lists(scheduled_time)
+            poll_idx += 1
+            next_deadline = start_time + poll_idx * self._mon_period
+            now = time.monotonic()
+            if now > next_deadline:
+                # The poll overran one or more deadlines, skip them rather than bursting.
+                missed = int((now - next_deadline) // self._mon_period) + 1
+                self._missed_deadlines += missed
+                poll_idx += missed
+
+    def _get_retained_slots(self, skip_initial=False):
+        """
+        RETURNS
+            The ring buffer slots of the retained samples from oldest to newest. With
+            skip_initial the sample taken in __init__ is left out if it is still retained.
+        """
+        retained_count = min(self._sample_count, self._history_length)
+        first_sample = self._sample_count - retained_count
+        if skip_initial:
+            first_sample = max(first_sample, 1)
+        return [sample_idx % self._history_length 
+                for sample_idx in range(first_sample, self._sample_count)]
+
+    def get_samples(self):
+        """
+        RETURNS
+            A dictionary of the retained samples, ordered from oldest to newest:
+                port_ids        : [(dpid, port_no)] labelling the columns of the arrays
+                scheduled_times : (T,) time.monotonic() at which each poll was due
+                sample_times    : (T,) time.monotonic() once all responses were received
+                rx_packets      : (T x P)
+                tx_packets      : (T x P)
+                port_durations  : (T x P) switch reported port durations, which stand in
+                                  for the time the counters were read
+                valid           : (T x P) False where a request failed
+        """
+        with self._lock:
+            slots = self._get_retained_slots()
+            return { 'port_ids'         : list(self._port_ids)
+                   , 'scheduled_times'  : self._scheduled_times[slots]
+                   , 'sample_times'     : self._sample_times[slots]
+                   , 'rx_packets'       : self._rx_packets[slots]
+                   , 'tx_packets'       : self._tx_packets[slots]
+                   , 'port_durations'   : self._port_durations[slots]
+                   , 'valid'            : self._valid[slots]
+                   }
+
+    def get_timing_stats(self):
+        """
+        RETURNS
+            Statistics describing how closely the poller has kept to its schedule. Drift
+            is the delay between a poll's deadline and the time its responses arrived.
+        """
+        # The sample taken in __init__ has no deadline to compare against. Once the ring
+        # buffer has wrapped it has been overwritten and every retained sample counts.
+        with self._lock:
+            slots = self._get_retained_slots(skip_initial=True)
+            sample_times = self._sample_times[slots]
+            scheduled_times = self._scheduled_times[slots]
+        drift = sample_times - scheduled_times
+        intervals = np.diff(sample_times)
+        return { 'samples'          : self._sample_count
+               , 'missed_deadlines' : self._missed_deadlines
+               , 'failed_requests'  : self._failed_requests
+               , 'mean_drift'       : float(np.mean(drift)) if len(drift) else 0.0
+               , 'max_drift'        : float(np.max(drift)) if len(drift) else 0.0
+               , 'mean_interval'    : float(np.mean(intervals)) if len(intervals) else 0.0
+               , 'period'           : self._mon_period
+               }
 
     def retrieve_results(self):
-        return (self._rx_stats_list, self._tx_stats_list)
+        samples = self.get_samples()
+        rx_stats_list = defaultdict(list)
+        tx_stats_list = defaultdict(list)
+        for col, port_id in enumerate(samples['port_ids']):
+            valid = samples['valid'][:, col]
+            rx_stats_list[port_id] = samples['rx_packets'][valid, col].tolist()
+            tx_stats_list[port_id] = samples['tx_packets'][valid, col].tolist()
+        return (rx_stats_list, tx_stats_list)
@@ -3,46 +3,170 @@ import pprint                   as pp
 import requests                 as req
 import json                     as json
 import urllib.parse             as url
+import time                     as time
+import statistics               as stat
 
 import mp_routing.multipath_orchestrator        as mp
 import mp_routing.file_parsing                  as fp
 import nw_control.params                        as cfg
 
 from collections                    import defaultdict
+from concurrent.futures             import ThreadPoolExecutor
 
 from nw_control.host_mapper         import HostMapper
 from nw_control.stat_monitor        import OnMonitor
+from nw_control.onos_client         import get_onos_client, OnosClient
+
+class FlowInstallStatus:
+    """
+    Class: FlowInstallStatus
+    Purpose: Outcome of installing or uninstalling a single flow as part of a batch.
+    """
+
+    def __init__(self, index, request, token=None, error=None, latency=0.0):
+        self.index = index
+        self.request = request
+        self.token = token
+        self.error = error
+        self.latency = latency
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    def __str__(self):
+        if self.succeeded:
+            outcome = "Token: %s" % str(self.token)
+        else:
+            outcome = "Error: %s" % str(self.error)
+        return "Flow %d, Latency: %.4fs, %s" % (self.index, self.latency, outcome)
+
+class BatchFlowResult:
+    """
+    Class: BatchFlowResult
+    Purpose: Per-flow statuses of a batch install or uninstall, in the order the flows
+    were supplied. The batch is complete once every request has been acknowledged by
+    the controller (or has failed).
+    """
+
+    def __init__(self, statuses, elapsed_time):
+        self.statuses = statuses
+        self.elapsed_time = elapsed_time
+
+    @property
+    def tokens(self):
+        """
+        The token of each flow in input order, None for flows that failed.
+        """
+        return [s.token for s in self.statuses]
+
+    def get_succeeded_tokens(self):
+        return [s.token for s in self.statuses if s.succeeded]
+
+    def get_failures(self):
+        return [s for s in self.statuses if not s.succeeded]
+
+    def all_succeeded(self):
+        return len(self.get_failures()) == 0
+
+    def get_latency_stats(self):
+        latencies = sorted(s.latency for s in self.statuses)
+        if not latencies:
+            return {}
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+        return { "count"        : len(latencies)
+               , "failures"     : len(self.get_failures())
+               , "mean"         : stat.mean(latencies)
+               , "min"          : latencies[0]
+               , "max"          : latencies[-1]
+               , "p50"          : percentile(0.50)
+               , "p95"          : percentile(0.95)
+               , "p99"          : percentile(0.99)
+               , "elapsed"      : self.elapsed_time
+               , "throughput"   : len(latencies) / self.elapsed_time if self.elapsed_time > 0 else 0.0
+               }
+
+    def raise_on_failure(self, operation_name):
+        failures = self.get_failures()
+        if failures:
+            raise ValueError("Failed to %s %d of %d flows. First failure: %s" %
+                    (operation_name, len(failures), len(self.statuses), str(failures[0])))
+
+    def __iter__(self):
+        for status in self.statuses:
+            yield status
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def __str__(self):
+        return ("%d flows in %.3fs, %d failed" % 
+                (len(self.statuses), self.elapsed_time, len(self.get_failures())))
 
 class OnosRouteAdder:
+    """
+    Class: OnosRouteAdder
+    Purpose: Installs and removes the routes of a route provider through the ONOS
+    multipath routing REST API. Requests are sent with onos_client, or the shared
+    OnosClient if none is given. A route adder that is given non-default credentials and
+    no client creates its own OnosClient, which close releases.
+    """
 
     def __init__( self
                 , route_provider
                 , mapper
-                , onos_credentials = ("onos", "rocks")):
+                , onos_credentials = cfg.ONOS_API_CREDENTIALS
+                , onos_client      = None):
         self._route_provider            = route_provider
         self._credentials               = onos_credentials
+        self._owns_client               = (onos_client is None and
+                onos_credentials != cfg.ONOS_API_CREDENTIALS)
+        if onos_client is not None:
+            self._onos_client           = onos_client
+        elif self._owns_client:
+            self._onos_client           = OnosClient(credentials=onos_credentials)
+        else:
+            self._onos_client           = get_onos_client()
         self._mapper                    = mapper
         self._installed_route_tokens    = set()
 
-    def install_routes(self):
+    def close(self):
+        """
+        Close the OnosClient if it was created by this route adder. A shared client or one
+        passed in by the caller is left open.
+        """
+        if self._owns_client:
+            self._onos_client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def install_routes(self, max_parallel=None):
         routes = self._route_provider.flows
-        route_count = 0
         tag_counters    = defaultdict(lambda: 1)
         tag_values      = {}
-        for flow_id, flow in enumerate(routes):
-            self.install_route(flow_id, flow.paths, tag_values, tag_counters, flow)
+        route_jsons = [self._build_route_json(flow_id, flow.paths, tag_values, tag_counters, flow)
+                for flow_id, flow in enumerate(routes)]
+        install_result = install_flows(route_jsons, max_parallel, self._onos_client)
+        self._installed_route_tokens.update(install_result.get_succeeded_tokens())
+        install_result.raise_on_failure("add")
         return tag_values
 
     def remove_route(self, route_token):
-        route_remove_request = req.post(
-                "http://127.0.0.1:8181/onos/multipath-routing/v1/remove-route?route-id=%s" %
-                route_token, auth=self._credentials)
+        route_remove_request = self._onos_client.post(
+                "multipath-routing/v1/remove-route?route-id=%s" % route_token)
 
-    def remove_routes(self):
-        for route_token in self._installed_route_tokens:
-            self.remove_route(route_token)
+    def remove_routes(self, max_parallel=None):
+        remove_result = uninstall_flows(list(self._installed_route_tokens), max_parallel,
+                self._onos_client)
+        self._installed_route_tokens.difference_update(remove_result.get_succeeded_tokens())
+        return remove_result
 
-    def install_route(self, route_id, route, tag_values, tag_counters, flow):
+    def _build_route_json(self, route_id, route, tag_values, tag_counters, flow):
         tag_values[route_id] = []
         paths_dicts = []
         for path in route:
@@ -52,10 +176,13 @@ class OnosRouteAdder:
             tag_values[route_id].append(tag_counters[flow.source_node, flow.destination_node])
             tag_counters[flow.source_node, flow.destination_node] += 1
             paths_dicts.append(path_dict)
+        return { "paths": paths_dicts }
 
-        route_json = json.dumps({ "paths": paths_dicts })
-        route_add_request = req.post("http://127.0.0.1:8181/onos/multipath-routing/v1/add-route",
-                data=route_json, auth=self._credentials)
+    def install_route(self, route_id, route, tag_values, tag_counters, flow):
+        route_json = json.dumps(self._build_route_json(route_id, route, tag_values, 
+            tag_counters, flow))
+        route_add_request = self._onos_client.post("multipath-routing/v1/add-route",
+                data=route_json)
         if route_add_request.status_code == 200:
             add_response = json.loads(route_add_request.text)
             route_token = add_response["routeId"]
@@ -78,9 +205,9 @@ class OnosRouteAdder:
 def build_file_path(route_files_dir, trial_name, seed_no):
     return route_files_dir.joinpath(trial_name).joinpath("seed_%s" % seed_no)
 
-def install_flow(flow_json):
-    request_url = url.urljoin(cfg.onos_url.geturl(), "multipath-routing/v1/add-route")
-    route_add_request = req.post(request_url, json=flow_json, auth=cfg.ONOS_API_CREDENTIALS)
+def install_flow(flow_json, onos_client=None):
+    onos_client = onos_client or get_onos_client()
+    route_add_request = onos_client.post("multipath-routing/v1/add-route", json=flow_json)
     if not route_add_request:
         raise ValueError("Failed to add route. %d %s %s" %
                 (route_add_request.status_code, route_add_request.reason,
@@ -90,14 +217,80 @@ def install_flow(flow_json):
     route_token = json_response["routeId"]
     return route_token
 
-def uninstall_flow(flow_token):
-    request_url = url.urljoin(cfg.onos_url.geturl(),
+def uninstall_flow(flow_token, onos_client=None):
+    onos_client = onos_client or get_onos_client()
+    route_remove_request = onos_client.post(
             "multipath-routing/v1/remove-route?route-id=%s" % flow_token)
-    route_remove_request = req.post(request_url, auth=cfg.ONOS_API_CREDENTIALS)
     if not route_remove_request:
         raise ValueError("Failed to remove route. %d %s %s" %
                 (route_remove_request.status_code, route_remove_request.reason,
                     route_remove_request.text))
+    return flow_token
+
+def _run_flow_batch(flow_fn, requests, max_parallel, onos_client):
+    onos_client = onos_client or get_onos_client()
+    def timed_request(index, request):
+        start_time = time.perf_counter()
+        try:
+            token = flow_fn(request, onos_client)
+            return FlowInstallStatus(index, request, token=token,
+                    latency=time.perf_counter() - start_time)
+        except (ValueError, KeyError, req.exceptions.RequestException) as ex:
+            return FlowInstallStatus(index, request, error=ex,
+                    latency=time.perf_counter() - start_time)
+
+    requests = list(requests)
+    start_time = time.perf_counter()
+    if max_parallel is None:
+        statuses = onos_client.map_concurrently(timed_request, range(len(requests)), requests)
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+            statuses = list(executor.map(timed_request, range(len(requests)), requests))
+    return BatchFlowResult(statuses, time.perf_counter() - start_time)
+
+def install_flows(flow_jsons, max_parallel=None, onos_client=None):
+    """
+    Install each of flow_jsons with at most max_parallel requests in flight (the
+    concurrency of the OnosClient if not specified). Returns once the controller has
+    acknowledged every flow.
+
+    RETURNS
+        A BatchFlowResult whose tokens are in the same order as flow_jsons.
+    """
+    return _run_flow_batch(install_flow, flow_jsons, max_parallel, onos_client)
+
+def uninstall_flows(flow_tokens, max_parallel=None, onos_client=None):
+    """
+    Remove each of the flows identified by flow_tokens with at most max_parallel requests
+    in flight.
+
+    RETURNS
+        A BatchFlowResult in the same order as flow_tokens.
+    """
+    return _run_flow_batch(uninstall_flow, flow_tokens, max_parallel, onos_client)
+
+def install_all_flows(flow_jsons, flow_tokens, onos_client=None):
+    """
+    Install each of flow_jsons, adding the token of every flow that was installed to
+    flow_tokens so that they can be removed even if some of the flows failed.
+
+    RETURNS
+        The token of each flow in the same order as flow_jsons.
+    """
+    install_result = install_flows(flow_jsons, onos_client=onos_client)
+    flow_tokens.update(install_result.get_succeeded_tokens())
+    install_result.raise_on_failure("add")
+    return install_result.tokens
+
+def remove_all_flows(flow_tokens, onos_client=None):
+    """
+    Remove each of the flows identified by flow_tokens, printing the flows that could not
+    be removed.
+    """
+    remove_result = uninstall_flows(flow_tokens, onos_client=onos_client)
+    for failure in remove_result.get_failures():
+        print("Failed to remove flow with token %s." % failure.request)
+        print(failure.error)
 
 def main():
     seed_no = "4065"
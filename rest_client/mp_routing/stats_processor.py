@@ -26,11 +26,18 @@ class StatsProcessor:
         self._of_proc = of_proc
         self.base_path = base_path
 
+    def invalidate_topology(self):
+        """
+        Discard the cached topology so that the next port classification
+        requests a fresh snapshot from the controller. Should be called whenever
+        the topology changes between trials.
+        """
+        self._of_proc.invalidate_topo_cache()
+
     def _get_link(self, src_dpid, port_no):
-        topo = self._of_proc.get_topo_links().get_adj_mat()
-        next_hop = list(filter(lambda t : t[1] == port_no, topo[src_dpid].items()))
-        if next_hop:
-            return (src_dpid, next_hop[0][0])
+        next_hop = self._of_proc.get_topo_cache().get_neighbour(src_dpid, port_no)
+        if next_hop is not None:
+            return (src_dpid, next_hop)
         else:
             raise ValueError('Port %d on %d is not in the core of the network'
                 % (port_no, src_dpid))
@@ -184,42 +191,54 @@ class StatsProcessor:
         src_host, dst_host = int(toks[0].split('_')[1]), int(toks[1])
         return (src_host, dst_host)
 
+    def _fix_dst_ip(self, dst_ip):
+        octets = dst_ip.split('.')
+        if octets[1] == '0' and octets[2] == '168' and octets[3] == '192':
+            dst_ip = octets[3] + '.' + octets[2] + '.' + octets[1] + '.' + octets[0]
+        return dst_ip
+
     def _mk_tx_dict(self, tx_files):
         tx_dict = defaultdict(lambda : defaultdict(dict))
+        flow_dicts = []
         for f in tx_files:
             with open(f, 'rb') as fd:
-                flow_dict = pick.load(fd)
-                for flow_id, flow_info in flow_dict.items():
-                    src_host = flow_info['src_host']
-                    dst_ip = flow_info['dst_ip']
-                    src_port = flow_info['src_port']
-                    str = dst_ip.split('.')
-                    if str[1] == '0' and str[2] == '168' and str[3] == '192':
-                     dst_ip = str[3] + '.' + str[2] + '.' + str[1] + '.' + str[0]
-                    dst_hname = self._mapper.reverse_lookup(dst_ip)
-                    tok_list = dst_hname.split('.')
-                    if tok_list[2] == '168':
-                        dst_hname = tok_list[0] + '.of.cpsc.'
-                    src_hname = self._mapper.qualify_host_domain(self._mapper.map_sw_to_host(src_host))
-                    tx_dict[src_hname][dst_hname][src_port] = flow_info['pkt_count']
-                    print('stats_processor-> _mk_tx_dict: tx[src=%s][dst=%s][src_port=%s] = pkt_count:%d'%(src_hname,dst_hname,src_port,flow_info['pkt_count']))
+                flow_dicts.append(pick.load(fd))
+        # Resolve every destination up front so the lookups below hit the DNS cache.
+        self._mapper.reverse_many([self._fix_dst_ip(flow_info['dst_ip'])
+            for flow_dict in flow_dicts for flow_info in flow_dict.values()])
+        for flow_dict in flow_dicts:
+            for flow_id, flow_info in flow_dict.items():
+                src_host = flow_info['src_host']
+                src_port = flow_info['src_port']
+                dst_ip = self._fix_dst_ip(flow_info['dst_ip'])
+                dst_hname = self._mapper.reverse_lookup(dst_ip)
+                tok_list = dst_hname.split('.')
+                if tok_list[2] == '168':
+                    dst_hname = tok_list[0] + '.of.cpsc.'
+                src_hname = self._mapper.qualify_host_domain(self._mapper.map_sw_to_host(src_host))
+                tx_dict[src_hname][dst_hname][src_port] = flow_info['pkt_count']
+                print('stats_processor-> _mk_tx_dict: tx[src=%s][dst=%s][src_port=%s] = pkt_count:%d'%(src_hname,dst_hname,src_port,flow_info['pkt_count']))
         return tx_dict
 
     def _mk_rx_dict(self, rx_files):
         rx_dict = defaultdict(lambda : defaultdict(dict))
+        rx_infos = []
         for f in rx_files:
             with open(f, 'rb') as fd:
-                infos = pick.load(fd)
-                for (src_ip, src_port), pkt_count in infos.items():
-                    base, _ = os_path.splitext(os_path.basename(f))
-                    rx_er = base.split('_')[1]
-                    rx_host = self._mapper.qualify_host_domain(self._mapper.map_sw_to_host(rx_er))
-                    hostname = self._mapper.reverse_lookup(src_ip)
-                    tok_list = hostname.split('.')
-                    if tok_list[2] == '168':
-                        hostname = tok_list[0] + '.of.cpsc.'
-                    rx_dict[rx_host][hostname][src_port] = pkt_count
-                    print('stats_processor-> _mk_rx_dict: rx[rx_host=%s][hostname=%s][src_port=%s] = pkt_count:%d'%(rx_host,hostname,src_port,pkt_count))
+                rx_infos.append((f, pick.load(fd)))
+        # Resolve every source up front so the lookups below hit the DNS cache.
+        self._mapper.reverse_many([src_ip for _, infos in rx_infos for (src_ip, _) in infos.keys()])
+        for f, infos in rx_infos:
+            for (src_ip, src_port), pkt_count in infos.items():
+                base, _ = os_path.splitext(os_path.basename(f))
+                rx_er = base.split('_')[1]
+                rx_host = self._mapper.qualify_host_domain(self._mapper.map_sw_to_host(rx_er))
+                hostname = self._mapper.reverse_lookup(src_ip)
+                tok_list = hostname.split('.')
+                if tok_list[2] == '168':
+                    hostname = tok_list[0] + '.of.cpsc.'
+                rx_dict[rx_host][hostname][src_port] = pkt_count
+                print('stats_processor-> _mk_rx_dict: rx[rx_host=%s][hostname=%s][src_port=%s] = pkt_count:%d'%(rx_host,hostname,src_port,pkt_count))
         return rx_dict
     
     def calc_pkt_loss(self, tx_pkts, rx_pkts):
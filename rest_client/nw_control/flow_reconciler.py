@@ -0,0 +1,222 @@
+import time                 as time
+
+import nw_control.flowmod   as fm
+
+from collections            import Counter, defaultdict
+
+# Ryu reports the match fields of installed flows using the OpenFlow 1.0 names.
+OF10_MATCH_FIELD_NAMES = { "dl_type"    : "eth_type"
+                         , "dl_src"     : "eth_src"
+                         , "dl_dst"     : "eth_dst"
+                         , "dl_vlan"    : "vlan_vid"
+                         , "nw_src"     : "ipv4_src"
+                         , "nw_dst"     : "ipv4_dst"
+                         , "nw_proto"   : "ip_proto"
+                         }
+
+# Ryu reports reserved port numbers by name in OUTPUT actions.
+RESERVED_PORT_NUMBERS = { "IN_PORT"     : 0xfffffff8
+                        , "TABLE"       : 0xfffffff9
+                        , "NORMAL"      : 0xfffffffa
+                        , "FLOOD"       : 0xfffffffb
+                        , "ALL"         : 0xfffffffc
+                        , "CONTROLLER"  : 0xfffffffd
+                        , "LOCAL"       : 0xfffffffe
+                        , "ANY"         : 0xffffffff
+                        }
+
+def _canonicalize_value(value):
+    if isinstance(value, str):
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        for exact_mask in ["/255.255.255.255", "/32"]:
+            if value.endswith(exact_mask):
+                return value[:-len(exact_mask)]
+    return value
+
+def canonicalize_match(match):
+    """
+    Map a match dictionary, either from Flowmod.get_json or as reported by the
+    controller for an installed flow, onto a hashable canonical form using the
+    OpenFlow 1.3 field names.
+    """
+    canonical_match = {}
+    for field_name, field_value in match.items():
+        canonical_match[OF10_MATCH_FIELD_NAMES.get(field_name, field_name)] = (
+                _canonicalize_value(field_value))
+    # tp_src/tp_dst are shared by TCP and UDP in the OpenFlow 1.0 names.
+    l4_proto = {fm.IPProto.TCP.value: "tcp", fm.IPProto.UDP.value: "udp"}.get(
+            canonical_match.get("ip_proto"))
+    for tp_field in ["tp_src", "tp_dst"]:
+        if tp_field in canonical_match and l4_proto != None:
+            canonical_match["%s_%s" % (l4_proto, tp_field[3:])] = canonical_match.pop(tp_field)
+    return frozenset(canonical_match.items())
+
+def _canonicalize_action(action):
+    if isinstance(action, dict):
+        action_type = action.get("type")
+        if action_type == "OUTPUT":
+            return ("OUTPUT", _canonicalize_value(str(action["port"])))
+        elif action_type == "GOTO_TABLE":
+            return ("GOTO_TABLE", _canonicalize_value(str(action["table_id"])))
+        elif action_type == "SET_FIELD":
+            return ("SET_FIELD", "%s:%s" % (action["field"], action["value"]))
+        return (action_type, tuple(sorted((k, str(v)) for k, v in action.items() if k != "type")))
+
+    # Installed flows report their actions as strings such as "OUTPUT:2",
+    # "GOTO_TABLE:100" or "SET_FIELD: {ip_dscp:3}"
+    action_type, _, action_arg = str(action).partition(":")
+    action_arg = action_arg.strip().strip("{}").replace(" ", "")
+    if action_type == "OUTPUT":
+        return ("OUTPUT", RESERVED_PORT_NUMBERS.get(action_arg, _canonicalize_value(action_arg)))
+    return (action_type, _canonicalize_value(action_arg))
+
+def canonicalize_actions(actions):
+    return tuple(_canonicalize_action(action) for action in actions)
+
+def compute_flow_key(flow_json):
+    """
+    Compute the identity of a flow from its JSON representation, i.e. the output of
+    Flowmod.get_json or one of the flows returned by OFResponseSwitchFlows.get_flows.
+    Two flows with the same key have the same effect on the switch. The cookie is not
+    part of the key.
+    """
+    return ( flow_json.get("table_id", 0)
+           , flow_json.get("priority", 0)
+           , flow_json.get("idle_timeout", 0)
+           , flow_json.get("hard_timeout", 0)
+           , canonicalize_match(flow_json.get("match", {}))
+           , canonicalize_actions(flow_json.get("actions", []))
+           )
+
+class ReconcileResult:
+    """
+    Class: ReconcileResult
+    Purpose: Summarizes the operations that were needed to move the flow tables of a
+    set of switches from their installed state to the desired state.
+    """
+
+    def __init__( self
+                , added
+                , deleted
+                , unchanged_count
+                , add_result        = None
+                , delete_result     = None
+                , elapsed_time      = 0.0 ):
+        self.added              = added
+        self.deleted            = deleted
+        self.unchanged_count    = unchanged_count
+        self.add_result         = add_result
+        self.delete_result      = delete_result
+        self.elapsed_time       = elapsed_time
+
+    def get_operation_count(self):
+        return len(self.added) + len(self.deleted)
+
+    def get_avoided_operation_count(self):
+        """
+        The number of requests saved compared to removing every installed flow and
+        then installing every desired flow.
+        """
+        return 2 * self.unchanged_count
+
+    def get_failures(self):
+        failures = []
+        for bulk_result in [self.delete_result, self.add_result]:
+            if bulk_result != None:
+                failures.extend(bulk_result.get_failures())
+        return failures
+
+    def all_succeeded(self):
+        return len(self.get_failures()) == 0
+
+    def __str__(self):
+        return ('Reconciled flows in %.3fs: %d added, %d deleted, %d unchanged '
+                '(%d operations avoided, %d failed)' %
+                (self.elapsed_time, len(self.added), len(self.deleted), self.unchanged_count,
+                    self.get_avoided_operation_count(), len(self.get_failures())))
+
+class FlowReconciler:
+    """
+    Class: FlowReconciler
+    Purpose: Brings the flow tables of a set of switches to a desired state by pushing
+    only the flows that are missing and deleting only the flows that are no longer
+    wanted. Only flows whose cookie matches cookie under cookie_mask are considered to
+    be managed by the reconciler; every other flow is left alone.
+    """
+
+    def __init__(self, of_proc, cookie, cookie_mask=fm.Flowmod.COOKIE_MASK_ALL):
+        self._of_proc       = of_proc
+        self._cookie        = cookie
+        self._cookie_mask   = cookie_mask
+
+    def get_installed_flows(self, dpids):
+        return self._of_proc.get_flows_by_cookie(dpids, self._cookie, self._cookie_mask)
+
+    def _build_delete_flow_mod(self, dpid, flow_json):
+        delete_flow_mod = fm.Flowmod( dpid
+                                    , cookie        = flow_json.get("cookie", self._cookie)
+                                    , cookie_mask   = fm.Flowmod.COOKIE_MASK_ALL
+                                    , table_id      = flow_json.get("table_id", 0)
+                                    , priority      = flow_json.get("priority", 0)
+                                    )
+        delete_flow_mod.match = dict(canonicalize_match(flow_json.get("match", {})))
+        return delete_flow_mod
+
+    def diff(self, desired_flow_mods, installed_flows):
+        """
+        desired_flow_mods: [(dpid, Flowmod)]
+        installed_flows: dpid -> [flow] as returned by get_installed_flows
+
+        RETURNS
+            (to_add, to_delete, unchanged_count) where to_add and to_delete are lists of
+            (dpid, Flowmod) pairs.
+        """
+        desired_by_switch = defaultdict(lambda: defaultdict(list))
+        for dpid, flow_mod in desired_flow_mods:
+            desired_by_switch[dpid][compute_flow_key(flow_mod.get_json())].append(flow_mod)
+
+        to_add, to_delete = [], []
+        unchanged_count = 0
+        for dpid in set(desired_by_switch.keys()) | set(installed_flows.keys()):
+            desired_flows = desired_by_switch.get(dpid, {})
+            installed_keys = Counter()
+            installed_by_key = defaultdict(list)
+            for flow_json in installed_flows.get(dpid, []):
+                flow_key = compute_flow_key(flow_json)
+                installed_keys[flow_key] += 1
+                installed_by_key[flow_key].append(flow_json)
+
+            for flow_key, flow_mods in desired_flows.items():
+                kept_count = min(len(flow_mods), installed_keys[flow_key])
+                unchanged_count += kept_count
+                to_add.extend((dpid, flow_mod) for flow_mod in flow_mods[kept_count:])
+            for flow_key, flows in installed_by_key.items():
+                # Strict deletes remove every copy of a flow, so a flow that is still
+                # wanted is never deleted even if it is installed more than once.
+                if flow_key not in desired_flows:
+                    to_delete.append((dpid, self._build_delete_flow_mod(dpid, flows[0])))
+        return to_add, to_delete, unchanged_count
+
+    def reconcile(self, desired_flow_mods, dpids=None):
+        """
+        Reconcile the flow tables of dpids against desired_flow_mods. If dpids is not
+        specified every switch connected to the controller is reconciled.
+
+        RETURNS
+            A ReconcileResult
+        """
+        start_time = time.perf_counter()
+        desired_flow_mods = list(desired_flow_mods)
+        if dpids is None:
+            dpids = self._of_proc.get_switch_list()
+        dpids = set(dpids) | {dpid for dpid, _ in desired_flow_mods}
+        installed_flows = self.get_installed_flows(dpids)
+        to_add, to_delete, unchanged_count = self.diff(desired_flow_mods, installed_flows)
+        # Delete first so that a flow being replaced never coexists with its replacement.
+        delete_result = (self._of_proc.remove_flow_mods(to_delete, strict=True)
+                if to_delete else None)
+        add_result = self._of_proc.push_flow_mods(to_add) if to_add else None
+        return ReconcileResult(to_add, to_delete, unchanged_count, add_result, delete_result,
+                time.perf_counter() - start_time)
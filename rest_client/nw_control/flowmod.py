@@ -14,6 +14,10 @@ class Flowmod:
     messages. 
     """
 
+    COOKIE_MASK_ALL = 0xFFFFFFFFFFFFFFFF
+    # OFPTT_ALL, matches every flow table in a delete.
+    TABLE_ID_ALL = 0xFF
+
     def __init__( self
                 , dpid
                 , cookie = None
@@ -42,19 +46,19 @@ class Flowmod:
     
     def add_action(self, action):
         d = action.get_dict()
-        self.actions = self.actions + [d]
+        self.actions.append(d)
 
     def get_json(self):
         d = {}
         d['dpid'] = self.dpid
-        d = set_field(d, 'dpid', self.dpid)
-        d = set_field(d, 'cookie', self.cookie)
-        d = set_field(d, 'cookie_mask', self.cookie_mask)
-        d = set_field(d, 'table_id', self.table_id)
-        d = set_field(d, 'idle_timeout', self.idle_timeout)
-        d = set_field(d, 'hard_timeout', self.hard_timeout)
-        d = set_field(d, 'priority', self.priority)
-        d = set_field(d, 'flags', self.flags)
+        d = util.set_field(d, 'dpid', self.dpid)
+        d = util.set_field(d, 'cookie', self.cookie)
+        d = util.set_field(d, 'cookie_mask', self.cookie_mask)
+        d = util.set_field(d, 'table_id', self.table_id)
+        d = util.set_field(d, 'idle_timeout', self.idle_timeout)
+        d = util.set_field(d, 'hard_timeout', self.hard_timeout)
+        d = util.set_field(d, 'priority', self.priority)
+        d = util.set_field(d, 'flags', self.flags)
 
         d['match'] = self.match
         d['actions'] = self.actions
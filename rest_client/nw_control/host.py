@@ -175,6 +175,28 @@ class TrafficGenHost(Host):
 
         return modified_receiver_results, dict(sender_results)
 
+    def retrieve_receiver_stats(self):
+        """
+        RETURNS
+            The kernel drop counts and per-flow metrics that traffic_server writes next to
+            its receiver file, in the format of MininetHost.get_receiver_stats, or None if
+            the server did not write them.
+        """
+        host_string = "alexj@%s:%s" % (self.host_ip, TrafficGenHost.COUNT_DIR)
+        stats_file = "receiver_%d-stats.p" % self.host_id
+        stats_file_path = TrafficGenHost.TMP_OUTPUT_DIRECTORY / stats_file
+        # Don't pick up the file of an earlier trial if the copy fails.
+        if stats_file_path.exists():
+            stats_file_path.unlink()
+        scp_cmd = "sshpass -pcpsc scp %s/%s %s" % (host_string, stats_file,
+                TrafficGenHost.TMP_OUTPUT_DIRECTORY)
+        subprocess.run(scp_cmd.split(" "))
+
+        if not stats_file_path.exists():
+            return None
+        with stats_file_path.open("rb") as fd:
+            return pickle.load(fd)
+
     # This isn't going to work in mininet.
     def get_local_ip(self):
         mapper = hm.HostMapper([cfg.man_net_dns_ip], cfg.of_controller_ip,
@@ -1,4 +1,8 @@
 import pprint               as pp
+import json                 as json
+import pathlib              as path
+import threading            as thread
+import time                 as time
 
 import dns.resolver         as dns
 import dns.reversename      as rev_name
@@ -8,56 +12,209 @@ from . import util
 from . import of_rest_client    as of
 from . import topo_mapper       as topo_mapper
 
+from concurrent.futures     import ThreadPoolExecutor
+
+class SwitchIndex:
+    """
+    Bidirectional index between switch DPIDs, switch names (of the form of_<sw_no>)
+    and switch numbers. DPIDs are stored as integers.
+    """
+    def __init__(self):
+        self._dpid_to_name  = {}
+        self._name_to_dpid  = {}
+        self._num_to_dpid   = {}
+
+    def add_switch(self, dpid, sw_name):
+        dpid = int(dpid)
+        self._dpid_to_name[dpid] = sw_name
+        self._name_to_dpid[sw_name] = dpid
+        try:
+            self._num_to_dpid[util.sw_name_to_no(sw_name)] = dpid
+        except IndexError:
+            pass
+
+    def has_dpid(self, dpid):
+        return int(dpid) in self._dpid_to_name
+
+    def get_name(self, dpid):
+        return self._dpid_to_name.get(int(dpid))
+
+    def get_dpid_for_name(self, sw_name):
+        return self._name_to_dpid.get(sw_name)
+
+    def get_dpid_for_num(self, sw_no):
+        return self._num_to_dpid.get(str(sw_no))
+
+    def write(self, file_path):
+        file_path.write_text(json.dumps({str(k): v for k, v in self._dpid_to_name.items()}))
+
+    @staticmethod
+    def read(file_path):
+        index = SwitchIndex()
+        for dpid, sw_name in util.read_json_from_file(file_path).items():
+            index.add_switch(dpid, sw_name)
+        return index
+
+    def __len__(self):
+        return len(self._dpid_to_name)
+
+class DnsCache:
+    """
+    Thread-safe cache of DNS answers. Entries expire once the TTL of the record
+    they were built from has elapsed.
+    """
+    def __init__(self):
+        self._entries   = {}
+        self._lock      = thread.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expiry = entry
+            if time.monotonic() >= expiry:
+                del self._entries[key]
+                return None
+            return value
+
+    def put(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+# Shared by every HostMapper so that short lived mappers still benefit from caching.
+dns_cache = DnsCache()
+
 class HostMapper:
-    def __init__(self, nameservers, host, port_no, domain='data.sdn.'):
+    # Maximum number of concurrent SwitchDesc/DNS requests for batched lookups.
+    MAX_PARALLEL_REQUESTS = 16
+
+    def __init__(self, nameservers, host, port_no, domain='data.sdn.', index_path=None):
         self.nameservers = nameservers
         self.host = host
         self.port_no = port_no
         self.domain = domain
+        # If index_path is set the switch index is loaded from and saved to that file.
+        self.index_path = path.Path(index_path) if index_path else None
+        self._index_lock = thread.Lock()
+        if self.index_path and self.index_path.exists():
+            self._sw_index = SwitchIndex.read(self.index_path)
+        else:
+            self._sw_index = SwitchIndex()
+
+    def refresh_switch_index(self):
+        """
+        Add any switches reported by the controller that are not already in the
+        switch index. Descriptions of the new switches are requested concurrently.
+        """
+        def request_sw_name(dpid):
+            req = of.SwitchDesc(str(dpid), self.host, self.port_no)
+            return dpid, req.get_response().get_sw_name()
+
+        with self._index_lock:
+            switch_list = of.SwitchList(self.host, self.port_no).get_response().get_sw_list()
+            new_dpids = [dpid for dpid in switch_list if not self._sw_index.has_dpid(dpid)]
+            if len(new_dpids) == 0:
+                return 0
+            worker_count = min(len(new_dpids), HostMapper.MAX_PARALLEL_REQUESTS)
+            with ThreadPoolExecutor(max_workers=worker_count) as executor:
+                for dpid, sw_name in executor.map(request_sw_name, new_dpids):
+                    self._sw_index.add_switch(dpid, sw_name)
+            if self.index_path:
+                self._sw_index.write(self.index_path)
+            return len(new_dpids)
+
+    def clear_switch_index(self):
+        with self._index_lock:
+            self._sw_index = SwitchIndex()
+            if self.index_path and self.index_path.exists():
+                self.index_path.unlink()
 
     def map_sw_to_host(self, sw_no):
         host_str = 'host%d' % int(sw_no)
         return host_str
 
+    def _get_resolver(self):
+        resolver = dns.Resolver(configure=False)
+        resolver.nameservers = list(self.nameservers)
+        return resolver
+
+    def _cached_query(self, query_str, record_type, answer_fn):
+        cache_key = (tuple(self.nameservers), record_type, str(query_str))
+        cached_answer = dns_cache.get(cache_key)
+        if cached_answer is not None:
+            return cached_answer
+
+        answers = self._get_resolver().query(query_str, record_type)
+        if not answers:
+            return None
+        answer = answer_fn(answers)
+        dns_cache.put(cache_key, answer, answers.rrset.ttl)
+        return answer
+
     def resolve_hostname(self, hostname):
-        resolver = dns.Resolver()
-        resolver.nameservers = self.nameservers
-        
         query_str = self.qualify_host_domain(hostname)
         try:
-            answers = resolver.query(query_str, 'A')
+            return self._cached_query(query_str, 'A', lambda answers: answers[0].address)
         except Exception as ex:
             raise IOError('Failed to resolve hostname: %s. Exception: %s' % 
                     (query_str, str(ex)))
 
-        if answers:
-            return answers[0].address
-        else: 
-            return None 
+    def resolve_many(self, hostnames):
+        """
+        Resolve a collection of hostnames concurrently.
+
+        RETURNS
+            hostname -> ip_address
+        """
+        return self._lookup_many(self.resolve_hostname, hostnames)
 
     def get_ip_address_for_host_number(self, host_number):
         hostname = self.map_sw_to_host(host_number)
         return self.resolve_hostname(hostname)
     
     def reverse_lookup(self, ip_addr):
-        dns_resolver = dns.Resolver()
-        dns_resolver.nameservers = self.nameservers
         name = rev_name.dns.reversename.from_address(ip_addr)
         try:
-            answers = dns_resolver.query(name, 'PTR')
+            return self._cached_query(name, 'PTR', lambda answers: str(answers[0]))
         except dns.NXDOMAIN:
             raise IOError('Failed to resolve IP: %s' % name)
         except Exception:
             raise IOError('Failed to resolve IP: %s' % name)
-        if answers:
-            return str(answers[0])
-        else:
-            return None
+
+    def reverse_many(self, ip_addrs):
+        """
+        Run reverse lookups for a collection of IP addresses concurrently.
+
+        RETURNS
+            ip_address -> hostname
+        """
+        return self._lookup_many(self.reverse_lookup, ip_addrs)
+
+    def _lookup_many(self, lookup_fn, keys):
+        unique_keys = list(set(keys))
+        if len(unique_keys) == 0:
+            return {}
+        worker_count = min(len(unique_keys), HostMapper.MAX_PARALLEL_REQUESTS)
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            return dict(zip(unique_keys, executor.map(lookup_fn, unique_keys)))
 
     def map_dpid_to_sw(self, dpid):
-        req = of.SwitchDesc(dpid, self.host, self.port_no)
-        resp = req.get_response()
-        return resp.get_sw_name()
+        if not self._sw_index.has_dpid(dpid):
+            self.refresh_switch_index()
+        if not self._sw_index.has_dpid(dpid):
+            # Not a switch the controller lists, ask for it directly.
+            req = of.SwitchDesc(dpid, self.host, self.port_no)
+            resp = req.get_response()
+            return resp.get_sw_name()
+        return self._sw_index.get_name(dpid)
 
     def map_dpid_to_sw_num(self, dpid):
         sw_name = self.map_dpid_to_sw(dpid)
@@ -65,16 +222,13 @@ class HostMapper:
         return int(num)
 
     def map_sw_to_dpid(self, sw_no):
-        sw_no = str(sw_no)
-        switch_list = of.SwitchList(self.host, 
-            self.port_no).get_response().get_sw_list()
-        for sw in switch_list:
-            req = of.SwitchDesc(str(sw), self.host, self.port_no)
-            resp = req.get_response()
-            curr_no = util.sw_name_to_no(resp.get_sw_name())
-            if curr_no == sw_no:
-                return resp.get_sw_dpid()
-        return None
+        dpid = self._sw_index.get_dpid_for_num(sw_no)
+        if dpid is None:
+            self.refresh_switch_index()
+            dpid = self._sw_index.get_dpid_for_num(sw_no)
+        if dpid is None:
+            return None
+        return str(dpid)
 
     def qualify_host_domain(self, hostname):
         if hostname[-1] == '.':
@@ -101,6 +101,11 @@ class MininetHost(Host):
     TRAFFIC_GEN_ROOT_DIR = path.Path("/home/alexj/repos/cpsc_of_testbed/traffic_generation/")
     TRAFFIC_SERVER_BIN_PATH = TRAFFIC_GEN_ROOT_DIR / "traffic_server.py"
     TRAFFIC_GEN_BIN_PATH = TRAFFIC_GEN_ROOT_DIR / "traffic_gen.py"
+    LIVE_COUNTERS_BIN_PATH = TRAFFIC_GEN_ROOT_DIR / "live_counters.py"
+    # Number of processes traffic_gen spreads the configured flows over.
+    TRAFFIC_GEN_WORKER_COUNT = 2
+    # Number of processes traffic_server receives on, each with its own SO_REUSEPORT socket.
+    TRAFFIC_SERVER_WORKER_COUNT = 1
 
     def __init__(self, host_ip, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -109,9 +114,18 @@ class MininetHost(Host):
         self.client_procs = []
         self.configured_flows = []
 
-    def start_traffic_generation_server(self):
-        self.server_proc = self.run_async(
-                f"{str(MininetHost.TRAFFIC_SERVER_BIN_PATH)} -host {self.host_id} -source_addr {self.host_ip}")
+    def start_traffic_generation_server(self, worker_count=None, track_flows=False):
+        """
+        Start traffic_server on this host. With track_flows the server also measures the
+        loss, reordering, latency and jitter of each flow for get_receiver_stats, at a
+        large cost in receive throughput.
+        """
+        worker_count = worker_count or MininetHost.TRAFFIC_SERVER_WORKER_COUNT
+        self.remove_live_counters("receiver")
+        server_args = f"{str(MininetHost.TRAFFIC_SERVER_BIN_PATH)} -host {self.host_id} -source_addr {self.host_ip} -workers {worker_count}"
+        if track_flows:
+            server_args += " -flow_metrics"
+        self.server_proc = self.run_async(server_args)
 
     def stop_traffic_generation_server(self):
         if self.server_proc:
@@ -164,7 +178,7 @@ class MininetHost(Host):
                       }
         self.configured_flows.append(client_args)
 
-    def start_traffic_generation_client(self):
+    def start_traffic_generation_client(self, worker_count=None):
         if len(self.configured_flows) == 0:
             return
         
@@ -174,16 +188,15 @@ class MininetHost(Host):
         # args_file_path.write_text(json.dumps(self.configured_flows))
         # self.put_file(str(args_file_path), str(args_file_path))
         # self.client_proc = self.run_async(args)
-        flow_count = len(self.configured_flows) // 2
-        flow_groups = []
-        flow_groups.append(self.configured_flows[:flow_count])
-        flow_groups.append(self.configured_flows[flow_count:])
-        for flow_idx, flow_group in enumerate(flow_groups):
-            args_file_path = path.Path(f"/tmp/host-{self.host_id}-instance-{flow_idx}-traffic-gen-args.json")
-            args = f"{str(MininetHost.TRAFFIC_GEN_BIN_PATH)} {str(args_file_path)}"
-            args_file_path.write_text(json.dumps(flow_group))
-            self.put_file(str(args_file_path), str(args_file_path))
-            self.client_procs.append(self.run_async(args))
+        # traffic_gen balances the flows across its worker processes by expected packet 
+        # rate and merges their results into a single sender file.
+        worker_count = worker_count or MininetHost.TRAFFIC_GEN_WORKER_COUNT
+        self.remove_live_counters("sender")
+        args_file_path = path.Path(f"/tmp/host-{self.host_id}-instance-0-traffic-gen-args.json")
+        args = f"{str(MininetHost.TRAFFIC_GEN_BIN_PATH)} {str(args_file_path)} -workers {worker_count}"
+        args_file_path.write_text(json.dumps(self.configured_flows))
+        self.put_file(str(args_file_path), str(args_file_path))
+        self.client_procs.append(self.run_async(args))
 
     def stop_traffic_generation_client(self):
         for proc in self.client_procs:
@@ -214,6 +227,30 @@ class MininetHost(Host):
         #     raise ValueError(f"Couldn't find file {str(sender_file_path)} on host with IP Address {self.host_ip}.")
         # return sender_results
 
+    def remove_live_counters(self, kind):
+        """
+        Remove the live counter files left on this host by earlier trials, of either the
+        "sender" or the "receiver" processes.
+        """
+        self.run(f"{str(MininetHost.LIVE_COUNTERS_BIN_PATH)} -remove -host {self.host_id} -kind {kind}")
+
+    def get_live_counters(self):
+        """
+        Sample the live counters published by the traffic generation processes on this
+        host while they are still running. Processes that have exited are left out.
+
+        RETURNS
+            [counter_snapshot] with one dictionary per process, as produced by
+            live_counters.CounterSnapshot.to_dict
+        """
+        live_counters_result = self.run(f"{str(MininetHost.LIVE_COUNTERS_BIN_PATH)} -json -count 1 -host {self.host_id}")
+        live_counters_output = live_counters_result.read_stdout()
+        try:
+            return json.loads(live_counters_output)
+        except ValueError:
+            raise ValueError(
+                    f"Couldn't read live counters on host with IP Address {self.host_ip}.")
+
     def get_receiver_results(self):
         receiver_file_path = path.Path(f"/tmp/receiver_{self.host_id}.p")
         try:
@@ -222,5 +259,23 @@ class MininetHost(Host):
             raise ValueError(
                     f"Couldn't find file {str(receiver_file_path)} on host with IP Address {self.host_ip}.")
         return receiver_results
+
+    def get_receiver_stats(self):
+        """
+        RETURNS
+            { "drop_count"          : packets dropped by the kernel before traffic_server read them
+            , "worker_drop_counts"  : [drop_count] for each traffic_server worker
+            , "flows"               : (src_addr, src_port, flow_id) -> loss, reordering and
+                                      per path latency and jitter of the flow, empty unless
+                                      the server was started with track_flows
+            }
+        """
+        stats_file_path = path.Path(f"/tmp/receiver_{self.host_id}-stats.p")
+        try:
+            receiver_stats = self.get_file(stats_file_path, lambda fp: pickle.load(fp.open("rb")))
+        except Exception:
+            raise ValueError(
+                    f"Couldn't find file {str(stats_file_path)} on host with IP Address {self.host_ip}.")
+        return receiver_stats
         
 
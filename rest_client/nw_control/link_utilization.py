@@ -0,0 +1,309 @@
+import numpy        as np
+
+from enum           import Enum
+from collections    import defaultdict
+
+class ByteCounter(Enum):
+    """
+    Selects which of the OnMonitor interface counters to compute utilization from.
+    """
+    SENT        = 0
+    RECEIVED    = 1
+    TOTAL       = 2
+
+def compute_link_key(source_id, destination_id):
+    return tuple(sorted((source_id, destination_id)))
+
+class LinkCounterMatrix:
+    """
+    Class: LinkCounterMatrix
+    Purpose: Stores the byte counts collected by the OnMonitor as a (T x L) array,
+    where T is the number of snapshots and L is the number of directed links seen
+    in any snapshot. Column l always refers to link_ids[l].
+
+    Rates, means and percentiles are computed as array operations. Every method that
+    produces per-period values also returns a boolean mask of the same shape marking
+    which entries are defined.
+    """
+
+    def __init__(self, link_ids, bytes_sent, bytes_received, present):
+        self._link_ids          = link_ids
+        self._link_index        = {link_id: idx for idx, link_id in enumerate(link_ids)}
+        self._bytes_sent        = bytes_sent
+        self._bytes_received    = bytes_received
+        self._present           = present
+
+    @staticmethod
+    def from_snapshots(snapshots):
+        """
+        snapshots: [byte_count_snapshot] where each byte_count_snapshot is either the list
+        of utilizationStats for one monitoring period, or the raw OnMonitor response for
+        that period (containing netUtilStats).
+        """
+        snapshots = [s["netUtilStats"]["utilizationStats"] if isinstance(s, dict) else s
+                for s in snapshots]
+        link_index = {}
+        for snapshot in snapshots:
+            for iface_stats in snapshot:
+                link_id = (iface_stats["sourceSwitchId"], iface_stats["destinationSwitchId"])
+                if link_id not in link_index:
+                    link_index[link_id] = len(link_index)
+
+        shape = (len(snapshots), len(link_index))
+        bytes_sent      = np.zeros(shape, dtype=np.int64)
+        bytes_received  = np.zeros(shape, dtype=np.int64)
+        present         = np.zeros(shape, dtype=bool)
+        for t_idx, snapshot in enumerate(snapshots):
+            columns = [link_index[(d["sourceSwitchId"], d["destinationSwitchId"])]
+                    for d in snapshot]
+            bytes_sent[t_idx, columns]      = [d["bytesSent"] for d in snapshot]
+            bytes_received[t_idx, columns]  = [d["bytesReceived"] for d in snapshot]
+            present[t_idx, columns]         = True
+        return LinkCounterMatrix(list(link_index.keys()), bytes_sent, bytes_received, present)
+
+    @property
+    def link_ids(self):
+        return self._link_ids
+
+    @property
+    def link_index(self):
+        return self._link_index
+
+    @property
+    def sample_count(self):
+        return self._present.shape[0]
+
+    @property
+    def present(self):
+        return self._present
+
+    def get_counts(self, counter=ByteCounter.SENT):
+        if counter == ByteCounter.SENT:
+            return self._bytes_sent
+        elif counter == ByteCounter.RECEIVED:
+            return self._bytes_received
+        elif counter == ByteCounter.TOTAL:
+            return self._bytes_sent + self._bytes_received
+        raise ValueError("Unrecognized counter %s" % str(counter))
+
+    def get_deltas(self, counter=ByteCounter.SENT, require_both=False):
+        """
+        Compute the change in each counter between consecutive snapshots.
+
+        A delta is defined for period t if the link was present in snapshot t. If the
+        link is missing from snapshot t+1 the delta is 0, unless require_both is set in
+        which case the delta is undefined.
+
+        RETURNS
+            (deltas, valid) each with shape (T-1 x L)
+        """
+        counts = self.get_counts(counter)
+        if self.sample_count < 2:
+            empty_shape = (0, len(self.link_ids))
+            return np.zeros(empty_shape, dtype=np.int64), np.zeros(empty_shape, dtype=bool)
+        present_t0, present_t1 = self._present[:-1], self._present[1:]
+        deltas = np.where(present_t1, counts[1:] - counts[:-1], 0)
+        valid = present_t0 & present_t1 if require_both else present_t0.copy()
+        deltas[~valid] = 0
+        return deltas, valid
+
+    def get_rates(self, counter=ByteCounter.SENT, scale=1.0, require_both=False):
+        """
+        Scale the per-period deltas into rates, i.e. for a 10 second monitoring period
+        scale=(8 / 10.0 / 10**6) gives Mbps.
+        """
+        deltas, valid = self.get_deltas(counter, require_both)
+        return deltas * scale, valid
+
+    def fold_bidirectional(self, values, valid):
+        """
+        Sum the values for both directions of each link. A folded entry is defined if
+        either direction was defined.
+
+        RETURNS
+            (folded_link_ids, folded_values, folded_valid)
+        """
+        folded_index = {}
+        column_map = np.empty(len(self.link_ids), dtype=np.int64)
+        for idx, (source_id, destination_id) in enumerate(self.link_ids):
+            link_key = compute_link_key(source_id, destination_id)
+            column_map[idx] = folded_index.setdefault(link_key, len(folded_index))
+
+        folded_shape = (values.shape[0], len(folded_index))
+        folded_values = np.zeros(folded_shape, dtype=np.float64)
+        folded_valid = np.zeros(folded_shape, dtype=bool)
+        np.add.at(folded_values.T, column_map, np.where(valid, values, 0).T)
+        np.logical_or.at(folded_valid.T, column_map, valid.T)
+        return list(folded_index.keys()), folded_values, folded_valid
+
+    @staticmethod
+    def mean_over_time(values, valid):
+        """
+        Mean of each column over the periods where it is defined (NaN if never defined).
+        """
+        counts = valid.sum(axis=0)
+        sums = np.where(valid, values, 0).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+    @staticmethod
+    def max_over_time(values, valid):
+        masked = np.where(valid, values, -np.inf)
+        result = masked.max(axis=0, initial=-np.inf)
+        return np.where(np.isneginf(result), np.nan, result)
+
+    @staticmethod
+    def percentile_over_time(values, valid, q):
+        masked = np.where(valid, values.astype(np.float64), np.nan)
+        if masked.shape[0] == 0:
+            return np.full(masked.shape[1], np.nan)
+        with np.errstate(all="ignore"):
+            return np.nanpercentile(masked, q, axis=0)
+
+    @staticmethod
+    def to_dicts(link_ids, values, valid):
+        """
+        RETURNS
+            [link_id -> value] with one dictionary per period
+        """
+        per_period = []
+        for values_t, valid_t in zip(values.tolist(), valid.tolist()):
+            per_period.append({link_id: v for link_id, v, is_valid
+                in zip(link_ids, values_t, valid_t) if is_valid})
+        return per_period
+
+    @staticmethod
+    def to_nested_dicts(link_ids, values, valid):
+        """
+        RETURNS
+            [source_id -> destination_id -> value] with one dictionary per period
+        """
+        per_period = []
+        for values_t, valid_t in zip(values.tolist(), valid.tolist()):
+            nested = defaultdict(dict)
+            for (source_id, destination_id), v, is_valid in zip(link_ids, values_t, valid_t):
+                if is_valid:
+                    nested[source_id][destination_id] = v
+            per_period.append(dict(nested))
+        return per_period
+
+    @staticmethod
+    def to_column_dict(link_ids, column_values):
+        """
+        RETURNS
+            link_id -> value for each column value that is defined (not NaN)
+        """
+        return {link_id: v for link_id, v in zip(link_ids, column_values.tolist())
+                if not np.isnan(v)}
+
+def compute_folded_link_rates(link_byte_counts, counter, scale):
+    """
+    Shared implementation of the compute_link_utilization_over_time functions: folds
+    both directions of each link together and scales the per-period byte deltas.
+
+    RETURNS
+        (folded_link_ids, rates (T-1 x L'), valid (T-1 x L'))
+    """
+    counter_matrix = LinkCounterMatrix.from_snapshots(link_byte_counts)
+    rates, valid = counter_matrix.get_rates(counter, scale)
+    return counter_matrix.fold_bidirectional(rates, valid)
+
+def compute_directed_link_rates(link_byte_counts, counter, scale, require_both=True):
+    """
+    RETURNS
+        [source_id -> destination_id -> scaled byte delta] with one dictionary per period
+    """
+    counter_matrix = LinkCounterMatrix.from_snapshots(link_byte_counts)
+    rates, valid = counter_matrix.get_rates(counter, scale, require_both)
+    return LinkCounterMatrix.to_nested_dicts(counter_matrix.link_ids, rates, valid)
+
+class RateSketch:
+    """
+    Class: RateSketch
+    Purpose: Online percentile estimator for a fixed set of links. Each link keeps a
+    histogram over logarithmically sized buckets so that any percentile can be
+    recovered to within RELATIVE_ACCURACY of the true value, using a constant amount
+    of memory regardless of how many samples have been added.
+    """
+
+    RELATIVE_ACCURACY   = 0.01
+    MAX_VALUE           = 10**12
+
+    def __init__(self, link_count, relative_accuracy=None, max_value=None):
+        relative_accuracy   = relative_accuracy or RateSketch.RELATIVE_ACCURACY
+        max_value           = max_value or RateSketch.MAX_VALUE
+        self._gamma         = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma     = np.log(self._gamma)
+        # Bucket 0 holds every value smaller than 1, bucket i > 0 holds (gamma^(i-1), gamma^i]
+        bucket_count        = int(np.ceil(np.log(max_value) / self._log_gamma)) + 2
+        self._counts        = np.zeros((link_count, bucket_count), dtype=np.int64)
+
+    def _bucket_indices(self, values):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            indices = np.ceil(np.log(np.maximum(values, 1.0)) / self._log_gamma) + 1
+        indices = np.where(values < 1.0, 0, indices)
+        return np.clip(indices, 0, self._counts.shape[1] - 1).astype(np.int64)
+
+    def add(self, values, valid):
+        """
+        Add one sample per link. values and valid both have shape (L,).
+        """
+        link_indices = np.nonzero(valid)[0]
+        if len(link_indices) > 0:
+            np.add.at(self._counts, 
+                    (link_indices, self._bucket_indices(values[link_indices])), 1)
+
+    def get_percentile(self, q):
+        """
+        RETURNS
+            An (L,) array of the estimated qth percentile for each link (NaN if the link
+            has no samples).
+        """
+        cumulative_counts = np.cumsum(self._counts, axis=1)
+        totals = cumulative_counts[:, -1]
+        ranks = np.maximum(np.ceil((q / 100.0) * totals), 1)
+        bucket_indices = np.argmax(cumulative_counts >= ranks[:, None], axis=1)
+        estimates = np.where(bucket_indices == 0, 0.0,
+                2 * self._gamma ** (bucket_indices - 1) / (self._gamma + 1))
+        return np.where(totals > 0, estimates, np.nan)
+
+class RunningLinkAggregates:
+    """
+    Class: RunningLinkAggregates
+    Purpose: Maintains the sample count, mean, max and a RateSketch for every link so
+    that summary statistics can be queried in O(links) at any point during a trial.
+    """
+
+    def __init__(self, link_ids, relative_accuracy=None):
+        self._link_ids  = link_ids
+        link_count      = len(link_ids)
+        self._counts    = np.zeros(link_count, dtype=np.int64)
+        self._sums      = np.zeros(link_count, dtype=np.float64)
+        self._maxes     = np.full(link_count, -np.inf)
+        self._sketch    = RateSketch(link_count, relative_accuracy)
+
+    @property
+    def link_ids(self):
+        return self._link_ids
+
+    def update(self, values, valid):
+        """
+        Fold one sample per link into the aggregates. values and valid have shape (L,).
+        """
+        self._counts += valid
+        self._sums += np.where(valid, values, 0)
+        self._maxes = np.where(valid, np.maximum(self._maxes, values), self._maxes)
+        self._sketch.add(values, valid)
+
+    def get_count(self):
+        return self._counts.copy()
+
+    def get_mean(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self._counts > 0, self._sums / np.maximum(self._counts, 1), np.nan)
+
+    def get_max(self):
+        return np.where(self._counts > 0, self._maxes, np.nan)
+
+    def get_percentile(self, q):
+        return self._sketch.get_percentile(q)
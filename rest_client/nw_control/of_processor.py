@@ -1,15 +1,138 @@
 import of_rest_client as of
 import flowmod as fm
+import time as time
+import statistics as stat
+import threading as thread
 
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class FlowmodStatus:
+    """
+    Class: FlowmodStatus
+    Purpose: Outcome of pushing a single flowmod as part of a bulk push.
+    """
+
+    def __init__(self, dpid, flow_mod, response=None, error=None, latency=0.0):
+        self.dpid = dpid
+        self.flow_mod = flow_mod
+        self.response = response
+        self.error = error
+        self.latency = latency
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    def __str__(self):
+        if self.succeeded:
+            outcome = str(self.response)
+        else:
+            outcome = 'Error: %s' % str(self.error)
+        return 'DPID: %s, Latency: %.4fs, %s' % (str(self.dpid), self.latency, outcome)
+
+class BulkPushResult:
+    """
+    Class: BulkPushResult
+    Purpose: Per-flowmod statuses of a bulk push, in the order the flowmods
+    were supplied, along with aggregate latency statistics.
+    """
+
+    def __init__(self, statuses, elapsed_time):
+        self.statuses = statuses
+        self.elapsed_time = elapsed_time
+
+    def get_failures(self):
+        return [s for s in self.statuses if not s.succeeded]
+
+    def all_succeeded(self):
+        return len(self.get_failures()) == 0
+
+    def get_latency_stats(self):
+        latencies = sorted(s.latency for s in self.statuses)
+        if not latencies:
+            return {}
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+        return { 'count'        : len(latencies)
+               , 'failures'     : len(self.get_failures())
+               , 'mean'         : stat.mean(latencies)
+               , 'min'          : latencies[0]
+               , 'max'          : latencies[-1]
+               , 'p50'          : percentile(0.50)
+               , 'p95'          : percentile(0.95)
+               , 'p99'          : percentile(0.99)
+               , 'elapsed'      : self.elapsed_time
+               , 'throughput'   : len(latencies) / self.elapsed_time if self.elapsed_time > 0 else 0.0
+               }
+
+    def __iter__(self):
+        for status in self.statuses:
+            yield status
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def __str__(self):
+        stats = self.get_latency_stats()
+        if not stats:
+            return 'Pushed 0 flowmods.'
+        return ('Pushed %d flowmods (%d failed) in %.3fs. Latency mean %.4fs, p95 %.4fs, max %.4fs.'
+                % (stats['count'], stats['failures'], stats['elapsed'], stats['mean'],
+                    stats['p95'], stats['max']))
+
+
+class TopologyCache:
+    """
+    Class: TopologyCache
+    Purpose: Snapshot of the controller's view of the topology along with a
+    reverse index from (dpid, port_no) to the DPID of the neighbouring switch.
+    """
+
+    def __init__(self, topo_links):
+        self.topo_links = topo_links
+        self.adj_mat = topo_links.get_adj_mat()
+        self.port_index = {}
+        for dpid, neighbours in self.adj_mat.items():
+            for neighbour_dpid, port_no in neighbours.items():
+                self.port_index.setdefault((dpid, port_no), neighbour_dpid)
+        self.created_at = time.monotonic()
+
+    def get_neighbour(self, dpid, port_no):
+        """
+        Returns the DPID of the switch connected to port_no on dpid or None if
+        the port does not connect to another switch.
+        """
+        return self.port_index.get((dpid, port_no))
+
+    def get_age(self):
+        return time.monotonic() - self.created_at
 
 class OFProcessor:
 
-    def __init__(self, of_controller_ip, of_controller_port):
+    MAX_PARALLEL_REQUESTS       = 32
+    MAX_PARALLEL_PER_SWITCH     = 4
+
+    def __init__(self, of_controller_ip, of_controller_port, session_pool=None, topo_ttl=None):
         self._of_controller_ip = of_controller_ip
         self._of_controller_port = of_controller_port
+        self._session_pool = session_pool or of.get_session_pool()
+        # Topology snapshots older than topo_ttl seconds are refreshed. A TTL of
+        # None means the snapshot is kept until invalidate_topo_cache is called.
+        self._topo_ttl = topo_ttl
+        self._topo_cache = None
+        self._topo_cache_lock = thread.Lock()
+
+    @property
+    def session_pool(self):
+        return self._session_pool
 
     def _curry_of_msg_cons(self, cons):
-        return (lambda args : cons(*args, self._of_controller_ip, self._of_controller_port))
+        def mk_msg(args):
+            msg = cons(*args, self._of_controller_ip, self._of_controller_port)
+            msg.session_pool = self._session_pool
+            return msg
+        return mk_msg
 
     def get_switch_list(self):
         req = self._curry_of_msg_cons(of.SwitchList)
@@ -26,11 +149,95 @@ class OFProcessor:
         resp = req([flow_mod]).get_response()
         return resp
     
+    def push_flow_mods( self
+                      , flow_mods
+                      , max_parallel = MAX_PARALLEL_REQUESTS
+                      , max_per_switch = MAX_PARALLEL_PER_SWITCH ):
+        """
+        Push an iterable of (dpid, flow_mod) pairs to the controller concurrently.
+        At most max_parallel requests are outstanding in total and at most
+        max_per_switch requests are outstanding for any single switch.
+
+        RETURNS
+            A BulkPushResult whose statuses are ordered like flow_mods.
+        """
+        return self._dispatch_flow_mods(flow_mods, self.push_flow_mod, max_parallel, 
+                max_per_switch)
+
+    def remove_flow_mods( self
+                        , flow_mods
+                        , max_parallel = MAX_PARALLEL_REQUESTS
+                        , max_per_switch = MAX_PARALLEL_PER_SWITCH
+                        , strict = False ):
+        """
+        Same as push_flow_mods except that each flow_mod is sent as a RemoveFlow request,
+        or a RemoveFlowStrict request if strict is set.
+        """
+        request_fn = self.remove_flow_strict if strict else self.remove_flow
+        return self._dispatch_flow_mods(flow_mods, request_fn, max_parallel, max_per_switch)
+
+    def _dispatch_flow_mods(self, flow_mods, request_fn, max_parallel, max_per_switch):
+        def timed_push(dpid, flow_mod):
+            start = time.perf_counter()
+            try:
+                resp = request_fn(dpid, flow_mod)
+                return FlowmodStatus(dpid, flow_mod, response=resp,
+                        latency=time.perf_counter() - start)
+            except Exception as ex:
+                return FlowmodStatus(dpid, flow_mod, error=ex,
+                        latency=time.perf_counter() - start)
+
+        max_parallel = max(1, max_parallel)
+        max_per_switch = max(1, max_per_switch)
+        pending = defaultdict(deque)
+        push_count = 0
+        for idx, (dpid, flow_mod) in enumerate(flow_mods):
+            pending[dpid].append((idx, flow_mod))
+            push_count += 1
+
+        statuses = [None] * push_count
+        in_flight = {}
+        in_flight_per_switch = defaultdict(int)
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            while pending or in_flight:
+                for dpid in list(pending.keys()):
+                    sw_queue = pending[dpid]
+                    while (sw_queue and len(in_flight) < max_parallel
+                            and in_flight_per_switch[dpid] < max_per_switch):
+                        idx, flow_mod = sw_queue.popleft()
+                        future = executor.submit(timed_push, dpid, flow_mod)
+                        in_flight[future] = (idx, dpid)
+                        in_flight_per_switch[dpid] += 1
+                    if not sw_queue:
+                        del pending[dpid]
+                done, _ = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, dpid = in_flight.pop(future)
+                    in_flight_per_switch[dpid] -= 1
+                    statuses[idx] = future.result()
+        return BulkPushResult(statuses, time.perf_counter() - start_time)
+    
     def get_topo_links(self):
         req = self._curry_of_msg_cons(of.TopologyLinks)
         resp = req([]).get_response()
         return resp
     
+    def get_topo_cache(self):
+        """
+        Return the cached topology snapshot, requesting a new one from the
+        controller if there is no snapshot or the current one has expired.
+        """
+        with self._topo_cache_lock:
+            if (self._topo_cache is None or (self._topo_ttl is not None
+                    and self._topo_cache.get_age() > self._topo_ttl)):
+                self._topo_cache = TopologyCache(self.get_topo_links())
+            return self._topo_cache
+
+    def invalidate_topo_cache(self):
+        with self._topo_cache_lock:
+            self._topo_cache = None
+
     def get_switch_desc(self, dpid):
         req = self._curry_of_msg_cons(of.SwitchDesc)
         resp = req([dpid]).get_response()
@@ -46,11 +253,54 @@ class OFProcessor:
         resp = req([dpid, flow_mod]).get_response()
         return resp
 
+    def remove_flow_strict(self, dpid, flow_mod):
+        req = self._curry_of_msg_cons(of.RemoveFlowStrict)
+        resp = req([dpid, flow_mod]).get_response()
+        return resp
+
     def get_port_stats(self, dpid):
         req = self._curry_of_msg_cons(of.GetPortStats)
         resp = req([dpid]).get_response()
         return resp
 
+    def remove_flows_by_cookie( self
+                              , dpids
+                              , cookie
+                              , cookie_mask = fm.Flowmod.COOKIE_MASK_ALL
+                              , table_id = fm.Flowmod.TABLE_ID_ALL
+                              , max_parallel = MAX_PARALLEL_REQUESTS ):
+        """
+        Remove every flow whose cookie matches cookie under cookie_mask from each of the
+        switches in dpids. Only flows in table_id are removed, every table by default
+        (Ryu deletes from table 0 if no table is given). One delete request is sent per
+        switch, and the requests for different switches are sent concurrently.
+
+        RETURNS
+            A BulkPushResult with one status per switch, ordered like dpids.
+        """
+        flow_mods = [(dpid, fm.Flowmod(dpid, cookie=cookie, cookie_mask=cookie_mask, 
+            table_id=table_id)) for dpid in dpids]
+        return self.remove_flow_mods(flow_mods, max_parallel, max_per_switch=1)
+
+    def get_flows_by_cookie( self
+                           , dpids
+                           , cookie
+                           , cookie_mask = fm.Flowmod.COOKIE_MASK_ALL
+                           , max_parallel = MAX_PARALLEL_REQUESTS ):
+        """
+        RETURNS
+            dpid -> [flow] for the flows installed on each switch in dpids whose cookie
+            matches cookie under cookie_mask.
+        """
+        def matching_flows(dpid):
+            flow_records = self.get_switch_flows(dpid).iter_flows(cookie=cookie, 
+                    cookie_mask=cookie_mask)
+            return [flow_record.get_json() for flow_record in flow_records]
+
+        dpids = list(dpids)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(dpids)))) as executor:
+            return dict(zip(dpids, executor.map(matching_flows, dpids)))
+
     def remove_table_flows(self, dpid, table_id):
         flow_mod = fm.Flowmod(dpid, table_id=table_id)
         return self.remove_flow(dpid, flow_mod)
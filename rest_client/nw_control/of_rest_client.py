@@ -1,4 +1,8 @@
 import requests as req
+# Connection pooling for keep-alive sessions
+import requests.adapters as req_adapters
+# Guards the shared session pool
+import threading
 # Loggers
 from logging import error, warn, info
 # Python3 Enumerations
@@ -11,6 +15,8 @@ from collections import defaultdict
 import pprint as pp
 # JSON Formatter/Serializer
 import json
+# Tokenizing streamed flow dumps
+import re
 # Various local utility functions
 from . import util
 
@@ -32,6 +38,7 @@ class HttpReqType(Enum):
             str_rep = 'POST'
         elif self == HttpReqType.DELETE:
             str_rep = 'DELETE'
+        return str_rep
 
 class OFRequestType(Enum):
     """
@@ -47,6 +54,7 @@ class OFRequestType(Enum):
     RemoveAllFlows  = 5
     RemoveFlow      = 6
     GetPortStats    = 7
+    RemoveFlowStrict = 8
 
     @staticmethod
     def get_type_parser(req_type):
@@ -58,6 +66,7 @@ class OFRequestType(Enum):
                   , OFRequestType.RemoveAllFlows    : OFStatusResponse.parse_json
                   , OFRequestType.RemoveFlow        : OFStatusResponse.parse_json
                   , OFRequestType.GetPortStats      : OFPortStatsResponse.parse_json
+                  , OFRequestType.RemoveFlowStrict  : OFStatusResponse.parse_json
                   }
         return parsers[req_type]
 
@@ -71,6 +80,7 @@ class OFRequestType(Enum):
                    , OFRequestType.RemoveAllFlows   : HttpReqType.DELETE
                    , OFRequestType.RemoveFlow       : HttpReqType.POST
                    , OFRequestType.GetPortStats     : HttpReqType.GET
+                   , OFRequestType.RemoveFlowStrict : HttpReqType.POST
                    }
         return http_map[req_type]
 
@@ -158,31 +168,165 @@ class OFResponseSwitchFlows(OFResponse):
     """
 
     def __init__(self):
-        self.resp = None
+        self._resp = None
+        self._resp_text = None
 
     def parse(self, json_repr):
         self.response_code = json_repr.status_code
-        self.resp = json_repr.json()
+        # The dump is only decoded in full if resp is accessed, iter_flows streams it.
+        self._resp_text = json_repr.text
 
     @staticmethod
     def parse_json(json_repr):
         obj = OFResponseSwitchFlows()
         obj.parse(json_repr)
         return obj
+
+    @property
+    def resp(self):
+        if self._resp is None and self._resp_text is not None:
+            self._resp = json.loads(self._resp_text)
+        return self._resp
     
     def get_flows(self):
         flow_list = []
-        for sw_dpid in self.resp.values():
-            flow_list = flow_list + sw_dpid
+        for sw_flows in self.resp.values():
+            flow_list.extend(sw_flows)
         return flow_list
 
+    def iter_flows( self
+                  , table_id = None
+                  , cookie = None
+                  , cookie_mask = fm.Flowmod.COOKIE_MASK_ALL
+                  , match = None ):
+        """
+        Yield a FlowRecord for each flow in the response that passes the filters. See
+        iter_flow_records.
+        """
+        if self._resp is None and self._resp_text is not None:
+            flow_entries = iter_flow_dump_text(self._resp_text)
+        else:
+            flow_entries = ((dpid, flow) for dpid, sw_flows in self.resp.items() 
+                    for flow in sw_flows)
+        return iter_flow_records(flow_entries, table_id, cookie, cookie_mask, match)
+
     def get_flow_count(self):
-        return len(self.get_flows())
+        return sum(len(sw_flows) for sw_flows in self.resp.values())
     
     def __str__(self):
         str_rep = 'Flow Count: %d' % self.get_flow_count()
         return str_rep
 
+class FlowRecord:
+    """
+    Class: FlowRecord
+    Purpose: Lightweight view of one flow entry in a flow table dump. Fields are read
+    from the decoded JSON entry on access rather than being copied out of it.
+    """
+
+    __slots__ = ('dpid', '_flow')
+
+    def __init__(self, dpid, flow):
+        self.dpid = dpid
+        self._flow = flow
+
+    @property
+    def table_id(self):
+        return self._flow.get('table_id', 0)
+
+    @property
+    def priority(self):
+        return self._flow.get('priority', 0)
+
+    @property
+    def cookie(self):
+        return self._flow.get('cookie', 0)
+
+    @property
+    def match(self):
+        return self._flow.get('match', {})
+
+    @property
+    def actions(self):
+        return self._flow.get('actions', [])
+
+    @property
+    def packet_count(self):
+        return self._flow.get('packet_count', 0)
+
+    @property
+    def byte_count(self):
+        return self._flow.get('byte_count', 0)
+
+    def get_json(self):
+        return self._flow
+
+    def __str__(self):
+        return ('DPID: %s, Table: %d, Priority: %d, Cookie: %#x, Match: %s, Actions: %s' %
+                (str(self.dpid), self.table_id, self.priority, self.cookie, self.match,
+                    self.actions))
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def _expect_json_token(text, idx, token):
+    idx = _JSON_WHITESPACE.match(text, idx).end()
+    if text[idx:idx+1] != token:
+        raise ValueError('Malformed flow dump: expected %s at offset %d' % (token, idx))
+    return idx + 1
+
+def iter_flow_dump_text(text):
+    """
+    Incrementally decode the text of a flow table dump of the form {dpid: [flow]},
+    yielding one (dpid, flow) pair at a time without building the complete dump.
+    """
+    idx = _expect_json_token(text, 0, '{')
+    while True:
+        idx = _JSON_WHITESPACE.match(text, idx).end()
+        if text[idx:idx+1] == '}':
+            return
+        dpid, idx = _JSON_DECODER.raw_decode(text, idx)
+        idx = _expect_json_token(text, idx, ':')
+        idx = _expect_json_token(text, idx, '[')
+        while True:
+            idx = _JSON_WHITESPACE.match(text, idx).end()
+            if text[idx:idx+1] == ']':
+                idx += 1
+                break
+            flow, idx = _JSON_DECODER.raw_decode(text, idx)
+            yield dpid, flow
+            idx = _JSON_WHITESPACE.match(text, idx).end()
+            if text[idx:idx+1] == ',':
+                idx += 1
+        idx = _JSON_WHITESPACE.match(text, idx).end()
+        if text[idx:idx+1] == ',':
+            idx += 1
+
+def iter_flow_records( flow_entries
+                     , table_id = None
+                     , cookie = None
+                     , cookie_mask = fm.Flowmod.COOKIE_MASK_ALL
+                     , match = None ):
+    """
+    Lazily wrap (dpid, flow) pairs, i.e. from iter_flow_dump_text, in FlowRecords.
+
+    table_id: Only yield flows in this table.
+    cookie: Only yield flows whose cookie equals cookie under cookie_mask.
+    match: Only yield flows whose match contains every field -> value in this dict.
+    """
+    masked_cookie = cookie & cookie_mask if cookie is not None else None
+    match_items = list(match.items()) if match else []
+    for dpid, flow in flow_entries:
+        if table_id is not None and flow.get('table_id', 0) != table_id:
+            continue
+        if masked_cookie is not None and (flow.get('cookie', 0) & cookie_mask) != masked_cookie:
+            continue
+        if match_items:
+            flow_match = flow.get('match', {})
+            if any(flow_match.get(k) != v for k, v in match_items):
+                continue
+        yield FlowRecord(dpid, flow)
+
 class OFResponseTopologyLinks(OFResponse):
     """
     Class: OFResponseTopologyLinks(OFResponse)
@@ -256,11 +400,23 @@ class OFPortStatsResponse(OFResponse):
         ret = {}
         for _, lst in self.resp.items():
             for port_desc in lst:
+                # Reserved ports (i.e. LOCAL) are reported by name, skip them.
+                if not str(port_desc['port_no']).isdigit():
+                    continue
                 port_no = int(port_desc['port_no'])
                 field_val = field_accessor(port_desc)
                 ret[port_no] = field_val
         return ret
 
+    def get_port_durations(self):
+        """
+        Returns the time in seconds that each port has been alive, as reported by 
+        the switch when the counters were read.
+        """
+        durations = self._build_port_dict(lambda d : 
+                d.get('duration_sec', 0) + d.get('duration_nsec', 0) * 1e-9)
+        return durations
+
     def get_tx_packets(self):
         tx_pkts = self._build_port_dict(lambda d : d['tx_packets'])
         return tx_pkts
@@ -269,6 +425,115 @@ class OFPortStatsResponse(OFResponse):
         rx_pkts = self._build_port_dict(lambda d : d['rx_packets'])
         return rx_pkts
 
+class SessionPool:
+    """
+    Class: SessionPool
+    Purpose: Share keep-alive HTTP sessions between all of the requests sent to
+    a particular controller. One session is maintained per (host, port_no) and
+    each session holds up to pool_size open connections.
+    """
+
+    DEFAULT_POOL_SIZE   = 16
+    DEFAULT_TIMEOUT     = 30.0 # Seconds
+
+    def __init__( self
+                , pool_size     = DEFAULT_POOL_SIZE
+                , keep_alive    = True
+                , timeout       = DEFAULT_TIMEOUT ):
+        self.pool_size      = pool_size
+        self.keep_alive     = keep_alive
+        self.timeout        = timeout
+        self._sessions      = {}
+        self._lock          = threading.Lock()
+
+    def _create_session(self):
+        session = req.Session()
+        adapter = req_adapters.HTTPAdapter(pool_connections=1,
+                pool_maxsize=self.pool_size, pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def get_session(self, host, port_no):
+        with self._lock:
+            session = self._sessions.get((host, port_no))
+            if session is None:
+                session = self._create_session()
+                self._sessions[(host, port_no)] = session
+        return session
+
+    def send(self, http_req_type, url, host, port_no, data=None, timeout=None):
+        session = self.get_session(host, port_no)
+        if timeout is None:
+            timeout = self.timeout
+        return session.request(str(http_req_type), url, data=data, timeout=timeout)
+
+    def _connection_pools(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        pools = []
+        for session in sessions:
+            pool_manager = session.get_adapter('http://').poolmanager
+            pools.extend(pool_manager.pools[k] for k in pool_manager.pools.keys())
+        return pools
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of requests sent through the pool, the
+        number of requests that reused an open connection (hits) and the number
+        of requests that had to open a new connection (misses).
+        """
+        pools = self._connection_pools()
+        request_count = sum(pool.num_requests for pool in pools)
+        miss_count = sum(pool.num_connections for pool in pools)
+        return { 'requests' : request_count
+               , 'hits'     : max(0, request_count - miss_count)
+               , 'misses'   : miss_count
+               }
+
+    def get_hit_count(self):
+        return self.get_stats()['hits']
+
+    def get_miss_count(self):
+        return self.get_stats()['misses']
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+        for session in sessions:
+            session.close()
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+def get_session_pool():
+    """
+    Return the session pool shared by every OFRequest that wasn't given a pool
+    of its own.
+    """
+    global _session_pool
+    with _session_pool_lock:
+        if _session_pool is None:
+            _session_pool = SessionPool()
+        return _session_pool
+
+def configure_session_pool( pool_size     = SessionPool.DEFAULT_POOL_SIZE
+                          , keep_alive    = True
+                          , timeout       = SessionPool.DEFAULT_TIMEOUT ):
+    """
+    Replace the shared session pool with one using the specified parameters.
+    """
+    global _session_pool
+    with _session_pool_lock:
+        old_pool = _session_pool
+        _session_pool = SessionPool(pool_size, keep_alive, timeout)
+    if old_pool is not None:
+        old_pool.close()
+    return _session_pool
+
 class OFRequest:
     """
     Class OFRequest:
@@ -280,20 +545,16 @@ class OFRequest:
         self.req_type = req_type
         self.host = host
         self.port_no = port_no
+        self.session_pool = None
 
     def get_response(self):
         of_request = self.get_request_url()
         of_params = json.dumps(self.get_request_params())
+        session_pool = self.session_pool or get_session_pool()
         try:
             http_req_type = OFRequestType.get_http_req_type(self.req_type)
-            if http_req_type == HttpReqType.GET:
-                resp = req.get(of_request, data=of_params)
-            elif http_req_type == HttpReqType.POST:
-                resp = req.post(of_request, data=of_params)
-            elif http_req_type == HttpReqType.DELETE:
-                resp = req.delete(of_request, data=of_params)
-            else:
-                raise ValueError('Undefined HTTP Method')
+            resp = session_pool.send(http_req_type, of_request, self.host, self.port_no,
+                    data=of_params)
         except req.exceptions.ConnectionError as ex:
             error(ex)
             raise ex
@@ -431,6 +692,22 @@ class RemoveFlow(OFRequest):
     def get_request_params(self):
         return self.flow_mod.get_json()
 
+class RemoveFlowStrict(RemoveFlow):
+    """
+    Class: RemoveFlowStrict(RemoveFlow)
+    Purpose: Removes only the flow whose match, priority and table exactly match the
+    specified flowmod.
+    """
+
+    def __init__(self, dpid, flow_mod, host, port_no):
+        OFRequest.__init__(self, OFRequestType.RemoveFlowStrict, host, port_no)
+        self.flow_mod = flow_mod
+        self.dpid = dpid
+
+    def get_request_url(self):
+        url = self.get_host_url('/stats/flowentry/delete_strict')
+        return url
+
 class GetPortStats(OFRequest):
     """
     Class: GetPortStats(OFRequest)
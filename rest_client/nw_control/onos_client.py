@@ -0,0 +1,201 @@
+import requests             as req
+import requests.adapters    as req_adapters
+import urllib.parse         as url
+import threading            as threading
+import time                 as time
+import bisect               as bisect
+
+import nw_control.params    as cfg
+
+from concurrent.futures     import ThreadPoolExecutor, wait
+
+class LatencyHistogram:
+    """
+    Class: LatencyHistogram
+    Purpose: Fixed bucket histogram of request latencies for a single endpoint.
+    """
+
+    # Upper bounds of the buckets in seconds, the final bucket is unbounded.
+    BUCKET_BOUNDS = [ 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05
+                    , 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0
+                    ]
+
+    def __init__(self):
+        self._counts    = [0] * (len(LatencyHistogram.BUCKET_BOUNDS) + 1)
+        self._count     = 0
+        self._total     = 0.0
+        self._max       = 0.0
+
+    def add(self, latency):
+        self._counts[bisect.bisect_left(LatencyHistogram.BUCKET_BOUNDS, latency)] += 1
+        self._count += 1
+        self._total += latency
+        self._max = max(self._max, latency)
+
+    def get_percentile(self, q):
+        """
+        Returns the upper bound of the bucket containing the qth percentile.
+        """
+        if self._count == 0:
+            return 0.0
+        rank = max(1, q / 100.0 * self._count)
+        cumulative_count = 0
+        for bucket_idx, bucket_count in enumerate(self._counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                if bucket_idx < len(LatencyHistogram.BUCKET_BOUNDS):
+                    return min(LatencyHistogram.BUCKET_BOUNDS[bucket_idx], self._max)
+                return self._max
+        return self._max
+
+    def get_stats(self):
+        return { "count"    : self._count
+               , "mean"     : self._total / self._count if self._count else 0.0
+               , "max"      : self._max
+               , "p50"      : self.get_percentile(50)
+               , "p95"      : self.get_percentile(95)
+               , "p99"      : self.get_percentile(99)
+               , "buckets"  : list(zip(LatencyHistogram.BUCKET_BOUNDS + [float("inf")],
+                   self._counts))
+               }
+
+class OnosClient:
+    """
+    Class: OnosClient
+    Purpose: Shared client for the ONOS REST API. Requests are sent over a pool of
+    persistent keep-alive connections with a common timeout and credentials, and
+    map_concurrently fans a batch of calls out over a bounded executor so that
+    bursts of requests are spread over at most max_concurrency connections. The
+    latency of every request is recorded in a per-endpoint LatencyHistogram.
+    """
+
+    DEFAULT_MAX_CONCURRENCY = 8
+    DEFAULT_TIMEOUT         = 30.0
+
+    def __init__( self
+                , base_url          = None
+                , credentials       = cfg.ONOS_API_CREDENTIALS
+                , max_concurrency   = DEFAULT_MAX_CONCURRENCY
+                , timeout           = DEFAULT_TIMEOUT):
+        self._base_url          = (base_url or cfg.onos_url).geturl()
+        self._max_concurrency   = max(1, max_concurrency)
+        self._timeout           = timeout
+        self._session           = req.Session()
+        self._session.auth      = credentials
+        adapter = req_adapters.HTTPAdapter(pool_connections=1,
+                pool_maxsize=self._max_concurrency, pool_block=True)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._executor          = None
+        self._lock              = threading.Lock()
+        self._histograms        = {}
+
+    @property
+    def base_url(self):
+        return self._base_url
+
+    @property
+    def max_concurrency(self):
+        return self._max_concurrency
+
+    def build_url(self, endpoint):
+        return url.urljoin(self._base_url, endpoint)
+
+    def request(self, method, endpoint, **kwargs):
+        """
+        Send a request to endpoint (relative to the ONOS base URL, i.e. "v1/links").
+
+        RETURNS
+            The requests.Response. Callers are responsible for checking the status.
+        """
+        kwargs.setdefault("timeout", self._timeout)
+        start_time = time.perf_counter()
+        try:
+            return self._session.request(method, self.build_url(endpoint), **kwargs)
+        finally:
+            self._record_latency("%s %s" % (method, endpoint.split("?")[0]),
+                    time.perf_counter() - start_time)
+
+    def get(self, endpoint, **kwargs):
+        return self.request("GET", endpoint, **kwargs)
+
+    def post(self, endpoint, **kwargs):
+        return self.request("POST", endpoint, **kwargs)
+
+    def delete(self, endpoint, **kwargs):
+        return self.request("DELETE", endpoint, **kwargs)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_concurrency)
+            return self._executor
+
+    def map_concurrently(self, fn, *iterables):
+        """
+        Apply fn to each element of iterables using at most max_concurrency threads.
+
+        RETURNS
+            The results in the same order as the inputs. If any call raises, the first
+            exception (in input order) is re-raised once all calls have completed.
+        """
+        futures = [self._get_executor().submit(fn, *args) for args in zip(*iterables)]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def _record_latency(self, endpoint_name, latency):
+        with self._lock:
+            if endpoint_name not in self._histograms:
+                self._histograms[endpoint_name] = LatencyHistogram()
+            self._histograms[endpoint_name].add(latency)
+
+    def get_latency_stats(self):
+        """
+        RETURNS
+            endpoint_name -> latency statistics, where endpoint_name is the HTTP method
+            and endpoint path without its query string.
+        """
+        with self._lock:
+            return {endpoint_name: histogram.get_stats()
+                    for endpoint_name, histogram in self._histograms.items()}
+
+    def reset_latency_stats(self):
+        with self._lock:
+            self._histograms = {}
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        self._session.close()
+
+_onos_clients = {}
+_onos_clients_lock = threading.Lock()
+
+def get_onos_client(base_url=None):
+    """
+    Returns the process wide OnosClient for base_url (nw_control.params.onos_url if not
+    specified), creating it on first use.
+    """
+    base_url_str = (base_url or cfg.onos_url).geturl()
+    with _onos_clients_lock:
+        if base_url_str not in _onos_clients:
+            _onos_clients[base_url_str] = OnosClient(base_url)
+        return _onos_clients[base_url_str]
+
+def configure_onos_client( base_url          = None
+                         , credentials       = cfg.ONOS_API_CREDENTIALS
+                         , max_concurrency   = OnosClient.DEFAULT_MAX_CONCURRENCY
+                         , timeout           = OnosClient.DEFAULT_TIMEOUT):
+    """
+    Replace the shared OnosClient for base_url with one using the given settings.
+    """
+    base_url_str = (base_url or cfg.onos_url).geturl()
+    new_client = OnosClient(base_url, credentials, max_concurrency, timeout)
+    with _onos_clients_lock:
+        old_client = _onos_clients.get(base_url_str)
+        _onos_clients[base_url_str] = new_client
+    if old_client is not None:
+        old_client.close()
+    return new_client
@@ -6,6 +6,7 @@ means but I haven't thought of a better way to do this yet.
 """
 
 import urllib.parse as url
+import pathlib      as path
 
 # DNS Server IP for OpenFlow Network
 dns_server_ip = '10.0.0.1'
@@ -28,3 +29,6 @@ ONOS_API_CREDENTIALS = ("onos", "rocks")
 
 # See dns_server_ip
 man_net_dns_ip = dns_server_ip
+
+# Cache of previously computed mappings between target topology node IDs and ONOS DPIDs.
+topo_mapping_cache_file = path.Path("/tmp/cpsc-of-testbed-topo-mapping-cache.json")
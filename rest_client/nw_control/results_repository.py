@@ -4,8 +4,213 @@ import nw_control.util      as util
 import shutil               as shutil
 import json                 as json
 import pickle               as pickle
+import numbers              as numbers
+import numpy                as np
 
-from functools              import reduce
+import nw_control.link_utilization  as link_utilization
+from functools                  import reduce
+from nw_control.trial_provider  import Trial, ParameterReference
+
+class ColumnarParameter(ParameterReference):
+    """
+    Class: ColumnarParameter
+    Purpose: Lightweight stand-in for a large numeric trial parameter whose data has
+    been written to .npy blobs next to the trial provider. Only the blob file names 
+    and the small amount of metadata needed to rebuild the original value are pickled 
+    with the trial. The blobs are opened with np.load(mmap_mode="r") so that reading 
+    a provider does not touch the data until it is actually used.
+
+    Supported parameter layouts (kind):
+        ndarray         : A numpy array.
+        link-records    : [[record]] where every record is a dict with the same fields,
+                          e.g. the byte-counts-over-time parameter. The non-numeric fields 
+                          identify a link, every numeric field becomes a (T x L) column.
+        keyed-series    : [key -> number], e.g. the link-utilization-over-time parameter.
+    """
+
+    def __init__(self, kind, blob_names, metadata):
+        self._kind          = kind
+        self._blob_names    = blob_names
+        self._metadata      = metadata
+        self._base_path     = None
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def blob_names(self):
+        return self._blob_names
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    def bind(self, base_path):
+        self._base_path = base_path
+
+    def load_arrays(self, mmap_mode="r"):
+        """
+        RETURNS
+            column_name -> array for each of the blobs backing this parameter.
+        """
+        if self._base_path == None:
+            raise ValueError("ColumnarParameter has not been bound to a results directory.")
+        return {column_name: np.load(self._base_path / blob_name, mmap_mode=mmap_mode)
+                for column_name, blob_name in self._blob_names.items()}
+
+    def get_counter_matrix(self, mmap_mode="r"):
+        """
+        RETURNS
+            A LinkCounterMatrix backed by the memory mapped blobs of a link-records
+            parameter that was built from OnMonitor byte counts.
+        """
+        if self._kind != "link-records":
+            raise ValueError("Cannot build a LinkCounterMatrix from a %s parameter." % self._kind)
+        arrays = self.load_arrays(mmap_mode)
+        return link_utilization.LinkCounterMatrix(self._metadata["keys"], arrays["bytesSent"],
+                arrays["bytesReceived"], arrays["present"])
+
+    def resolve(self):
+        arrays = self.load_arrays()
+        if self._kind == "ndarray":
+            return arrays["values"]
+        elif self._kind == "link-records":
+            return ColumnarParameter._decode_link_records(self._metadata, arrays)
+        elif self._kind == "keyed-series":
+            return ColumnarParameter._decode_keyed_series(self._metadata, arrays)
+        raise ValueError("Unrecognized columnar parameter kind %s" % self._kind)
+
+    def __getstate__(self):
+        # The base path is reassigned when the provider is read.
+        state = self.__dict__.copy()
+        state["_base_path"] = None
+        return state
+
+    def __repr__(self):
+        return "ColumnarParameter(%s, %s)" % (self._kind, list(self._blob_names.values()))
+
+    @staticmethod
+    def _is_number(value):
+        return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+    @staticmethod
+    def _column_dtype(values):
+        return np.int64 if all(isinstance(v, numbers.Integral) for v in values) else np.float64
+
+    @staticmethod
+    def encode(value):
+        """
+        RETURNS
+            (kind, metadata, column_name -> array) or None if value does not have one of 
+            the supported layouts.
+        """
+        if isinstance(value, np.ndarray):
+            # Arrays of objects can only be read back from .npy files by unpickling them.
+            if value.dtype.hasobject:
+                return None
+            return "ndarray", {}, {"values": value}
+        if not isinstance(value, list) or len(value) == 0:
+            return None
+        if all(isinstance(snapshot, list) for snapshot in value):
+            return ColumnarParameter._encode_link_records(value)
+        if all(isinstance(snapshot, dict) for snapshot in value):
+            return ColumnarParameter._encode_keyed_series(value)
+        return None
+
+    @staticmethod
+    def _encode_link_records(snapshots):
+        first_record = next((r for snapshot in snapshots for r in snapshot), None)
+        if not isinstance(first_record, dict):
+            return None
+        field_names = list(first_record.keys())
+        key_fields = [f for f in field_names if not ColumnarParameter._is_number(first_record[f])]
+        value_fields = [f for f in field_names if f not in key_fields]
+        link_index = {}
+        for snapshot in snapshots:
+            for record in snapshot:
+                if (not isinstance(record, dict) or list(record.keys()) != field_names or
+                        not all(ColumnarParameter._is_number(record[f]) for f in value_fields)):
+                    return None
+                link_key = tuple(record[f] for f in key_fields)
+                if link_key not in link_index:
+                    link_index[link_key] = len(link_index)
+
+        shape = (len(snapshots), len(link_index))
+        present = np.zeros(shape, dtype=bool)
+        # The position of each record within its snapshot so that the order is preserved.
+        positions = np.full(shape, -1, dtype=np.int32)
+        columns = {f: [[0] * shape[1] for _ in snapshots] for f in value_fields}
+        for t_idx, snapshot in enumerate(snapshots):
+            for position, record in enumerate(snapshot):
+                link_idx = link_index[tuple(record[f] for f in key_fields)]
+                if present[t_idx, link_idx]:
+                    # Duplicated links can't be represented in a single cell.
+                    return None
+                present[t_idx, link_idx] = True
+                positions[t_idx, link_idx] = position
+                for f in value_fields:
+                    columns[f][t_idx][link_idx] = record[f]
+
+        arrays = {"present": present, "positions": positions}
+        for f in value_fields:
+            flat_values = [v for row in columns[f] for v in row]
+            arrays[f] = np.array(columns[f], dtype=ColumnarParameter._column_dtype(flat_values))
+        metadata = { "field_names"  : field_names
+                   , "key_fields"   : key_fields
+                   , "keys"         : list(link_index.keys())
+                   }
+        return "link-records", metadata, arrays
+
+    @staticmethod
+    def _decode_link_records(metadata, arrays):
+        field_names, key_fields, keys = (metadata["field_names"], metadata["key_fields"],
+                metadata["keys"])
+        value_fields = [f for f in field_names if f not in key_fields]
+        positions = np.asarray(arrays["positions"])
+        columns = {f: np.asarray(arrays[f]).tolist() for f in value_fields}
+        snapshots = []
+        for t_idx, positions_t in enumerate(positions):
+            snapshot = []
+            for link_idx in np.argsort(positions_t, kind="stable").tolist():
+                if positions_t[link_idx] < 0:
+                    continue
+                record_values = dict(zip(key_fields, keys[link_idx]))
+                for f in value_fields:
+                    record_values[f] = columns[f][t_idx][link_idx]
+                snapshot.append({f: record_values[f] for f in field_names})
+            snapshots.append(snapshot)
+        return snapshots
+
+    @staticmethod
+    def _encode_keyed_series(series):
+        key_index = {}
+        for sample in series:
+            for key, v in sample.items():
+                if not ColumnarParameter._is_number(v):
+                    return None
+                if key not in key_index:
+                    key_index[key] = len(key_index)
+        shape = (len(series), len(key_index))
+        rows = [[0] * shape[1] for _ in series]
+        present = np.zeros(shape, dtype=bool)
+        for t_idx, sample in enumerate(series):
+            for key, v in sample.items():
+                rows[t_idx][key_index[key]] = v
+                present[t_idx, key_index[key]] = True
+        all_values = [v for sample in series for v in sample.values()]
+        arrays = { "values"     : np.array(rows, dtype=ColumnarParameter._column_dtype(all_values))
+                 , "present"    : present
+                 }
+        return "keyed-series", {"keys": list(key_index.keys())}, arrays
+
+    @staticmethod
+    def _decode_keyed_series(metadata, arrays):
+        keys = metadata["keys"]
+        return [{keys[k_idx]: v for k_idx, (v, is_present) in enumerate(zip(values_t, present_t))
+                if is_present}
+                for values_t, present_t in zip(np.asarray(arrays["values"]).tolist(), 
+                    np.asarray(arrays["present"]).tolist())]
 
 # The repository will be rooted at {base_path}.
 # When a repository, or a handle to a repository is created, is created a schema is provided.
@@ -22,6 +227,10 @@ from functools              import reduce
 # a repository handle.
 class ResultsRepository:
     REPO_METADATA_FILE = path.Path(".results_repo")
+    # Trial parameters containing at least this many numeric values are written to 
+    # columnar blobs instead of being pickled along with the trial.
+    COLUMNAR_MIN_VALUES = 1024
+    COLUMNAR_DIR = path.Path("columnar")
     
     def __init__(self, base_path, schema, repository_name):
         self._base_path         = base_path
@@ -105,17 +314,84 @@ class ResultsRepository:
                     {t_j.get_parameter("trial-name") for t_j in trial_provider})
             if len(name_intersection) != 0 and not overwrite:
                 raise ValueError("Attempting to overwrite trials with the same name without specifying overwrite")
+            ResultsRepository._bind_columnar_parameters(output_path, the_existing_provider)
             for duplicated_name in name_intersection:
+                overwritten_trials = the_existing_provider.get_all_trials_that_match(
+                        lambda t: t.get_parameter("trial-name") == duplicated_name)
+                for overwritten_trial in overwritten_trials:
+                    ResultsRepository._remove_columnar_parameters(output_path, overwritten_trial)
                 the_existing_provider.remove_all_trials_that_match(
                         lambda t: t.get_parameter("trial-name") == duplicated_name)
 
             if merge_existing:
                 for t_i in the_existing_provider:
                     trial_provider.add_trial(t_i)
+            else:
+                for t_i in the_existing_provider:
+                    ResultsRepository._remove_columnar_parameters(output_path, t_i)
 
+        for the_trial in trial_provider:
+            self._write_columnar_parameters(output_path, the_trial)
         with provider_output_file.open("wb") as fd:
             pickle.dump(trial_provider, fd)
 
+    @staticmethod
+    def _count_numeric_values(encoded_arrays):
+        return sum(a.size for column_name, a in encoded_arrays.items() 
+                if column_name not in {"present", "positions"})
+
+    def _write_columnar_parameters(self, output_path, the_trial):
+        """
+        Replace each of the large numeric parameters of the_trial with a ColumnarParameter
+        and write the parameter's data to .npy blobs under output_path.
+        """
+        if not isinstance(the_trial, Trial):
+            return
+        for parameter_name in the_trial.parameter_names:
+            parameter_value = the_trial.get_raw_parameter(parameter_name)
+            if isinstance(parameter_value, ParameterReference):
+                continue
+            encoded = ColumnarParameter.encode(parameter_value)
+            if encoded == None:
+                continue
+            kind, metadata, arrays = encoded
+            if ResultsRepository._count_numeric_values(arrays) < ResultsRepository.COLUMNAR_MIN_VALUES:
+                continue
+
+            blob_dir = ResultsRepository.COLUMNAR_DIR / the_trial.get_parameter("id")
+            (output_path / blob_dir).mkdir(parents=True, exist_ok=True)
+            blob_names = {}
+            for column_name, column_array in arrays.items():
+                blob_name = blob_dir / ("%s.%s.npy" % (parameter_name, column_name))
+                np.save(output_path / blob_name, column_array)
+                blob_names[column_name] = str(blob_name)
+            columnar_parameter = ColumnarParameter(kind, blob_names, metadata)
+            columnar_parameter.bind(output_path)
+            the_trial.update_parameter(parameter_name, columnar_parameter)
+
+    @staticmethod
+    def _get_columnar_parameters(the_trial):
+        if not isinstance(the_trial, Trial):
+            return []
+        return [the_trial.get_raw_parameter(parameter_name) 
+                for parameter_name in the_trial.parameter_names
+                if isinstance(the_trial.get_raw_parameter(parameter_name), ColumnarParameter)]
+
+    @staticmethod
+    def _bind_columnar_parameters(provider_path, the_provider):
+        for the_trial in the_provider:
+            for columnar_parameter in ResultsRepository._get_columnar_parameters(the_trial):
+                columnar_parameter.bind(provider_path)
+
+    @staticmethod
+    def _remove_columnar_parameters(provider_path, the_trial):
+        for columnar_parameter in ResultsRepository._get_columnar_parameters(the_trial):
+            for blob_name in columnar_parameter.blob_names.values():
+                blob_path = provider_path / blob_name
+                blob_path.unlink(missing_ok=True)
+                if blob_path.parent.exists() and not any(blob_path.parent.iterdir()):
+                    blob_path.parent.rmdir()
+
     def read_trial_results(self, schema_variables, file_names):
         output_path_segments = [schema_variables[schema_label] for schema_label in
                 self.schema.split("/") if schema_label != ""]
@@ -132,8 +408,9 @@ class ResultsRepository:
     def read_trial_provider(self, provider_name):
         provider_file = self.base_path / provider_name / "trial-provider.p"
         with provider_file.open("rb") as fd:
-            trial_provider = pickle.load(fd)
-        return trial_provider
+            the_provider = pickle.load(fd)
+        ResultsRepository._bind_columnar_parameters(provider_file.parent, the_provider)
+        return the_provider
 
     @staticmethod
     def repository_exists(base_path):
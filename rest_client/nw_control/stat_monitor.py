@@ -1,11 +1,15 @@
 import requests     as req
 import json         as json
 import numpy        as np
+import pathlib      as path
+import threading    as threading
+import time         as time
+import urllib.parse as url
 
-from collections    import defaultdict
+import nw_control.link_utilization as link_utilization
 
-def compute_link_key(source_id, destination_id):
-    return tuple(sorted((source_id, destination_id)))
+from nw_control.link_utilization import compute_link_key
+from nw_control.onos_client      import get_onos_client
 
 def compute_link_utilization_over_time(link_byte_counts):
     """
@@ -18,43 +22,9 @@ def compute_link_utilization_over_time(link_byte_counts):
     RETURNS 
         tx_rate_t: (source_id x destination_id) -> link_utilization_in_time_period_t forall. t
     """
-    def find_matching_iface_stats(byte_count, source_id, destination_id):
-        matching_stats = [d_i for d_i in byte_count
-                if d_i["sourceSwitchId"] == source_id and
-                d_i["destinationSwitchId"] == destination_id]
-        if len(matching_stats) != 1:
-            raise ValueError("Unexpected results in find_matching_iface_stats. \
-                    Found %d matching iface_stats" % len(matching_stats))
-        return matching_stats[0]
-
-    def compute_tx_rate(count_in_bytes):
-        return (count_in_bytes * 8) / 10.0 / 2**20
-
-    # pp.pprint(len(link_byte_counts[0])) 
-    # First compute the delta between the iface_stats in time_period t_i and the iface_stats
-    # in time period t_{i+1}.
-    # tx_rate_t: (source_id x destination_id) -> link_utilization_in_time_period_t forall. t
-    tx_rate_t = []
-    for t_0, t_1 in zip(link_byte_counts, link_byte_counts[1:]):
-        byte_count_delta_t = defaultdict(float)
-        for iface_stats in t_0:
-            source_id = iface_stats["sourceSwitchId"]
-            destination_id = iface_stats["destinationSwitchId"]
-            t_0_count = iface_stats["bytesSent"] # + iface_stats["bytesReceived"]
-            try:
-                t_1_stats = find_matching_iface_stats(t_1, source_id, destination_id)
-                t_1_count = t_1_stats["bytesSent"] # + t_1_stats["bytesReceived"]
-            except ValueError:
-                t_1_count = t_0_count
-
-            count_delta = t_1_count - t_0_count
-            link_key = compute_link_key(source_id, 
-                    destination_id)
-            byte_count_delta_t[link_key] += count_delta
-
-        tx_rate_t.append({the_link_key: compute_tx_rate(byte_count_t) 
-            for the_link_key, byte_count_t in byte_count_delta_t.items()})
-    return tx_rate_t
+    link_keys, tx_rates, valid = link_utilization.compute_folded_link_rates(link_byte_counts,
+            link_utilization.ByteCounter.SENT, 8 / 10.0 / 2**20)
+    return link_utilization.LinkCounterMatrix.to_dicts(link_keys, tx_rates, valid)
 
 def compute_mean_link_utilization(link_byte_counts):
     """
@@ -64,24 +34,10 @@ def compute_mean_link_utilization(link_byte_counts):
     RETURNS
         link_util: (source_id x destination_id) -> mean link utilization
     """
-    def collect_all_link_keys(link_util_t):
-        link_keys = set()
-        for t_i in link_util_t:
-            for link_key in t_i.keys():
-                link_keys.add(link_key)
-        return link_keys
-
-    link_util_t = compute_link_utilization_over_time(link_byte_counts)
-    link_keys = collect_all_link_keys(link_util_t)
-    mean_link_utils = {}
-    for link_key in link_keys:
-
-        link_util_over_time = [d_i[link_key] for d_i in link_util_t if link_key in d_i]
-        mean_link_util = np.mean(link_util_over_time)
-        mean_link_utils[link_key] = mean_link_util
-
-    return mean_link_utils
-
+    link_keys, tx_rates, valid = link_utilization.compute_folded_link_rates(link_byte_counts,
+            link_utilization.ByteCounter.SENT, 8 / 10.0 / 2**20)
+    mean_link_utils = link_utilization.LinkCounterMatrix.mean_over_time(tx_rates, valid)
+    return link_utilization.LinkCounterMatrix.to_column_dict(link_keys, mean_link_utils)
 
 class OnMonitor:
 
@@ -91,16 +47,15 @@ class OnMonitor:
         self._onos_controller_ip        = onos_controller_ip
         self._onos_controller_port      = onos_controller_port
         self._monitor_token             = None
-        self._credentials               = ("onos", "rocks")
+        self._onos_client               = get_onos_client(url.urlparse("http://%s:%d/onos/" %
+            (onos_controller_ip, onos_controller_port)))
         self._stop_monitor_response     = None
 
     def start_monitor(self):
         if self._monitor_token != None:
             raise ValueError("Monitor is already running.")
 
-        on_mon_url = ("http://%s:%d/onos/on-mon/v1/start-monitor" % 
-                (self._onos_controller_ip, self._onos_controller_port))
-        start_monitor_request = req.post(on_mon_url, auth=self._credentials)
+        start_monitor_request = self._onos_client.post("on-mon/v1/start-monitor")
         if start_monitor_request.status_code == 200:
             start_monitor_response = json.loads(start_monitor_request.text)
             self._monitor_token = start_monitor_response["token"]
@@ -112,9 +67,8 @@ class OnMonitor:
         if self._monitor_token == None:
             raise ValueError("Monitor was not running.")
 
-        on_mon_url = ("http://%s:%d/onos/on-mon/v1/stop-monitor?monitor-token=%s" %
-                (self._onos_controller_ip, self._onos_controller_port, self._monitor_token))
-        stop_monitor_request = req.post(on_mon_url, auth=self._credentials)
+        stop_monitor_request = self._onos_client.post(
+                "on-mon/v1/stop-monitor?monitor-token=%s" % self._monitor_token)
         if stop_monitor_request.status_code == 200:
             stop_monitor_response = json.loads(stop_monitor_request.text)
             self._stop_monitor_response = stop_monitor_response
@@ -127,3 +81,275 @@ class OnMonitor:
         if self._stop_monitor_response == None:
             raise ValueError("No results have been collected yet! Did you remember to start/stop the monitor.")
         return [d["netUtilStats"]["utilizationStats"] for d in self._stop_monitor_response]
+
+class ColumnarLinkLog:
+    """
+    Class: ColumnarLinkLog
+    Purpose: Append-only on-disk log of the counters collected by the 
+    StreamingOnMonitor. Each column is stored in its own flat binary file so that 
+    a row can be appended without rewriting anything and the complete log can be 
+    read back with np.fromfile (or memory mapped) without any parsing.
+    """
+
+    LINK_IDS_FILE   = "link_ids.json"
+    COLUMNS         = { "timestamps"        : np.float64
+                      , "bytes_sent"        : np.int64
+                      , "bytes_received"    : np.int64
+                      , "present"           : np.bool_
+                      }
+
+    def __init__(self, log_dir, link_ids):
+        self._log_dir = path.Path(log_dir)
+        self._log_dir.mkdir(parents=True, exist_ok=True)
+        (self._log_dir / ColumnarLinkLog.LINK_IDS_FILE).write_text(json.dumps(link_ids))
+        self._column_files = {column_name: (self._log_dir / column_name).open("wb")
+                for column_name in ColumnarLinkLog.COLUMNS}
+
+    def append(self, timestamp, bytes_sent, bytes_received, present):
+        row = { "timestamps"        : np.array([timestamp])
+              , "bytes_sent"        : bytes_sent
+              , "bytes_received"    : bytes_received
+              , "present"           : present
+              }
+        for column_name, column_dtype in ColumnarLinkLog.COLUMNS.items():
+            column_file = self._column_files[column_name]
+            column_file.write(np.asarray(row[column_name], dtype=column_dtype).tobytes())
+            column_file.flush()
+
+    def close(self):
+        for column_file in self._column_files.values():
+            column_file.close()
+
+    @staticmethod
+    def read(log_dir, mmap_mode=None):
+        """
+        RETURNS
+            (timestamps, LinkCounterMatrix) for all of the rows in the log.
+        """
+        log_dir = path.Path(log_dir)
+        link_ids = [tuple(link_id) for link_id in 
+                json.loads((log_dir / ColumnarLinkLog.LINK_IDS_FILE).read_text())]
+        columns = {}
+        for column_name, column_dtype in ColumnarLinkLog.COLUMNS.items():
+            column_path = log_dir / column_name
+            if mmap_mode != None and column_path.stat().st_size > 0:
+                columns[column_name] = np.memmap(column_path, dtype=column_dtype, mode=mmap_mode)
+            else:
+                columns[column_name] = np.fromfile(column_path, dtype=column_dtype)
+        # Ignore a partially written trailing row, i.e. if the monitor was killed mid-write.
+        link_count = len(link_ids)
+        row_count = min([len(columns["timestamps"])] + [len(columns[column_name]) // max(link_count, 1)
+            for column_name in ["bytes_sent", "bytes_received", "present"]])
+        shape = (row_count, link_count)
+        counter_matrix = link_utilization.LinkCounterMatrix(link_ids,
+                columns["bytes_sent"][:row_count * link_count].reshape(shape),
+                columns["bytes_received"][:row_count * link_count].reshape(shape),
+                columns["present"][:row_count * link_count].reshape(shape))
+        return columns["timestamps"][:row_count], counter_matrix
+
+class StreamingOnMonitor:
+    """
+    Class: StreamingOnMonitor
+    Purpose: Drop in replacement for OnMonitor that polls the port counters of every
+    infrastructure link from a background thread on a fixed schedule instead of 
+    collecting all of the samples at once when the monitor is stopped. 
+
+    The most recent HISTORY_LENGTH snapshots are held in a ring buffer, and running 
+    aggregates (mean, max and percentiles of the transmit rate in bytes per second) 
+    are maintained for every link so that they can be queried while the trial is 
+    still running. If log_dir is provided every snapshot is also appended to a 
+    ColumnarLinkLog so that the complete trial can be recovered afterwards.
+
+    The set of links is fixed when the monitor is started.
+    """
+
+    MONITOR_PERIOD      = 10 # Seconds
+    HISTORY_LENGTH      = 360 # Snapshots
+    REQUEST_TIMEOUT     = 5.0 # Seconds
+
+    def __init__( self
+                , onos_controller_ip
+                , onos_controller_port
+                , monitor_period    = None
+                , history_length    = None
+                , log_dir           = None):
+        self._onos_controller_ip        = onos_controller_ip
+        self._onos_controller_port      = onos_controller_port
+        self._onos_client               = get_onos_client(url.urlparse("http://%s:%d/onos/" %
+            (onos_controller_ip, onos_controller_port)))
+        self._monitor_period            = monitor_period or StreamingOnMonitor.MONITOR_PERIOD
+        self._history_length            = history_length or StreamingOnMonitor.HISTORY_LENGTH
+        self._log_dir                   = log_dir
+        self._lock                      = threading.Lock()
+        self._stop_event                = threading.Event()
+        self._poll_thread               = None
+        self._link_ids                  = None
+        self._aggregates                = None
+        self._missed_polls              = 0
+        self._failed_polls              = 0
+
+    def _get_json(self, endpoint):
+        response = self._onos_client.get("v1/%s" % endpoint,
+                timeout=StreamingOnMonitor.REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            raise ValueError("Failed to GET %s from ONOS controller. Status %d, Reason %s." %
+                    (endpoint, response.status_code, response.reason))
+        return json.loads(response.text)
+
+    def _build_link_index(self):
+        links = [link for link in self._get_json("links")["links"] if link["type"] != "EDGE"]
+        self._link_ids = [(link["src"]["device"], link["dst"]["device"]) for link in links]
+        # Each link is measured by the counters of the port on its source switch.
+        self._port_index = {(link["src"]["device"], str(link["src"]["port"])): link_idx
+                for link_idx, link in enumerate(links)}
+
+    def start_monitor(self):
+        if self._poll_thread != None:
+            raise ValueError("Monitor is already running.")
+
+        self._build_link_index()
+        link_count = len(self._link_ids)
+        self._timestamps        = np.zeros(self._history_length, dtype=np.float64)
+        self._bytes_sent        = np.zeros((self._history_length, link_count), dtype=np.int64)
+        self._bytes_received    = np.zeros((self._history_length, link_count), dtype=np.int64)
+        self._present           = np.zeros((self._history_length, link_count), dtype=bool)
+        self._sample_count      = 0
+        self._latest_rates      = np.full(link_count, np.nan)
+        self._aggregates        = link_utilization.RunningLinkAggregates(self._link_ids)
+        self._missed_polls      = 0
+        self._failed_polls      = 0
+        self._columnar_log      = (ColumnarLinkLog(self._log_dir, self._link_ids) 
+                if self._log_dir != None else None)
+
+        self._stop_event.clear()
+        self._poll_thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self._poll_thread.start()
+
+    def stop_monitor(self):
+        if self._poll_thread == None:
+            raise ValueError("Monitor was not running.")
+
+        self._stop_event.set()
+        self._poll_thread.join()
+        self._poll_thread = None
+        if self._columnar_log != None:
+            self._columnar_log.close()
+
+    def _poll_loop(self):
+        next_poll_time = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                self._poll()
+            except (req.exceptions.RequestException, ValueError, KeyError):
+                self._failed_polls += 1
+            # Keep to the original schedule rather than sleeping for a full period after 
+            # each poll so that the polling period does not drift.
+            next_poll_time += self._monitor_period
+            now = time.monotonic()
+            if next_poll_time < now:
+                skipped_polls = int((now - next_poll_time) // self._monitor_period) + 1
+                self._missed_polls += skipped_polls
+                next_poll_time += skipped_polls * self._monitor_period
+            self._stop_event.wait(next_poll_time - now)
+
+    def _poll(self):
+        port_stats = self._get_json("statistics/ports")["statistics"]
+        timestamp = time.monotonic()
+        link_count = len(self._link_ids)
+        bytes_sent = np.zeros(link_count, dtype=np.int64)
+        bytes_received = np.zeros(link_count, dtype=np.int64)
+        present = np.zeros(link_count, dtype=bool)
+        for device_stats in port_stats:
+            device_id = device_stats["device"]
+            for port in device_stats["ports"]:
+                link_idx = self._port_index.get((device_id, str(port["port"])))
+                if link_idx != None:
+                    bytes_sent[link_idx]        = port["bytesSent"]
+                    bytes_received[link_idx]    = port["bytesReceived"]
+                    present[link_idx]           = True
+        self._add_snapshot(timestamp, bytes_sent, bytes_received, present)
+
+    def _add_snapshot(self, timestamp, bytes_sent, bytes_received, present):
+        with self._lock:
+            slot = self._sample_count % self._history_length
+            if self._sample_count > 0:
+                prev_slot = (self._sample_count - 1) % self._history_length
+                elapsed = timestamp - self._timestamps[prev_slot]
+                deltas = bytes_sent - self._bytes_sent[prev_slot]
+                # A negative delta means the counters were reset, so there is no valid sample.
+                valid = present & self._present[prev_slot] & (deltas >= 0)
+                rates = np.where(valid, deltas / elapsed, np.nan)
+                self._aggregates.update(rates, valid)
+                self._latest_rates = rates
+            self._timestamps[slot]      = timestamp
+            self._bytes_sent[slot]      = bytes_sent
+            self._bytes_received[slot]  = bytes_received
+            self._present[slot]         = present
+            self._sample_count += 1
+        if self._columnar_log != None:
+            self._columnar_log.append(timestamp, bytes_sent, bytes_received, present)
+
+    def _get_retained_slots(self):
+        retained_count = min(self._sample_count, self._history_length)
+        first_sample = self._sample_count - retained_count
+        return [sample_idx % self._history_length 
+                for sample_idx in range(first_sample, self._sample_count)]
+
+    def get_counter_matrix(self):
+        """
+        RETURNS
+            A LinkCounterMatrix of the snapshots that are currently held in the ring buffer,
+            ordered from oldest to newest.
+        """
+        with self._lock:
+            slots = self._get_retained_slots()
+            return link_utilization.LinkCounterMatrix(list(self._link_ids), 
+                    self._bytes_sent[slots], self._bytes_received[slots], self._present[slots])
+
+    def get_monitor_statistics(self):
+        """
+        Returns the retained snapshots in the same format as OnMonitor.get_monitor_statistics.
+        """
+        if self._aggregates == None:
+            raise ValueError("No results have been collected yet! Did you remember to start the monitor.")
+        counter_matrix = self.get_counter_matrix()
+        bytes_sent_t = counter_matrix.get_counts(link_utilization.ByteCounter.SENT).tolist()
+        bytes_received_t = counter_matrix.get_counts(link_utilization.ByteCounter.RECEIVED).tolist()
+        snapshots = []
+        for t_idx, (bytes_sent, bytes_received) in enumerate(zip(bytes_sent_t, bytes_received_t)):
+            snapshots.append([{ "sourceSwitchId"        : source_id
+                              , "destinationSwitchId"   : destination_id
+                              , "bytesSent"             : bytes_sent[link_idx]
+                              , "bytesReceived"         : bytes_received[link_idx]
+                              } for link_idx, (source_id, destination_id) 
+                              in enumerate(counter_matrix.link_ids)
+                              if counter_matrix.present[t_idx, link_idx]])
+        return snapshots
+
+    def _aggregate_to_dict(self, aggregate_fn):
+        if self._aggregates == None:
+            raise ValueError("No results have been collected yet! Did you remember to start the monitor.")
+        with self._lock:
+            column_values = aggregate_fn(self._aggregates)
+        return link_utilization.LinkCounterMatrix.to_column_dict(self._link_ids, column_values)
+
+    def get_mean_tx_rates(self):
+        return self._aggregate_to_dict(lambda aggregates: aggregates.get_mean())
+
+    def get_max_tx_rates(self):
+        return self._aggregate_to_dict(lambda aggregates: aggregates.get_max())
+
+    def get_percentile_tx_rates(self, q):
+        return self._aggregate_to_dict(lambda aggregates: aggregates.get_percentile(q))
+
+    def get_latest_tx_rates(self):
+        return self._aggregate_to_dict(lambda aggregates: self._latest_rates)
+
+    def get_sample_count(self):
+        return self._sample_count
+
+    def get_missed_poll_count(self):
+        return self._missed_polls
+
+    def get_failed_poll_count(self):
+        return self._failed_polls
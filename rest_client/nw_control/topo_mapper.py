@@ -2,10 +2,13 @@ import urllib.parse         as url
 import networkx             as nx
 import requests             as req
 import json                 as json
+import hashlib              as hashlib
 
 import nw_control.params            as cfg
 import port_mirroring.params        as pm_cfg
 
+from nw_control.onos_client     import get_onos_client
+
 def build_graph_from_topo_file(topo_file):
     text = topo_file.read_text()
     return build_graph_from_topo_string(text)
@@ -23,26 +26,206 @@ def build_graph_from_topo_string(topo_str):
 
     return graph
 
-def generate_graph_isomorphism(g1, g2):
-    graph_matcher = nx.algorithms.isomorphism.GraphMatcher(g1, g2)
-    if not graph_matcher.is_isomorphic():
+def _refine_colors(g1, g2, colors1, colors2):
+    """
+    Jointly refine the node colorings of g1 and g2 (1-dimensional Weisfeiler-Lehman)
+    until the partitions stop splitting. Colors are relabelled with a shared mapping
+    so that a color means the same thing in both graphs.
+    """
+    class_count = -1
+    while True:
+        signatures1 = {n: (colors1[n], tuple(sorted(colors1[m] for m in g1[n]))) for n in g1}
+        signatures2 = {n: (colors2[n], tuple(sorted(colors2[m] for m in g2[n]))) for n in g2}
+        relabel = {sig: idx for idx, sig in
+                enumerate(sorted(set(signatures1.values()) | set(signatures2.values())))}
+        colors1 = {n: relabel[sig] for n, sig in signatures1.items()}
+        colors2 = {n: relabel[sig] for n, sig in signatures2.items()}
+        if len(relabel) == class_count:
+            return colors1, colors2
+        class_count = len(relabel)
+
+def _color_classes(colors):
+    classes = {}
+    for node in sorted(colors.keys()):
+        classes.setdefault(colors[node], []).append(node)
+    return classes
+
+def _is_isomorphism(g1, g2, mapping):
+    return (g1.number_of_edges() == g2.number_of_edges() and
+            all(g2.has_edge(mapping[u], mapping[v]) for u, v in g1.edges()))
+
+def _search_isomorphism(g1, g2, colors1, colors2):
+    colors1, colors2 = _refine_colors(g1, g2, colors1, colors2)
+    classes1 = _color_classes(colors1)
+    classes2 = _color_classes(colors2)
+    if {c: len(ns) for c, ns in classes1.items()} != {c: len(ns) for c, ns in classes2.items()}:
+        return None
+
+    ambiguous_classes = [c for c, ns in classes1.items() if len(ns) > 1]
+    if len(ambiguous_classes) == 0:
+        mapping = {classes1[c][0]: classes2[c][0] for c in classes1}
+        return mapping if _is_isomorphism(g1, g2, mapping) else None
+
+    # Individualize a node from the smallest ambiguous class and try each candidate
+    # it could map to, backtracking if the refinement leads to a contradiction.
+    split_color = min(ambiguous_classes, key=lambda c: len(classes1[c]))
+    fresh_color = max(max(colors1.values()), max(colors2.values())) + 1
+    source_node = classes1[split_color][0]
+    for candidate_node in classes2[split_color]:
+        mapping = _search_isomorphism(g1, g2, {**colors1, source_node: fresh_color},
+                {**colors2, candidate_node: fresh_color})
+        if mapping is not None:
+            return mapping
+    return None
+
+def generate_graph_isomorphism(g1, g2, hints=None):
+    """
+    Find an isomorphism between g1 and g2 using color refinement seeded by node
+    degree. hints is an optional dict of g1 node -> g2 node pairs that are already
+    known to correspond; they're fixed before the refinement starts.
+
+    RETURNS
+        g1_node -> g2_node
+    """
+    if g1.number_of_nodes() != g2.number_of_nodes():
         raise ValueError("Trying to generate isomorphism for non-isomorphic graphs")
-    return graph_matcher.mapping
+    hints = hints or {}
+    colors1 = {n: (0, g1.degree(n)) for n in g1}
+    colors2 = {n: (0, g2.degree(n)) for n in g2}
+    for hint_idx, (g1_node, g2_node) in enumerate(hints.items()):
+        if g1_node not in g1 or g2_node not in g2:
+            raise ValueError("Hint %s -> %s refers to a node that is not in the graph" %
+                    (g1_node, g2_node))
+        colors1[g1_node] = (1, hint_idx)
+        colors2[g2_node] = (1, hint_idx)
+
+    mapping = _search_isomorphism(g1, g2, colors1, colors2)
+    if mapping is None:
+        raise ValueError("Trying to generate isomorphism for non-isomorphic graphs")
+    return mapping
+
+def compute_topology_fingerprint(*graphs):
+    """
+    Canonical fingerprint of the node and edge sets of a sequence of graphs.
+    """
+    def canonical_graph(graph):
+        nodes = sorted(str(n) for n in graph.nodes())
+        edges = sorted(sorted((str(u), str(v))) for u, v in graph.edges())
+        return [nodes, edges]
+    graph_json = json.dumps([canonical_graph(graph) for graph in graphs])
+    return hashlib.sha256(graph_json.encode("utf-8")).hexdigest()
+
+def _read_topo_mapping_cache():
+    try:
+        return json.loads(cfg.topo_mapping_cache_file.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def _write_topo_mapping_cache(fingerprint, id_to_dpid):
+    cache = _read_topo_mapping_cache()
+    cache[fingerprint] = [[node_id, dpid] for node_id, dpid in id_to_dpid.items()]
+    try:
+        cfg.topo_mapping_cache_file.write_text(json.dumps(cache))
+    except OSError as ex:
+        print("Failed to write topology mapping cache %s: %s" % 
+                (str(cfg.topo_mapping_cache_file), str(ex)))
+
+def map_target_topo_to_onos_topo(current_topo, target_topo, dpid_hints=None, use_cache=True):
+    """
+    Map the nodes of target_topo onto the DPIDs of current_topo. Mappings are cached
+    on disk, keyed by a fingerprint of both topologies, so that they only have to be
+    recomputed when the network changes.
 
-def get_collector_switch_dpid():
+    RETURNS
+        target_node_id -> dpid
+    """
+    fingerprint = compute_topology_fingerprint(current_topo, target_topo)
+    if use_cache and not dpid_hints:
+        cached_mapping = _read_topo_mapping_cache().get(fingerprint)
+        if cached_mapping is not None:
+            return {node_id: dpid for node_id, dpid in cached_mapping}
+
+    hints = {dpid: node_id for node_id, dpid in (dpid_hints or {}).items()}
+    dpid_to_id = generate_graph_isomorphism(current_topo, target_topo, hints)
+    id_to_dpid = {v: k for k, v in dpid_to_id.items()}
+    if use_cache:
+        _write_topo_mapping_cache(fingerprint, id_to_dpid)
+    return id_to_dpid
+
+class TopologySnapshot:
+    """
+    Snapshot of the links and hosts known to the ONOS controller. Each list is
+    requested at most once, the first time it's needed, and is indexed so that
+    port lookups don't require any further REST calls.
+    """
+    def __init__(self, links=None, hosts=None):
+        self._links         = links
+        self._hosts         = hosts
+        self._link_ports    = None
+        self._host_ports    = None
+
+    @property
+    def links(self):
+        if self._links is None:
+            self._links = get_nw_links()
+        return self._links
+
+    @property
+    def hosts(self):
+        if self._hosts is None:
+            self._hosts = get_nw_hosts()
+        return self._hosts
+
+    def _build_link_ports(self):
+        # (source_dpid, destination_dpid) -> (source_port, destination_port)
+        link_ports = {}
+        for link in self.links:
+            link_key = (link["src"]["device"], link["dst"]["device"])
+            link_ports.setdefault(link_key, (int(link["src"]["port"]), int(link["dst"]["port"])))
+        return link_ports
+
+    def _build_host_ports(self):
+        # switch_dpid -> port that the (non collector, non DNS) host is attached to.
+        host_ports = {}
+        for host in self.hosts:
+            if (pm_cfg.collector_ip_addr in host["ipAddresses"] or
+                    cfg.dns_server_ip in host["ipAddresses"]):
+                continue
+            for host_location in host["locations"]:
+                host_ports.setdefault(host_location["elementId"], int(host_location["port"]))
+        return host_ports
+
+    def get_ports_that_connect(self, source_dpid, destination_dpid):
+        if self._link_ports is None:
+            self._link_ports = self._build_link_ports()
+        try:
+            return self._link_ports[(source_dpid, destination_dpid)]
+        except KeyError:
+            raise ValueError("Could not find link connecting %s and %s" % 
+                    (source_dpid, destination_dpid))
+
+    def get_host_port(self, switch_dpid):
+        if self._host_ports is None:
+            self._host_ports = self._build_host_ports()
+        try:
+            return self._host_ports[switch_dpid]
+        except KeyError:
+            raise ValueError("Could not find host connected to switch with DPID %s" %
+                    switch_dpid)
+
+def get_collector_switch_dpid(snapshot=None):
     # request_url = url.urljoin(cfg.onos_url.geturl(), "v1/hosts")
     # hosts_request = req.get(request_url, auth=cfg.ONOS_API_CREDENTIALS)
     # if hosts_request.status_code != 200:
     #     raise ValueError("Failed to get hosts from ONOS controller. Stats %d %s." %
     #             (hosts_request.status_code, hosts_request.reason))
     # hosts = json.loads(hosts_request.text)["hosts"]
-    hosts = get_nw_hosts()
+    hosts = snapshot.hosts if snapshot else get_nw_hosts()
     collector_host = next(host for host in hosts if cfg.collector_host_ip in host["ipAddresses"])
     return collector_host["locations"][0]["elementId"]
 
 def get_nw_links():
-    request_url = url.urljoin(cfg.onos_url.geturl(), "v1/links")
-    links_request = req.get(request_url, auth=cfg.ONOS_API_CREDENTIALS)
+    links_request = get_onos_client().get("v1/links")
     if links_request.status_code != 200:
         raise ValueError("Failed to get links from ONOS controller. Status %d %s." %
                 (links_request.status_code, links_request.reason))
@@ -50,20 +233,19 @@ def get_nw_links():
     return [link for link in links["links"] if link["type"] != "EDGE"]
 
 def get_nw_hosts():
-    requests_url = url.urljoin(cfg.onos_url.geturl(), "v1/hosts")
-    hosts_request = req.get(requests_url, auth=cfg.ONOS_API_CREDENTIALS)
+    hosts_request = get_onos_client().get("v1/hosts")
     if hosts_request.status_code != 200:
         raise ValueError("Failed to get hosts from ONOS controller. Status %d %s." %
                 (hosts_request.status_code, hosts_request.reason))
     hosts = json.loads(hosts_request.text)
     return hosts["hosts"]
 
-def build_onos_topo_graph():
-    links = get_nw_links()
+def build_onos_topo_graph(snapshot=None):
+    links = snapshot.links if snapshot else get_nw_links()
     graph = nx.Graph()
     node_set = set()
     try:
-        collector_switch_dpid = get_collector_switch_dpid()
+        collector_switch_dpid = get_collector_switch_dpid(snapshot)
     except StopIteration:
         collector_switch_dpid = ""
 
@@ -83,26 +265,15 @@ def build_onos_topo_graph():
         graph.add_edge(source_dpid, destination_dpid)
     return graph
 
-def get_ports_that_connect(source_dpid, destination_dpid):
-    links = get_nw_links()
-    for link in links:
-        if link["src"]["device"] == source_dpid and link["dst"]["device"] == destination_dpid:
-            return (int(link["src"]["port"]), int(link["dst"]["port"]))
-    raise ValueError("Could not find link connecting %s and %s" % (source_dpid, destination_dpid))
-
-def get_host_port(switch_dpid):
-    hosts = get_nw_hosts()
-    for host in hosts:
-        host_locations = host["locations"]
-        for host_location in host_locations:
-            if (host_location["elementId"] == switch_dpid and 
-                    pm_cfg.collector_ip_addr not in host["ipAddresses"] and
-                    cfg.dns_server_ip not in host["ipAddresses"]):
-                return int(host_location["port"])
-    raise ValueError("Could not find host connected to switch with DPID %s" %
-            switch_dpid)
-
-def get_and_validate_onos_topo(target_topo_string):
+def get_ports_that_connect(source_dpid, destination_dpid, snapshot=None):
+    snapshot = snapshot or TopologySnapshot()
+    return snapshot.get_ports_that_connect(source_dpid, destination_dpid)
+
+def get_host_port(switch_dpid, snapshot=None):
+    snapshot = snapshot or TopologySnapshot()
+    return snapshot.get_host_port(switch_dpid)
+
+def get_and_validate_onos_topo(target_topo_string, snapshot=None, dpid_hints=None):
     def find_where_graphs_differ(target_graph, actual_graph):
         target_adj_list = target_graph.adj
         actual_adj_list = actual_graph.adj
@@ -111,21 +282,20 @@ def get_and_validate_onos_topo(target_topo_string):
                 print("Expected node %s to have edges to %s links. Found edges to %s" %
                         (actual_entry[0], target_entry[1].keys(), actual_entry[1].keys()))
 
-    current_topo = build_onos_topo_graph()
+    current_topo = build_onos_topo_graph(snapshot)
     target_topo = build_graph_from_topo_string(target_topo_string)
     try:
-        dpid_to_id = generate_graph_isomorphism(current_topo, target_topo)
+        id_to_dpid = map_target_topo_to_onos_topo(current_topo, target_topo, dpid_hints)
     except ValueError as ex:
         print("Failed to find isomorphism between current ONOS topology and target topology.")
         find_where_graphs_differ(target_topo, current_topo)
         raise ex
         
-    id_to_dpid = {v: k for k, v in dpid_to_id.items()}
     return id_to_dpid
 
 # @TODO: This version takes a network X graph, the other version takes a string representation
 # of a list of edges in the network. Should change all calling code to use this version.
-def get_and_validate_onos_topo_x(target_topo):
+def get_and_validate_onos_topo_x(target_topo, snapshot=None, dpid_hints=None):
     def find_where_graphs_differ(target_graph, actual_graph):
         target_adj_list = target_graph.adj
         actual_adj_list = actual_graph.adj
@@ -133,20 +303,20 @@ def get_and_validate_onos_topo_x(target_topo):
             if actual_entry != target_entry:
                 print("Expected node %s to have edges to %s links. Found edges to %s" %
                         (actual_entry[0], target_entry[1].keys(), actual_entry[1].keys()))
-    current_topo = build_onos_topo_graph()
+    current_topo = build_onos_topo_graph(snapshot)
     try:
-        dpid_to_id = generate_graph_isomorphism(current_topo, target_topo)
+        id_to_dpid = map_target_topo_to_onos_topo(current_topo, target_topo, dpid_hints)
     except ValueError as ex:
         print("Failed to find isomorphism between current ONOS topology and target topology.")
         find_where_graphs_differ(target_topo, current_topo)
         raise ex
 
-    id_to_dpid = {v: k for k, v in dpid_to_id.items()}
     return id_to_dpid
 
 def verify_flows_against_nw_topo(target_topo_file, flows):
-    nw_graph = build_onos_topo_graph()
-    id_to_dpid = get_and_validate_onos_topo(target_topo_file.read_text())
+    snapshot = TopologySnapshot()
+    nw_graph = build_onos_topo_graph(snapshot)
+    id_to_dpid = get_and_validate_onos_topo(target_topo_file.read_text(), snapshot)
     invalid_edges = set()
     for flow_id, flow in flows.items():
         flow_path = flow.path
@@ -173,8 +343,7 @@ def verify_flows_against_target_topo(target_topo_file, flows):
     return invalid_edges
 
 def get_switch_mirroring_ports():
-    requests_url = url.urljoin(cfg.onos_url.geturl(), "port-mirroring/v1/mirroring-ports")
-    mirroring_ports_request = req.get(requests_url, auth=cfg.ONOS_API_CREDENTIALS)
+    mirroring_ports_request = get_onos_client().get("port-mirroring/v1/mirroring-ports")
     if mirroring_ports_request.status_code != 200:
         raise ValueError(
                 "Failed to get switch mirroring ports from ONOS controller. Status %d %s." % 
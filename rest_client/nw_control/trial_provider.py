@@ -1,6 +1,17 @@
 
 import random           as rand
 import pprint           as pp
+import abc              as abc
+
+class ParameterReference(abc.ABC):
+    """
+    Base class for trial parameter values that are stored outside of the trial itself.
+    Trial.get_parameter returns the result of resolve() in place of the reference.
+    """
+
+    @abc.abstractmethod
+    def resolve(self):
+        pass
 
 class Trial:
     def __init__(self, name):
@@ -13,6 +24,10 @@ class Trial:
     def name(self):
         return self._name
 
+    @property
+    def parameter_names(self):
+        return list(self._parameters.keys())
+
     def add_parameter( self
                      , parameter_name
                      , parameter_value):
@@ -30,6 +45,16 @@ class Trial:
         self._parameters[parameter_name] = parameter_value
 
     def get_parameter(self, property_name):
+        parameter_value = self.get_raw_parameter(property_name)
+        if isinstance(parameter_value, ParameterReference):
+            return parameter_value.resolve()
+        return parameter_value
+
+    def get_raw_parameter(self, property_name):
+        """
+        Same as get_parameter except that ParameterReference values are returned without
+        being resolved.
+        """
         if property_name not in self._parameters:
             raise ValueError("Attempting to access non-existent property %s in trial with name %s" %
                     (property_name, self.name))
@@ -44,8 +69,8 @@ class Trial:
         return s
 
     def __iter__(self):
-        for property_name, property_value in self._parameters.items():
-            yield (property_name, property_value)
+        for property_name in self._parameters:
+            yield (property_name, self.get_parameter(property_name))
 
     def __lt__(self, other):
         return self.name < other.name
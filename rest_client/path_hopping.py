@@ -11,6 +11,7 @@ import virtual_hosts.virtual_host       as virtual_host
 import path_hopping.flow_allocation     as flow_allocation
 import nw_control.topo_mapper           as topo_mapper
 import nw_control.stat_monitor          as stat_monitor
+import nw_control.link_utilization      as link_utilization
 import nw_control.params                as cfg
 import mp_routing.onos_route_adder      as onos_route_adder
 import path_hopping.params              as ph_cfg
@@ -24,9 +25,6 @@ from nw_control.results_repository                  import ResultsRepository
 
 TARGET_GRAPH = nx.complete_graph(10)
 
-def compute_link_key(source_id, destination_id):
-    return tuple(sorted((source_id, destination_id)))
-
 def compute_link_utilization_over_time(link_byte_counts):
     """
     Compute a list of sampled link utilization values based on 
@@ -38,43 +36,9 @@ def compute_link_utilization_over_time(link_byte_counts):
     RETURNS 
         tx_rate_t: (source_id x destination_id) -> link_utilization_in_time_period_t forall. t
     """
-    def find_matching_iface_stats(byte_count, source_id, destination_id):
-        matching_stats = [d_i for d_i in byte_count
-                if d_i["sourceSwitchId"] == source_id and
-                d_i["destinationSwitchId"] == destination_id]
-        if len(matching_stats) != 1:
-            raise ValueError("Unexpected results in find_matching_iface_stats. \
-                    Found %d matching iface_stats" % len(matching_stats))
-        return matching_stats[0]
-
-    def compute_tx_rate(count_in_bytes):
-        return (count_in_bytes * 8) / 10.0**7
-
-    pp.pprint(len(link_byte_counts[0])) 
-    # First compute the delta between the iface_stats in time_period t_i and the iface_stats
-    # in time period t_{i+1}.
-    # tx_rate_t: (source_id x destination_id) -> link_utilization_in_time_period_t forall. t
-    tx_rate_t = []
-    for t_0, t_1 in zip(link_byte_counts, link_byte_counts[1:]):
-        byte_count_delta_t = defaultdict(float)
-        for iface_stats in t_0:
-            source_id = iface_stats["sourceSwitchId"]
-            destination_id = iface_stats["destinationSwitchId"]
-            t_0_count = iface_stats["bytesSent"] + iface_stats["bytesReceived"]
-            try:
-                t_1_stats = find_matching_iface_stats(t_1, source_id, destination_id)
-                t_1_count = t_1_stats["bytesSent"] + t_1_stats["bytesReceived"]
-            except ValueError:
-                t_1_count = t_0_count
-
-            count_delta = t_1_count - t_0_count
-            link_key = compute_link_key(source_id, 
-                    destination_id)
-            byte_count_delta_t[link_key] += count_delta
-
-        tx_rate_t.append({the_link_key: compute_tx_rate(byte_count_t) 
-            for the_link_key, byte_count_t in byte_count_delta_t.items()})
-    return tx_rate_t
+    link_keys, tx_rates, valid = link_utilization.compute_folded_link_rates(link_byte_counts,
+            link_utilization.ByteCounter.TOTAL, 8 / 10.0**7)
+    return link_utilization.LinkCounterMatrix.to_dicts(link_keys, tx_rates, valid)
 
 def compute_mean_link_utilization(link_byte_counts):
     """
@@ -84,23 +48,10 @@ def compute_mean_link_utilization(link_byte_counts):
     RETURNS
         link_util: (source_id x destination_id) -> mean link utilization
     """
-    def collect_all_link_keys(link_util_t):
-        link_keys = set()
-        for t_i in link_util_t:
-            for link_key in t_i.keys():
-                link_keys.add(link_key)
-        return link_keys
-
-    link_util_t = compute_link_utilization_over_time(link_byte_counts)
-    link_keys = collect_all_link_keys(link_util_t)
-    mean_link_utils = {}
-    for link_key in link_keys:
-
-        link_util_over_time = [d_i[link_key] for d_i in link_util_t if link_key in d_i]
-        mean_link_util = np.mean(link_util_over_time)
-        mean_link_utils[link_key] = mean_link_util
-
-    return mean_link_utils
+    link_keys, tx_rates, valid = link_utilization.compute_folded_link_rates(link_byte_counts,
+            link_utilization.ByteCounter.TOTAL, 8 / 10.0**7)
+    mean_link_utils = link_utilization.LinkCounterMatrix.mean_over_time(tx_rates, valid)
+    return link_utilization.LinkCounterMatrix.to_column_dict(link_keys, mean_link_utils)
 
 def create_virtual_hosts(id_to_dpid):
     hosts = {}
@@ -132,14 +83,6 @@ def destroy_all_hosts(hosts):
             print("Failed to destroy virtual host %s" % str(host))
             print(ex)
 
-def remove_all_flows(flow_tokens):
-    for flow_token in flow_tokens:
-        try:
-            onos_route_adder.uninstall_flow(flow_token)
-        except Exception as ex:
-            print("Failed to remove flow with token %s." % flow_token)
-            print(ex)
-
 def scale_flow_tx_rate(normalized_flow_tx_rate):
     """
     Converts from a unitless normalized flow tx rate in the range [0.0, 1.0)
@@ -176,18 +119,19 @@ def conduct_path_hopping_trial(results_repository, the_trial):
         for host in hosts.values():
             host.start_traffic_generation_server()
 
+        flow_jsons = []
         for flow in flows:
             source_node, destination_node, flow_tx_rate = (flow.source_node, 
                     flow.destination_node, flow.flow_tx_rate)
 
             flow_json, tag_values_for_flow = simple_paths_to_flow_json(flow.paths, tag_values, 
                     id_to_dpid)
-            flow_token = onos_route_adder.install_flow(flow_json)
-            flow_tokens.add(flow_token)
+            flow_jsons.append(flow_json)
             scaled_flow_tx_rate = scale_flow_tx_rate(flow_tx_rate)
             hosts[source_node+1].configure_flow(scaled_flow_tx_rate, 0.0, "uniform",
                     hosts[destination_node+1].virtual_host_ip, 50000, flow.splitting_ratio, 10,
                     tag_values_for_flow)
+        onos_route_adder.install_all_flows(flow_jsons, flow_tokens)
 
         traffic_monitor = stat_monitor.OnMonitor(cfg.of_controller_ip, cfg.of_controller_port)
         traffic_monitor.start_monitor()
@@ -208,7 +152,7 @@ def conduct_path_hopping_trial(results_repository, the_trial):
         input("Failed to carry out path hopping test. Press enter to continue...")
     finally:
         destroy_all_hosts(hosts)
-        remove_all_flows(flow_tokens)
+        onos_route_adder.remove_all_flows(flow_tokens)
 
 def main():
     # EXECUTION_MODE = "simulate"
@@ -15,17 +15,14 @@ import nw_control.topo_mapper           as topo_mapper
 import attacker_tests.trials            as trials
 import nw_control.packet_capture        as pcap
 import nw_control.stat_monitor          as stat_monitor
+import nw_control.link_utilization      as link_utilization
 import nw_control.params                as cfg
 import nw_control.results_repository    as rr
 import path_hopping.params              as ph_cfg
 
-from collections                        import defaultdict
 
 SUBSTRATE_TOPOLOGY = nx.complete_graph(10)
 
-def compute_link_key(source_id, destination_id):
-    return tuple(sorted((source_id, destination_id)))
-
 def compute_link_utilization_over_time(link_byte_counts):
     """
     Compute a list of sampled link utilization values based on 
@@ -37,42 +34,9 @@ def compute_link_utilization_over_time(link_byte_counts):
     RETURNS 
         tx_rate_t: (source_id x destination_id) -> link_utilization_in_time_period_t forall. t
     """
-    def find_matching_iface_stats(byte_count, source_id, destination_id):
-        matching_stats = [d_i for d_i in byte_count
-                if d_i["sourceSwitchId"] == source_id and
-                d_i["destinationSwitchId"] == destination_id]
-        if len(matching_stats) != 1:
-            raise ValueError("Unexpected results in find_matching_iface_stats. \
-                    Found %d matching iface_stats" % len(matching_stats))
-        return matching_stats[0]
-
-    def compute_tx_rate(count_in_bytes):
-        return (count_in_bytes * 8) / 10.0**7
-
-    # First compute the delta between the iface_stats in time_period t_i and the iface_stats
-    # in time period t_{i+1}.
-    # tx_rate_t: (source_id x destination_id) -> link_utilization_in_time_period_t forall. t
-    tx_rate_t = []
-    for t_0, t_1 in zip(link_byte_counts, link_byte_counts[1:]):
-        byte_count_delta_t = defaultdict(float)
-        for iface_stats in t_0:
-            source_id = iface_stats["sourceSwitchId"]
-            destination_id = iface_stats["destinationSwitchId"]
-            t_0_count = iface_stats["bytesSent"] + iface_stats["bytesReceived"]
-            try:
-                t_1_stats = find_matching_iface_stats(t_1, source_id, destination_id)
-                t_1_count = t_1_stats["bytesSent"] + t_1_stats["bytesReceived"]
-            except ValueError:
-                t_1_count = t_0_count
-
-            count_delta = t_1_count - t_0_count
-            link_key = compute_link_key(source_id, 
-                    destination_id)
-            byte_count_delta_t[link_key] += count_delta
-
-        tx_rate_t.append({the_link_key: compute_tx_rate(byte_count_t) 
-            for the_link_key, byte_count_t in byte_count_delta_t.items()})
-    return tx_rate_t
+    link_keys, tx_rates, valid = link_utilization.compute_folded_link_rates(link_byte_counts,
+            link_utilization.ByteCounter.TOTAL, 8 / 10.0**7)
+    return link_utilization.LinkCounterMatrix.to_dicts(link_keys, tx_rates, valid)
 
 def destroy_sender_receiver_pair(sender, receiver):
     if sender != None:
@@ -7,6 +7,8 @@ import pprint           as pp
 import nw_control.params            as cfg
 import nw_control.topo_mapper       as topo_mapper
 
+from nw_control.onos_client     import get_onos_client
+
 from collections import defaultdict
 
 def verify_that_all_flows_are_mirrored(flows, switches, solutions, port_ids_to_port_numbers,
@@ -31,12 +33,14 @@ def verify_that_all_flows_are_mirrored(flows, switches, solutions, port_ids_to_p
     else:
         print("All flows have been mirrored.")
 
-def verify_path_ports(flows_mapped_to_nw):
+def verify_path_ports(flows_mapped_to_nw, snapshot=None):
+    snapshot = snapshot or topo_mapper.TopologySnapshot()
     for flow_id, flow_mapped_to_nw in flows_mapped_to_nw.items():
         dpid_to_port = {dpid: port_num 
                 for dpid, port_num in zip(flow_mapped_to_nw.path, flow_mapped_to_nw.ports)}
         for switch_id, next_hop_id in zip(flow_mapped_to_nw.path, flow_mapped_to_nw.path[1:]):
-            source_port, dest_port = topo_mapper.get_ports_that_connect(switch_id, next_hop_id)
+            source_port, dest_port = topo_mapper.get_ports_that_connect(switch_id, next_hop_id,
+                    snapshot)
             if source_port != dpid_to_port[switch_id]:
                 print("WEIRDNESS WITH MAPPING BETWEEN PORT IDS AND PORT NUMBERS.")
                 print("Expected dpid %s to have port %s connecting to %s. Found port %s" %
@@ -59,7 +63,8 @@ def create_add_port_mirroring_rules_request_json( flow_def
                                                 , solutions
                                                 , id_to_dpid
                                                 , tag_value
-                                                , port_ids_to_port_numbers):
+                                                , port_ids_to_port_numbers
+                                                , snapshot = None):
     def create_path_json(flow_def):
         path_json_dict = {"nodes": [id_to_dpid[node_id] for node_id in flow_def.path]}
         return path_json_dict
@@ -71,7 +76,7 @@ def create_add_port_mirroring_rules_request_json( flow_def
             port_numbers.append(actual_port_number)
         
         last_hop_switch_dpid = id_to_dpid[flow_def.path[-1]]
-        last_hop_egress_port = topo_mapper.get_host_port(last_hop_switch_dpid)
+        last_hop_egress_port = topo_mapper.get_host_port(last_hop_switch_dpid, snapshot)
         port_numbers.append(last_hop_egress_port)
         return port_numbers
 
@@ -98,8 +103,8 @@ def create_add_port_mirroring_rules_request_json( flow_def
 def request_flow_mirroring(flow_def, switches, solution_def, id_to_dpid, tag_value):
     json_body = create_add_flow_mirroring_rules_request_json(flow_def, switches, solution_def, 
             id_to_dpid, tag_value)
-    rest_endpoint = url.urljoin(cfg.onos_url.geturl(), "port-mirroring/v1/add-mirrored-flow")
-    port_mirroring_request = req.post(rest_endpoint, data=json_body, auth=cfg.ONOS_API_CREDENTIALS)
+    port_mirroring_request = get_onos_client().post("port-mirroring/v1/add-mirrored-flow",
+            data=json_body)
     if port_mirroring_request.status_code != 200:
         pp.pprint(port_mirroring_request.text)
         raise ValueError("add-mirrored-flow request failed with code %d %s" % 
@@ -114,11 +119,12 @@ def request_port_mirroring( flow_def
                           , solution_def
                           , id_to_dpid
                           , tag_value
-                          , port_ids_to_port_numbers):
+                          , port_ids_to_port_numbers
+                          , snapshot = None):
     json_body = create_add_port_mirroring_rules_request_json(flow_def, switches, solution_def, 
-            id_to_dpid, tag_value, port_ids_to_port_numbers)   
-    rest_endpoint = url.urljoin(cfg.onos_url.geturl(), "port-mirroring/v1/add-mirrored-ports")
-    port_mirroring_request = req.post(rest_endpoint, data=json_body, auth=cfg.ONOS_API_CREDENTIALS)
+            id_to_dpid, tag_value, port_ids_to_port_numbers, snapshot)   
+    port_mirroring_request = get_onos_client().post("port-mirroring/v1/add-mirrored-ports",
+            data=json_body)
     if port_mirroring_request.status_code != 200:
         pp.pprint(port_mirroring_request.text)
         raise ValueError("add-mirrored-ports request failed with code %d %s" %
@@ -129,8 +135,8 @@ def request_port_mirroring( flow_def
         return response["routeId"]
 
 def remove_port_mirroring_rules(flow_token):
-    rest_endpoint = url.urljoin(cfg.onos_url.geturl(), "port-mirroring/v1/remove-mirrored-flow") + ("?route-id=%s" % flow_token)
-    remove_mirroring_rules_request = req.post(rest_endpoint, auth=cfg.ONOS_API_CREDENTIALS)
+    remove_mirroring_rules_request = get_onos_client().post(
+            "port-mirroring/v1/remove-mirrored-flow?route-id=%s" % flow_token)
     if remove_mirroring_rules_request.status_code != 200:
         pp.pprint(remove_mirroring_rules_request.text)
         raise ValueError("remove-mirrored-flow request failed with code %d %s" %
@@ -142,15 +148,16 @@ def remove_port_mirroring_flows(flow_tokens):
     for flow_token in flow_tokens.values():
         remove_port_mirroring_rules(flow_token)
 
-def map_port_ids_to_nw_ports(mirroring_ports, id_to_dpid):
+def map_port_ids_to_nw_ports(mirroring_ports, id_to_dpid, snapshot=None):
     # switch_id -> port_id -> port_number
+    snapshot = snapshot or topo_mapper.TopologySnapshot()
     dpid_port_map = defaultdict(dict)
     for source_id, destination_id_to_port_number in mirroring_ports.port_map.items():
         for destination_id, port_number in destination_id_to_port_number.items():
             source_dpid         = id_to_dpid[source_id]
             destination_dpid    = id_to_dpid[destination_id]
             source_port, destination_port = topo_mapper.get_ports_that_connect(source_dpid, 
-                    destination_dpid)
+                    destination_dpid, snapshot)
             dpid_port_map[source_id][port_number] = source_port
     
     return dpid_port_map
@@ -166,8 +173,9 @@ def add_flow_mirroring_flows(topology, flows, switches, solutions):
 
 def add_port_mirroring_flows(topology, flows, switches, solutions, mirroring_ports):
     flow_ids_to_add = flows.keys()
-    id_to_dpid = topo_mapper.get_and_validate_onos_topo(topology)
-    port_ids_to_port_numbers = map_port_ids_to_nw_ports(mirroring_ports, id_to_dpid)
+    snapshot = topo_mapper.TopologySnapshot()
+    id_to_dpid = topo_mapper.get_and_validate_onos_topo(topology, snapshot)
+    port_ids_to_port_numbers = map_port_ids_to_nw_ports(mirroring_ports, id_to_dpid, snapshot)
     flow_tokens = {}
 
     verify_that_all_flows_are_mirrored(flows, switches, solutions, port_ids_to_port_numbers,
@@ -175,5 +183,5 @@ def add_port_mirroring_flows(topology, flows, switches, solutions, mirroring_por
 
     for flow_id in flow_ids_to_add:
         flow_tokens[flow_id] = request_port_mirroring(flows[flow_id], switches, solutions,
-                id_to_dpid, flow_id, port_ids_to_port_numbers)
+                id_to_dpid, flow_id, port_ids_to_port_numbers, snapshot)
     return flow_tokens
@@ -0,0 +1,54 @@
+import importlib            as importlib
+import pathlib              as path
+import sys                  as sys
+
+import pytest               as pytest
+
+REST_CLIENT_DIR = path.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REST_CLIENT_DIR))
+
+import nw_control.flowmod           as fm
+import nw_control.of_rest_client    as of
+
+# of_processor imports its siblings as top level modules.
+sys.modules.setdefault("flowmod", fm)
+sys.modules.setdefault("of_rest_client", of)
+sys.path.insert(0, str(REST_CLIENT_DIR / "nw_control"))
+ofp = importlib.import_module("of_processor")
+
+@pytest.fixture
+def delete_requests(monkeypatch):
+    """
+    The JSON body of every RemoveFlow request, which is sent instead of being posted to the
+    controller.
+    """
+    sent_requests = []
+    def get_response(self):
+        sent_requests.append(self.get_request_params())
+    monkeypatch.setattr(of.RemoveFlow, "get_response", get_response)
+    return sent_requests
+
+def test_remove_flows_by_cookie_deletes_from_every_table_by_default(delete_requests):
+    of_proc = ofp.OFProcessor("127.0.0.1", 8080)
+    remove_result = of_proc.remove_flows_by_cookie([1, 2], 0x1234)
+
+    assert remove_result.all_succeeded()
+    assert sorted(request["dpid"] for request in delete_requests) == [1, 2]
+    for request in delete_requests:
+        assert request["cookie"] == 0x1234
+        assert request["table_id"] == fm.Flowmod.TABLE_ID_ALL
+
+def test_remove_routes_deletes_from_route_table(delete_requests):
+    pytest.importorskip("paramiko")
+    mp = importlib.import_module("mp_routing.multipath_orchestrator")
+    route_adder = mp.MPRouteAdder(ofp.OFProcessor("127.0.0.1", 8080), None, None, cookie=7)
+    route_adder.installed_routes[3].append(None)
+    route_adder.remove_routes()
+
+    assert delete_requests == [{ "dpid"         : 3
+                               , "cookie"       : 7
+                               , "cookie_mask"  : fm.Flowmod.COOKIE_MASK_ALL
+                               , "table_id"     : mp.MPRouteAdder.ROUTE_TABLE_ID
+                               , "match"        : {}
+                               , "actions"      : []
+                               }]
@@ -521,9 +521,10 @@ class PortMirroringTrial:
 
     @staticmethod
     def map_to_physical_network(trial):
-        id_to_dpid = topo_mapper.get_and_validate_onos_topo(trial.topology)
+        snapshot = topo_mapper.TopologySnapshot()
+        id_to_dpid = topo_mapper.get_and_validate_onos_topo(trial.topology, snapshot)
         port_ids_to_port_numbers = onos_rest_helpers.map_port_ids_to_nw_ports(
-                trial.mirroring_ports, id_to_dpid)
+                trial.mirroring_ports, id_to_dpid, snapshot)
 
         new_flows = {}
         for flow_id, flow in trial.flows.items():
@@ -533,7 +534,7 @@ class PortMirroringTrial:
             zipped_path = list(zip(new_path, new_ports))
             
             last_hop_switch_dpid    = id_to_dpid[flow.path[-1]]
-            last_hop_egress_port    = topo_mapper.get_host_port(last_hop_switch_dpid)
+            last_hop_egress_port    = topo_mapper.get_host_port(last_hop_switch_dpid, snapshot)
             zipped_path.append((last_hop_switch_dpid, last_hop_egress_port))
             new_flow = PortMirroringFlow(flow_id, flow.traffic_rate, zipped_path)
             new_flows[flow_id] = new_flow
@@ -12,6 +12,8 @@ import operator                     as operator
 import nw_control.params            as cfg
 import virtual_hosts.params         as vhost_cfg
 
+from nw_control.onos_client          import get_onos_client
+
 from functools                      import reduce
 
 class VirtualHost: 
@@ -43,10 +45,8 @@ class VirtualHost:
                        }
         pp.pprint(request_json)
 
-        request_url = url.urljoin(vhost_cfg.onos_url.geturl(), 
-                "virtual-hosts/v1/create-virtual-host")
-        create_virtual_host_request = req.post(request_url, json=request_json,
-                auth=cfg.ONOS_API_CREDENTIALS)
+        create_virtual_host_request = get_onos_client(vhost_cfg.onos_url).post(
+                "virtual-hosts/v1/create-virtual-host", json=request_json)
         if not create_virtual_host_request:
             raise ValueError("Failed to create virtual host with IP Address %s. Status %d %s" %
                     (virtual_host_ip, create_virtual_host_request.status_code, 
@@ -89,9 +89,8 @@ class VirtualHost:
     
     @staticmethod
     def _uninstall_virtual_host(virtual_host_token):
-        request_url = url.urljoin(vhost_cfg.onos_url.geturl(), 
+        destroy_host_request = get_onos_client(vhost_cfg.onos_url).post(
                 "virtual-hosts/v1/destroy-virtual-host?virtual-host-id=%s" % virtual_host_token)
-        destroy_host_request = req.post(request_url, auth=cfg.ONOS_API_CREDENTIALS)
         if not destroy_host_request:
             raise ValueError("Failed to destroy virtual host with token %s. %d %s" %
                     (virtual_host_token, 
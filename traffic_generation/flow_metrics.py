@@ -0,0 +1,271 @@
+"""
+Per-flow loss, reordering, latency and jitter measurement from the header that
+traffic_gen writes at the start of every packet it sends.
+
+The header is HEADER_FORMAT: a magic number, version, the DSCP tag of the path the
+packet was sent on, the flow ID, a per-flow sequence number starting at 0 and the send
+time in nanoseconds since the epoch. Packets shorter than HEADER_SIZE are sent without
+one. Latency is only meaningful when the sender and receiver clocks are synchronized,
+as they are for hosts in the same mininet instance.
+
+Everything kept per flow has a fixed size, regardless of the number of packets seen.
+"""
+
+import struct               as struct
+
+# magic, version, path_tag, flow_id, seq_num, send_time_ns
+HEADER_FORMAT       = "!HBBIQQ"
+HEADER_STRUCT       = struct.Struct(HEADER_FORMAT)
+HEADER_SIZE         = HEADER_STRUCT.size
+HEADER_MAGIC        = 0x5447
+HEADER_VERSION      = 1
+
+def pack_header(buf, offset, path_tag, flow_id, seq_num, send_time_ns):
+    HEADER_STRUCT.pack_into(buf, offset, HEADER_MAGIC, HEADER_VERSION, path_tag, flow_id,
+            seq_num, send_time_ns)
+
+def unpack_header(buf, offset=0):
+    """
+    RETURNS
+        (path_tag, flow_id, seq_num, send_time_ns) or None if buf does not hold a header
+        at offset.
+    """
+    if len(buf) - offset < HEADER_SIZE:
+        return None
+    magic, version, path_tag, flow_id, seq_num, send_time_ns = HEADER_STRUCT.unpack_from(buf,
+            offset)
+    if magic != HEADER_MAGIC or version != HEADER_VERSION:
+        return None
+    return path_tag, flow_id, seq_num, send_time_ns
+
+class HdrHistogram:
+    """
+    Class: HdrHistogram
+    Purpose: Histogram of non-negative integers with a bounded relative error, laid out
+    like HdrHistogram. Values below 2**SUB_BUCKET_BITS each have their own bucket, above
+    that every power of two is split into 2**(SUB_BUCKET_BITS - 1) equal buckets, so a
+    recorded value is off by less than 1 / 2**(SUB_BUCKET_BITS - 1) of itself (6.25%).
+    Values of 2**MAX_VALUE_BITS or more are counted in the last bucket.
+    """
+
+    SUB_BUCKET_BITS = 5
+    MAX_VALUE_BITS  = 40
+
+    def __init__(self):
+        self._counts    = [0] * (HdrHistogram.bucket_index((1 << HdrHistogram.MAX_VALUE_BITS) - 1) + 1)
+        self._max_value = (1 << HdrHistogram.MAX_VALUE_BITS) - 1
+        self.count      = 0
+        self.total      = 0
+        self.min        = None
+        self.max        = 0
+
+    @staticmethod
+    def bucket_index(value):
+        shift = value.bit_length() - HdrHistogram.SUB_BUCKET_BITS
+        if shift <= 0:
+            return value
+        return (shift << (HdrHistogram.SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+    @staticmethod
+    def bucket_bounds(bucket_idx):
+        """
+        RETURNS
+            (lowest_value, highest_value) that are counted in bucket_idx.
+        """
+        half_count = 1 << (HdrHistogram.SUB_BUCKET_BITS - 1)
+        if bucket_idx < 2 * half_count:
+            return bucket_idx, bucket_idx
+        shift = bucket_idx // half_count - 1
+        sub_bucket = bucket_idx - shift * half_count
+        return sub_bucket << shift, ((sub_bucket + 1) << shift) - 1
+
+    def add(self, value):
+        if value < 0:
+            value = 0
+        elif value > self._max_value:
+            value = self._max_value
+        self._counts[HdrHistogram.bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def merge(self, other):
+        for bucket_idx, bucket_count in enumerate(other._counts):
+            self._counts[bucket_idx] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def get_percentile(self, q):
+        """
+        Returns the highest value counted in the same bucket as the qth percentile.
+        """
+        if self.count == 0:
+            return 0
+        rank = max(1, q / 100.0 * self.count)
+        cumulative_count = 0
+        for bucket_idx, bucket_count in enumerate(self._counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                return min(HdrHistogram.bucket_bounds(bucket_idx)[1], self.max)
+        return self.max
+
+    def get_stats(self):
+        return { "count"    : self.count
+               , "min"      : self.min or 0
+               , "mean"     : self.total / self.count if self.count else 0.0
+               , "max"      : self.max
+               , "p50"      : self.get_percentile(50)
+               , "p90"      : self.get_percentile(90)
+               , "p99"      : self.get_percentile(99)
+               , "p999"     : self.get_percentile(99.9)
+               }
+
+class SequenceTracker:
+    """
+    Class: SequenceTracker
+    Purpose: Counts the lost, duplicated and reordered packets of a flow from their
+    sequence numbers. Whether each of the WINDOW_SIZE sequence numbers up to the highest
+    one seen was received is kept in a bytearray used as a ring, indexed by the sequence
+    number modulo WINDOW_SIZE. A packet that arrives after a higher sequence number is
+    reordered, and if it is older than the window it is also counted as late, in which
+    case a duplicate can no longer be told apart from a reordered packet. Loss is the
+    number of sequence numbers up to the highest seen that were never received, so packets
+    still in flight at the end of a trial are not counted as lost.
+    """
+
+    WINDOW_SIZE = 1024
+
+    def __init__(self):
+        self._window                = bytearray(SequenceTracker.WINDOW_SIZE)
+        self.max_seq_num            = None
+        self.received               = 0
+        self.duplicates             = 0
+        self.reordered              = 0
+        self.late                   = 0
+        self.max_reorder_distance   = 0
+
+    def _clear(self, first_seq_num, count):
+        """
+        Mark the count sequence numbers starting at first_seq_num as not received.
+        """
+        window_size = SequenceTracker.WINDOW_SIZE
+        if count >= window_size:
+            self._window[:] = bytes(window_size)
+            return
+        start = first_seq_num % window_size
+        end = start + count
+        if end <= window_size:
+            self._window[start:end] = bytes(count)
+        else:
+            self._window[start:] = bytes(window_size - start)
+            self._window[:end - window_size] = bytes(end - window_size)
+
+    def add(self, seq_num):
+        """
+        RETURNS
+            False if the packet is a duplicate.
+        """
+        max_seq_num = self.max_seq_num
+        if max_seq_num is None or seq_num > max_seq_num:
+            if max_seq_num is not None and seq_num - max_seq_num > 1:
+                self._clear(max_seq_num + 1, seq_num - max_seq_num - 1)
+            self._window[seq_num % SequenceTracker.WINDOW_SIZE] = 1
+            self.max_seq_num = seq_num
+        else:
+            distance = max_seq_num - seq_num
+            if distance < SequenceTracker.WINDOW_SIZE:
+                slot_idx = seq_num % SequenceTracker.WINDOW_SIZE
+                if self._window[slot_idx]:
+                    self.duplicates += 1
+                    return False
+                self._window[slot_idx] = 1
+            else:
+                self.late += 1
+            self.reordered += 1
+            if distance > self.max_reorder_distance:
+                self.max_reorder_distance = distance
+        self.received += 1
+        return True
+
+    @property
+    def lost(self):
+        if self.max_seq_num is None:
+            return 0
+        return max(0, self.max_seq_num + 1 - self.received)
+
+    def get_stats(self):
+        return { "received"             : self.received
+               , "lost"                 : self.lost
+               , "duplicates"           : self.duplicates
+               , "reordered"            : self.reordered
+               , "late"                 : self.late
+               , "max_reorder_distance" : self.max_reorder_distance
+               , "max_seq_num"          : self.max_seq_num
+               }
+
+class PathMetrics:
+    """
+    Class: PathMetrics
+    Purpose: One way latency and jitter of the packets of a flow that took one path, in
+    nanoseconds. Jitter is the RFC 3550 interarrival jitter, a running average of the
+    difference in transit time between consecutive packets.
+    """
+
+    def __init__(self):
+        self.latency        = HdrHistogram()
+        self.jitter         = HdrHistogram()
+        self._jitter        = 0.0
+        self._last_transit  = None
+
+    def add(self, send_time_ns, recv_time_ns):
+        transit_time = recv_time_ns - send_time_ns
+        self.latency.add(transit_time)
+        if self._last_transit != None:
+            transit_delta = abs(transit_time - self._last_transit)
+            self._jitter += (transit_delta - self._jitter) / 16.0
+            self.jitter.add(transit_delta)
+        self._last_transit = transit_time
+
+    def get_stats(self):
+        return { "latency"          : self.latency.get_stats()
+               , "transit_delta"    : self.jitter.get_stats()
+               , "jitter"           : self._jitter
+               }
+
+class FlowMetrics:
+    """
+    Class: FlowMetrics
+    Purpose: The SequenceTracker of a flow and the PathMetrics of each path it was seen
+    on, keyed by the DSCP tag of the path.
+    """
+
+    def __init__(self, flow_id):
+        self.flow_id    = flow_id
+        self.sequence   = SequenceTracker()
+        self.paths      = {}
+
+    def add(self, path_tag, seq_num, send_time_ns, recv_time_ns):
+        if not self.sequence.add(seq_num):
+            return
+        path_metrics = self.paths.get(path_tag)
+        if path_metrics is None:
+            path_metrics = self.paths[path_tag] = PathMetrics()
+        path_metrics.add(send_time_ns, recv_time_ns)
+
+    def to_dict(self):
+        """
+        RETURNS
+            The metrics as built-in types only, so that they can be unpickled without
+            this module.
+        """
+        flow_stats = self.sequence.get_stats()
+        flow_stats["flow_id"] = self.flow_id
+        flow_stats["paths"] = {path_tag: path_metrics.get_stats()
+                for path_tag, path_metrics in sorted(self.paths.items())}
+        return flow_stats
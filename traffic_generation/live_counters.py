@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+
+"""
+Live per-flow packet counters shared between the traffic generation processes and
+anything that wants to observe them while a trial is running.
+
+Each traffic_gen worker and each traffic_server publishes its counters in its own
+memory mapped file under LIVE_COUNTER_DIR. A file has a fixed layout: a HEADER_FORMAT
+header followed by capacity SLOT_FORMAT slots, one per flow. Every file has exactly one
+writer, and each counter is an aligned 64-bit word that is updated with a single store,
+so readers never need a lock and never see a torn counter. A slot is fully written
+before the slot count in the header is incremented to publish it.
+
+The files outlive the process that wrote them, so the counts of a process that crashed
+are still available. Writers refresh the heartbeat in the header at least every
+HEARTBEAT_INTERVAL seconds while they run, and readers skip the files of processes that
+have exited or whose heartbeat is older than MAX_HEARTBEAT_AGE unless asked not to.
+Files left over from earlier trials are removed with remove_counter_files.
+
+    python3 live_counters.py -interval 0.5          # print live rates for every process
+    python3 live_counters.py -json -count 1 -host 1 # one JSON snapshot, for remote reads
+    python3 live_counters.py -remove -host 1        # remove every file of host 1
+"""
+
+import mmap                 as mmap
+import os                   as os
+import struct               as struct
+import socket               as socket
+import time                 as time
+import json                 as json
+import argparse             as argparse
+import pathlib              as path
+
+from enum                   import Enum
+
+LIVE_COUNTER_DIR    = path.Path("/dev/shm") if path.Path("/dev/shm").is_dir() else path.Path("/tmp")
+MAGIC               = b"TGCOUNT1"
+VERSION             = 1
+# magic, version, kind, capacity, slot_count, pid, (padding), start_time, heartbeat
+HEADER_FORMAT       = "<8sIIIII4xdd"
+HEADER_SIZE         = struct.calcsize(HEADER_FORMAT)
+SLOT_COUNT_OFFSET   = 20
+HEARTBEAT_OFFSET    = 40
+# packets, bytes, last_update, flow_num, flow_id, src_ip, dst_ip, src_port, dst_port
+SLOT_FORMAT         = "<QQdii4s4sHH4x"
+SLOT_SIZE           = struct.calcsize(SLOT_FORMAT)
+DEFAULT_CAPACITY    = 4096
+HEARTBEAT_INTERVAL  = 1.0
+MAX_HEARTBEAT_AGE   = 10.0
+
+class CounterKinds(Enum):
+    SENDER      = 0
+    RECEIVER    = 1
+
+def get_sender_counter_path(src_host_id, instance_id, worker_id=None):
+    if worker_id is None:
+        return LIVE_COUNTER_DIR / f"traffic-gen-{src_host_id}-{instance_id}.counters"
+    return LIVE_COUNTER_DIR / f"traffic-gen-{src_host_id}-{instance_id}-worker-{worker_id}.counters"
+
+def get_receiver_counter_path(host_id, worker_id=None):
+    if worker_id is None:
+        return LIVE_COUNTER_DIR / f"traffic-server-{host_id}.counters"
+    return LIVE_COUNTER_DIR / f"traffic-server-{host_id}-worker-{worker_id}.counters"
+
+def _pack_ip(ip_address):
+    try:
+        return socket.inet_aton(ip_address or "0.0.0.0")
+    except OSError:
+        return bytes(4)
+
+class LiveCounterWriter:
+    """
+    Class: LiveCounterWriter
+    Purpose: The single writer of a live counter file. add_slot registers a flow and
+    returns the index that add_packets is called with.
+    """
+
+    def __init__(self, file_path, kind, capacity=DEFAULT_CAPACITY):
+        self._file_path = path.Path(file_path)
+        self._capacity  = capacity
+        self._slot_count = 0
+        file_size = HEADER_SIZE + capacity * SLOT_SIZE
+        # Write to a new file and rename it into place so that a reader never maps a
+        # partially initialized file.
+        tmp_path = self._file_path.with_suffix(".tmp-%d" % os.getpid())
+        fd = os.open(str(tmp_path), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, file_size)
+            self._mm = mmap.mmap(fd, file_size)
+        finally:
+            os.close(fd)
+        start_time = time.time()
+        struct.pack_into(HEADER_FORMAT, self._mm, 0, MAGIC, VERSION, kind.value, capacity, 0,
+                os.getpid(), start_time, start_time)
+        os.replace(str(tmp_path), str(self._file_path))
+        self._words     = memoryview(self._mm).cast("Q")
+        self._doubles   = memoryview(self._mm).cast("d")
+        self._header_words = memoryview(self._mm)[:HEADER_SIZE].cast("I")
+
+    @property
+    def file_path(self):
+        return self._file_path
+
+    def add_slot(self, flow_num=-1, flow_id=-1, src_ip=None, src_port=0, dst_ip=None,
+            dst_port=0):
+        """
+        RETURNS
+            The index of the new slot, or None if the file is full.
+        """
+        if self._slot_count >= self._capacity:
+            return None
+        slot_idx = self._slot_count
+        struct.pack_into(SLOT_FORMAT, self._mm, HEADER_SIZE + slot_idx * SLOT_SIZE, 0, 0,
+                time.time(), flow_num, flow_id, _pack_ip(src_ip), _pack_ip(dst_ip), src_port,
+                dst_port)
+        self._slot_count += 1
+        self._header_words[SLOT_COUNT_OFFSET // 4] = self._slot_count
+        return slot_idx
+
+    def add_packets(self, slot_idx, packet_count, byte_count, now=None):
+        word_idx = (HEADER_SIZE + slot_idx * SLOT_SIZE) // 8
+        self._words[word_idx] += packet_count
+        self._words[word_idx + 1] += byte_count
+        now = now or time.time()
+        self._doubles[word_idx + 2] = now
+        self._doubles[HEARTBEAT_OFFSET // 8] = now
+
+    def heartbeat(self, now=None):
+        self._doubles[HEARTBEAT_OFFSET // 8] = now or time.time()
+
+    def close(self):
+        self._words.release()
+        self._doubles.release()
+        self._header_words.release()
+        self._mm.close()
+
+class CounterSnapshot:
+    """
+    Class: CounterSnapshot
+    Purpose: The contents of one live counter file at a point in time.
+    """
+
+    def __init__(self, file_path, timestamp, kind, pid, start_time, heartbeat, flows):
+        self.file_path  = file_path
+        self.timestamp  = timestamp
+        self.kind       = kind
+        self.pid        = pid
+        self.start_time = start_time
+        self.heartbeat  = heartbeat
+        # [{"packets", "bytes", "last_update", "flow_num", "flow_id", "src_ip", "src_port",
+        #   "dst_ip", "dst_port"}], in the order the flows were registered
+        self.flows      = flows
+
+    def to_dict(self):
+        return { "file_path"    : str(self.file_path)
+               , "timestamp"    : self.timestamp
+               , "kind"         : self.kind.name
+               , "pid"          : self.pid
+               , "start_time"   : self.start_time
+               , "heartbeat"    : self.heartbeat
+               , "flows"        : self.flows
+               }
+
+    @staticmethod
+    def from_dict(d):
+        return CounterSnapshot(d["file_path"], d["timestamp"], CounterKinds[d["kind"]], d["pid"],
+                d["start_time"], d["heartbeat"], d["flows"])
+
+class LiveCounterReader:
+    """
+    Class: LiveCounterReader
+    Purpose: Samples a live counter file without coordinating with its writer.
+    """
+
+    def __init__(self, file_path):
+        self._file_path = path.Path(file_path)
+        fd = os.open(str(self._file_path), os.O_RDONLY)
+        try:
+            self._mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        if len(self._mm) < HEADER_SIZE:
+            self._mm.close()
+            raise ValueError("%s is not a live counter file." % str(self._file_path))
+        magic, version, kind, capacity, _, pid, start_time, _ = struct.unpack_from(
+                HEADER_FORMAT, self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError("%s is not a live counter file." % str(self._file_path))
+        self._kind      = CounterKinds(kind)
+        self._capacity  = capacity
+        self._pid       = pid
+        self._start_time = start_time
+
+    def read(self):
+        timestamp = time.time()
+        slot_count = min(struct.unpack_from("<I", self._mm, SLOT_COUNT_OFFSET)[0], self._capacity)
+        heartbeat = struct.unpack_from("<d", self._mm, HEARTBEAT_OFFSET)[0]
+        slots = self._mm[HEADER_SIZE:HEADER_SIZE + slot_count * SLOT_SIZE]
+        flows = []
+        for (packets, byte_count, last_update, flow_num, flow_id, src_ip, dst_ip, src_port,
+                dst_port) in struct.iter_unpack(SLOT_FORMAT, slots):
+            flows.append({ "packets"        : packets
+                         , "bytes"          : byte_count
+                         , "last_update"    : last_update
+                         , "flow_num"       : flow_num
+                         , "flow_id"        : flow_id
+                         , "src_ip"         : socket.inet_ntoa(src_ip)
+                         , "src_port"       : src_port
+                         , "dst_ip"         : socket.inet_ntoa(dst_ip)
+                         , "dst_port"       : dst_port
+                         })
+        return CounterSnapshot(self._file_path, timestamp, self._kind, self._pid,
+                self._start_time, heartbeat, flows)
+
+    def sample(self, interval, count=None):
+        """
+        Yield a snapshot every interval seconds, count times (forever if count is None).
+        """
+        next_sample_time = time.monotonic()
+        sample_idx = 0
+        while count is None or sample_idx < count:
+            yield self.read()
+            sample_idx += 1
+            next_sample_time += interval
+            if count is None or sample_idx < count:
+                time.sleep(max(0.0, next_sample_time - time.monotonic()))
+
+    def close(self):
+        self._mm.close()
+
+def find_counter_files(counter_dir=None, host_id=None, kind=None):
+    """
+    RETURNS
+        The counter files of every process, or only those of host_id and/or of the
+        processes of the given CounterKinds.
+    """
+    counter_dir = counter_dir or LIVE_COUNTER_DIR
+    host_pattern = "*" if host_id is None else str(host_id)
+    patterns = []
+    if kind in [None, CounterKinds.SENDER]:
+        patterns.append(f"traffic-gen-{host_pattern}-*.counters")
+    if kind in [None, CounterKinds.RECEIVER]:
+        patterns += [ f"traffic-server-{host_pattern}.counters"
+                    , f"traffic-server-{host_pattern}-worker-*.counters"
+                    ]
+    return sorted(set(file_path for pattern in patterns
+        for file_path in counter_dir.glob(pattern)))
+
+def remove_counter_files(host_id, kind=None, counter_dir=None):
+    for file_path in find_counter_files(counter_dir, host_id, kind):
+        try:
+            file_path.unlink()
+        except FileNotFoundError:
+            pass
+
+def is_process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def is_live(snapshot, max_heartbeat_age=MAX_HEARTBEAT_AGE):
+    """
+    Returns True if the process that wrote snapshot was still running and updating it.
+    """
+    return ((snapshot.timestamp - snapshot.heartbeat) <= max_heartbeat_age and
+            is_process_running(snapshot.pid))
+
+def open_readers(file_paths, live_only=True):
+    """
+    RETURNS
+        A LiveCounterReader for each of file_paths that is a live counter file, skipping
+        the files of processes that are no longer running if live_only is set.
+    """
+    readers = []
+    for file_path in file_paths:
+        try:
+            reader = LiveCounterReader(file_path)
+        except (OSError, ValueError):
+            continue
+        if live_only and not is_live(reader.read()):
+            reader.close()
+            continue
+        readers.append(reader)
+    return readers
+
+def read_all_counters(counter_dir=None, host_id=None, live_only=True):
+    snapshots = []
+    for reader in open_readers(find_counter_files(counter_dir, host_id), live_only):
+        snapshots.append(reader.read())
+        reader.close()
+    return snapshots
+
+def get_flow_key(flow):
+    return (flow["src_ip"], flow["src_port"])
+
+def compute_rates(previous_snapshot, snapshot):
+    """
+    RETURNS
+        (src_ip, src_port) -> (packets per second, bytes per second) between the two
+        snapshots of the same counter file.
+    """
+    elapsed_time = snapshot.timestamp - previous_snapshot.timestamp
+    previous_flows = {get_flow_key(flow): flow for flow in previous_snapshot.flows}
+    rates = {}
+    for flow in snapshot.flows:
+        previous_flow = previous_flows.get(get_flow_key(flow), {"packets": 0, "bytes": 0})
+        if elapsed_time > 0:
+            rates[get_flow_key(flow)] = ((flow["packets"] - previous_flow["packets"]) / elapsed_time,
+                    (flow["bytes"] - previous_flow["bytes"]) / elapsed_time)
+    return rates
+
+def compute_loss(sender_snapshots, receiver_snapshots):
+    """
+    Match the flows sent by traffic_gen to the flows seen by traffic_server by source
+    address and port. Senders that did not bind to a specific address are matched on
+    their source port alone. The snapshots should all be of the current trial, as
+    returned by read_all_counters, since flows of earlier trials may reuse the same ports.
+
+    RETURNS
+        (src_ip, src_port) -> {"sent", "received", "lost"} for every sender flow
+    """
+    received = {}
+    received_by_port = {}
+    for snapshot in receiver_snapshots:
+        for flow in snapshot.flows:
+            received[get_flow_key(flow)] = received.get(get_flow_key(flow), 0) + flow["packets"]
+            received_by_port[flow["src_port"]] = (received_by_port.get(flow["src_port"], 0) +
+                    flow["packets"])
+    loss = {}
+    for snapshot in sender_snapshots:
+        for flow in snapshot.flows:
+            if flow["src_ip"] == "0.0.0.0":
+                received_count = received_by_port.get(flow["src_port"], 0)
+            else:
+                received_count = received.get(get_flow_key(flow), 0)
+            loss[get_flow_key(flow)] = { "sent"      : flow["packets"]
+                                       , "received"  : received_count
+                                       , "lost"      : flow["packets"] - received_count
+                                       }
+    return loss
+
+def get_args():
+    p = argparse.ArgumentParser("Sample the live traffic generation counters.")
+    p.add_argument("files", nargs="*", help="Counter files to read. Defaults to all of them.")
+    p.add_argument("-interval", dest="interval", type=float, default=1.0)
+    p.add_argument("-count", dest="count", type=int, default=None)
+    p.add_argument("-json", dest="as_json", action="store_true",
+            help="Print each round of snapshots as a JSON list instead of rates.")
+    p.add_argument("-host", dest="host_id", type=int, default=None,
+            help="Only read the files of this host.")
+    p.add_argument("-all", dest="include_stale", action="store_true",
+            help="Also read the files of processes that are no longer running.")
+    p.add_argument("-kind", dest="kind", choices=["sender", "receiver"], default=None,
+            help="Only use the files of traffic_gen (sender) or traffic_server (receiver).")
+    p.add_argument("-remove", dest="remove", action="store_true",
+            help="Remove the files of the host given by -host instead of reading them.")
+    return p.parse_args()
+
+def main():
+    args = get_args()
+    kind = CounterKinds[args.kind.upper()] if args.kind else None
+    if args.remove:
+        if args.host_id is None:
+            raise ValueError("-remove requires -host.")
+        remove_counter_files(args.host_id, kind)
+        return
+    file_paths = ([path.Path(f) for f in args.files] or
+            find_counter_files(host_id=args.host_id, kind=kind))
+    readers = open_readers(file_paths, live_only=not args.include_stale)
+    previous_snapshots = None
+    sample_idx = 0
+    next_sample_time = time.monotonic()
+    while args.count is None or sample_idx < args.count:
+        snapshots = [reader.read() for reader in readers]
+        if args.as_json:
+            print(json.dumps([snapshot.to_dict() for snapshot in snapshots]), flush=True)
+        elif previous_snapshots != None:
+            for previous_snapshot, snapshot in zip(previous_snapshots, snapshots):
+                for (src_ip, src_port), (pps, bps) in compute_rates(previous_snapshot,
+                        snapshot).items():
+                    print("%-45s %15s:%-5d %10.0f pps %10.3f Mbps" % (snapshot.file_path.name,
+                        src_ip, src_port, pps, bps * 8 / 10**6))
+            print(flush=True)
+        previous_snapshots = snapshots
+        sample_idx += 1
+        if args.count is None or sample_idx < args.count:
+            next_sample_time += args.interval
+            time.sleep(max(0.0, next_sample_time - time.monotonic()))
+
+if __name__ == "__main__":
+    main()
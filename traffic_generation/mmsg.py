@@ -0,0 +1,61 @@
+"""
+ctypes bindings for the Linux sendmmsg and recvmmsg system calls, shared by traffic_gen
+and traffic_server. The structures match struct iovec, struct msghdr and struct mmsghdr
+from sys/socket.h on 64-bit Linux.
+"""
+
+import ctypes               as ctypes
+
+class IOVec(ctypes.Structure):
+    _fields_ = [ ("iov_base",       ctypes.c_void_p)
+               , ("iov_len",        ctypes.c_size_t)
+               ]
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [ ("msg_name",       ctypes.c_void_p)
+               , ("msg_namelen",    ctypes.c_uint32)
+               , ("msg_iov",        ctypes.POINTER(IOVec))
+               , ("msg_iovlen",     ctypes.c_size_t)
+               , ("msg_control",    ctypes.c_void_p)
+               , ("msg_controllen", ctypes.c_size_t)
+               , ("msg_flags",      ctypes.c_int)
+               ]
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [ ("msg_hdr",        MsgHdr)
+               , ("msg_len",        ctypes.c_uint)
+               ]
+
+_sendmmsg = None
+_recvmmsg = None
+
+def load_sendmmsg():
+    """
+    Returns the libc sendmmsg function, or None if it is not available on this platform.
+    """
+    global _sendmmsg
+    if _sendmmsg is None:
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            _sendmmsg = libc.sendmmsg
+            _sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+            _sendmmsg.restype = ctypes.c_int
+        except (OSError, AttributeError):
+            _sendmmsg = False
+    return _sendmmsg or None
+
+def load_recvmmsg():
+    """
+    Returns the libc recvmmsg function, or None if it is not available on this platform.
+    """
+    global _recvmmsg
+    if _recvmmsg is None:
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            _recvmmsg = libc.recvmmsg
+            _recvmmsg.argtypes = [ ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int
+                                 , ctypes.c_void_p]
+            _recvmmsg.restype = ctypes.c_int
+        except (OSError, AttributeError):
+            _recvmmsg = False
+    return _recvmmsg or None
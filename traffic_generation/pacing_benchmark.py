@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+Compares the CPU usage and burst timing error of the heap scheduled pacing engine in
+traffic_gen.transmit against the original busy waiting engine, sending to a UDP sink
+on the loopback interface.
+
+    python3 pacing_benchmark.py -flows 1 16 128 -duration 5
+"""
+
+import socket               as socket
+import time                 as time
+import resource             as resource
+import argparse             as argparse
+import statistics           as stat
+
+import traffic_gen          as traffic_gen
+
+from traffic_gen            import FlowParameters, TrafficModels
+from throughput_benchmark   import select_dscp
+
+def legacy_transmit(sock_list, ipd_list, duration, flow_params):
+    """
+    The pacing engine that traffic_gen.transmit replaced. Kept here as the baseline.
+    """
+    def wait(t):
+        start = time.perf_counter()
+        while (time.perf_counter() - start) < t:
+            pass
+
+    ipds = { i : (sock_list[i], ipd_list[i]) for i in range(len(ipd_list)) }
+    start_time = time.time()
+    while (time.time() - start_time) < duration:
+        loop_start = time.perf_counter()
+        expired = [ i for i, (_, t) in ipds.items() if t <= 0.0 ]
+        for i in expired:
+            flow = ipds[i]
+            for _ in range(traffic_gen.BURST_COUNT):
+                dscp_val = select_dscp(flow_params[i].prob_mat, flow_params[i].tag_value)
+                flow[0].setsockopt(socket.SOL_IP, socket.IP_TOS, dscp_val)
+                flow[0].sendto(flow_params[i].data_str, (flow_params[i].dest_addr, flow_params[i].dest_port))
+            traffic_gen.inc_pkt_count(i)
+            ipds[i] = (ipds[i][0], ipd_list[i])
+        t_offset = max(0.0, time.perf_counter() - loop_start)
+        wait_time = min(ipds.values(), key=lambda t : t[1])[1] - t_offset
+        wait(wait_time)
+        actual_wait = time.perf_counter() - loop_start
+        ipds = { i: (s, t - actual_wait) for i, (s, t) in ipds.items() }
+
+class TimestampingSocket:
+    """
+    Records the time at which the first packet of each burst is sent by legacy_transmit.
+    """
+
+    def __init__(self, sock):
+        self._sock          = sock
+        self._sent_count    = 0
+        self.burst_times    = []
+
+    def setsockopt(self, *args):
+        self._sock.setsockopt(*args)
+
+    def sendto(self, data, destination):
+        if self._sent_count % traffic_gen.BURST_COUNT == 0:
+            self.burst_times.append(time.perf_counter())
+        self._sent_count += 1
+        return self._sock.sendto(data, destination)
+
+    def close(self):
+        self._sock.close()
+
+class TimestampingSender:
+    """
+    Records the time at which each burst is sent by traffic_gen.transmit.
+    """
+
+    def __init__(self, flow_sender):
+        self._flow_sender   = flow_sender
+        self.burst_times    = []
+
+    def send_burst(self):
+        self.burst_times.append(time.perf_counter())
+        self._flow_sender.send_burst()
+
+    def close(self):
+        self._flow_sender.close()
+
+def run_legacy_transmit(flow_params, ipd_list, duration):
+    socks = {i: TimestampingSocket(traffic_gen.create_socket("127.0.0.1")) for i in flow_params}
+    legacy_transmit(socks, ipd_list, duration, flow_params)
+    return socks
+
+def run_transmit(flow_params, ipd_list, duration):
+    senders = {i: TimestampingSender(traffic_gen.FlowSender(fp)) for i, fp in flow_params.items()}
+    traffic_gen.transmit(senders, dict(enumerate(ipd_list)), duration)
+    return senders
+
+def run_engine(run_fn, flow_count, duration, sink_port, tx_rate):
+    flow_params = {i: FlowParameters( dest_port         = sink_port
+                                    , dest_addr         = "127.0.0.1"
+                                    , prob_mat          = [1.0]
+                                    , tx_rate           = tx_rate
+                                    , traffic_model     = TrafficModels.UNIFORM
+                                    , tag_value         = [1]
+                                    , source_addr       = "127.0.0.1"
+                                    , flow_id           = i)
+            for i in range(flow_count)}
+    ipd_list = [traffic_gen.compute_inter_pkt_delay(fp.packet_len, fp.tx_rate, fp.time_slice)
+            for fp in flow_params.values()]
+    traffic_gen.pkt_count.clear()
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    senders = run_fn(flow_params, ipd_list, duration)
+    elapsed_time = time.perf_counter() - start_time
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_time = ((usage_after.ru_utime - usage_before.ru_utime) +
+            (usage_after.ru_stime - usage_before.ru_stime))
+
+    timing_errors = []
+    for i, sender in senders.items():
+        for burst_idx, burst_time in enumerate(sender.burst_times):
+            ideal_time = start_time + (burst_idx + 1) * ipd_list[i]
+            timing_errors.append(abs(burst_time - ideal_time))
+        sender.close()
+    expected_bursts = sum(int(duration / ipd) for ipd in ipd_list)
+    sent_bursts = sum(len(sender.burst_times) for sender in senders.values())
+    timing_errors.sort()
+    return { "cpu"          : cpu_time / elapsed_time
+           , "bursts"       : sent_bursts / float(expected_bursts) if expected_bursts else 0.0
+           , "mean_error"   : stat.mean(timing_errors) if timing_errors else 0.0
+           , "p99_error"    : (timing_errors[int(0.99 * (len(timing_errors) - 1))]
+               if timing_errors else 0.0)
+           }
+
+def get_args():
+    p = argparse.ArgumentParser("Benchmark the traffic generator pacing engines.")
+    p.add_argument("-flows", dest="flow_counts", type=int, nargs="+", default=[1, 16, 128])
+    p.add_argument("-duration", dest="duration", type=float, default=5.0)
+    p.add_argument("-rate", dest="tx_rate", type=float, default=131072.0,
+            help="Transmission rate of each flow in bytes per second.")
+    return p.parse_args()
+
+def main():
+    args = get_args()
+    sink = socket.socket(type=socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    sink_port = sink.getsockname()[1]
+
+    print("%-8s %6s %8s %10s %14s %14s" %
+            ("engine", "flows", "cpu", "bursts", "mean err (us)", "p99 err (us)"))
+    for flow_count in args.flow_counts:
+        for engine_name, run_fn in [ ("legacy", run_legacy_transmit)
+                                   , ("heap", run_transmit)]:
+            result = run_engine(run_fn, flow_count, args.duration, sink_port, args.tx_rate)
+            print("%-8s %6d %7.1f%% %9.1f%% %14.1f %14.1f" %
+                    (engine_name, flow_count, result["cpu"] * 100, result["bursts"] * 100,
+                        result["mean_error"] * 10**6, result["p99_error"] * 10**6))
+    sink.close()
+
+if __name__ == "__main__":
+    main()
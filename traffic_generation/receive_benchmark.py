@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+Measures the rate at which traffic_server can count packets from a traffic_gen sender
+on the loopback interface, in packets per second of the receiver's CPU time, for the
+original recvfrom loop and for traffic_server.Receiver in each of its receive modes.
+With -flow_metrics the receivers also track the per-flow metrics of flow_metrics.
+
+    python3 receive_benchmark.py -sizes 64 1024 -sources 1 16 -duration 2
+"""
+
+import socket               as socket
+import time                 as time
+import resource             as resource
+import argparse             as argparse
+import struct               as struct
+import multiprocessing      as mp
+
+import traffic_gen          as traffic_gen
+import traffic_server       as traffic_server
+
+from collections            import defaultdict
+from traffic_gen            import FlowParameters, TrafficModels, SendModes
+from traffic_server         import RecvModes, SourceCounters
+
+# Ends the receive loop once the senders have finished and the socket has been idle
+# for this long.
+RECV_TIMEOUT = 0.2
+
+class LegacyReceiver:
+    """
+    Receives packets the way traffic_server did before Receiver: a recvfrom of a new
+    1 MiB buffer for every packet counted in a dict keyed by (src_addr, src_port).
+    """
+
+    def __init__(self, the_socket):
+        self._socket        = the_socket
+        self.byte_counts    = defaultdict(int)
+
+    def receive(self):
+        try:
+            data, (addr, port_no) = self._socket.recvfrom(1048576)
+        except BlockingIOError:
+            return 0
+        self.byte_counts[(addr, port_no)] += 1
+        return 1
+
+    def close(self):
+        pass
+
+RECEIVERS = [ ("legacy",    None,                   LegacyReceiver)
+            , ("recvfrom",  RecvModes.RECVFROM,     traffic_server.Receiver)
+            , ("recvmmsg",  RecvModes.RECVMMSG,     traffic_server.Receiver)
+            ]
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def run_sender(sink_port, packet_size, source_count, duration):
+    senders = [traffic_gen.FlowSender(FlowParameters( dest_port         = sink_port
+                                                    , dest_addr         = "127.0.0.1"
+                                                    , prob_mat          = [1.0]
+                                                    , traffic_model     = TrafficModels.UNIFORM
+                                                    , packet_len        = packet_size
+                                                    , tag_value         = [1]
+                                                    , source_addr       = "127.0.0.1"
+                                                    , send_mode         = SendModes.AUTO))
+            for _ in range(source_count)]
+    end_time = time.perf_counter() + duration
+    while time.perf_counter() < end_time:
+        for sender in senders:
+            sender.send_burst()
+    for sender in senders:
+        sender.close()
+
+def measure_receive_rate(receiver, sender_proc):
+    received_count = 0
+    cpu_start = get_cpu_time()
+    while True:
+        batch_count = receiver.receive()
+        received_count += batch_count
+        if batch_count == 0 and not sender_proc.is_alive():
+            break
+    cpu_time = get_cpu_time() - cpu_start
+    return received_count, received_count / cpu_time
+
+def pack_timeval(seconds):
+    return struct.pack("@ll", int(seconds), int((seconds % 1) * 10**6))
+
+def create_sink():
+    sink = socket.socket(type=socket.SOCK_DGRAM)
+    sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+            pack_timeval(RECV_TIMEOUT))
+    sink.bind(("127.0.0.1", 0))
+    return sink
+
+def get_args():
+    p = argparse.ArgumentParser("Benchmark the traffic server receive loops.")
+    p.add_argument("-sizes", dest="packet_sizes", type=int, nargs="+", default=[64, 1024])
+    p.add_argument("-sources", dest="source_counts", type=int, nargs="+", default=[1, 16])
+    p.add_argument("-duration", dest="duration", type=float, default=2.0)
+    p.add_argument("-flow_metrics", dest="track_flows", action="store_true")
+    return p.parse_args()
+
+def main():
+    args = get_args()
+    mp_context = mp.get_context("fork")
+
+    print("%-10s %8s %8s %10s %14s %10s" %
+            ("receiver", "size", "sources", "received", "pkts/cpu-sec", "speedup"))
+    for packet_size in args.packet_sizes:
+        for source_count in args.source_counts:
+            baseline = None
+            for receiver_name, recv_mode, receiver_cons in RECEIVERS:
+                sink = create_sink()
+                if recv_mode == None:
+                    receiver = receiver_cons(sink)
+                else:
+                    receiver = receiver_cons(sink, SourceCounters(track_flows=args.track_flows),
+                            recv_mode)
+                    if receiver.recv_mode != recv_mode:
+                        print("%-10s %8d %8d %10s" % (receiver_name, packet_size, source_count,
+                            "unsupported"))
+                        receiver.close()
+                        sink.close()
+                        continue
+                sender_proc = mp_context.Process(target=run_sender,
+                        args=(sink.getsockname()[1], packet_size, source_count, args.duration))
+                sender_proc.start()
+                received_count, receive_rate = measure_receive_rate(receiver, sender_proc)
+                sender_proc.join()
+                receiver.close()
+                sink.close()
+                baseline = baseline or receive_rate
+                print("%-10s %8d %8d %10d %14.0f %9.2fx" %
+                        (receiver_name, packet_size, source_count, received_count, receive_rate,
+                            receive_rate / baseline))
+
+if __name__ == "__main__":
+    main()
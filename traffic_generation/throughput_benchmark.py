@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+Measures the maximum rate at which traffic_gen can send bursts to a UDP sink on the
+loopback interface, in packets per second of CPU time, for each way of sending a burst:
+the original per-packet setsockopt sender and FlowSender in each of its send modes.
+
+    python3 throughput_benchmark.py -sizes 64 1024 8192 -duration 2
+"""
+
+import socket               as socket
+import time                 as time
+import resource             as resource
+import argparse             as argparse
+import random               as random
+
+import traffic_gen          as traffic_gen
+
+from traffic_gen            import FlowParameters, TrafficModels, SendModes
+
+def select_dscp(prob_matrix, tag_values):
+    """
+    The path pick that traffic_gen made for every packet before FlowSender: the DSCP value
+    of the first path whose cumulative proportion of prob_matrix is at least a uniform
+    random pick.
+    """
+    random_pick = random.uniform(0, 1)
+    accumulator = 0.0
+
+    for flow_num, proportion in enumerate(prob_matrix):
+        accumulator = accumulator + proportion
+        if (random_pick <= accumulator):
+            return traffic_gen.calc_dscp_val(flow_num, tag_values)
+
+class LegacyBurstSender:
+    """
+    Sends a burst the way traffic_gen did before FlowSender: a random path pick and an
+    IP_TOS setsockopt before every sendto.
+    """
+
+    def __init__(self, flow):
+        self._flow          = flow
+        self._sock          = traffic_gen.create_socket(flow.source_addr)
+        self._destination   = (flow.dest_addr, flow.dest_port)
+
+    def send_burst(self, count=traffic_gen.BURST_COUNT):
+        for _ in range(count):
+            dscp_val = select_dscp(self._flow.prob_mat, self._flow.tag_value)
+            self._sock.setsockopt(socket.SOL_IP, socket.IP_TOS, dscp_val)
+            self._sock.sendto(self._flow.data_str, self._destination)
+
+    def close(self):
+        self._sock.close()
+
+SENDERS = [ ("legacy",    None,                   LegacyBurstSender)
+          , ("sendto",    SendModes.SENDTO,       traffic_gen.FlowSender)
+          , ("sendmmsg",  SendModes.SENDMMSG,     traffic_gen.FlowSender)
+          , ("udp_gso",   SendModes.UDP_GSO,      traffic_gen.FlowSender)
+          ]
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def measure_throughput(sender, duration):
+    burst_count = 0
+    cpu_start = get_cpu_time()
+    end_time = time.perf_counter() + duration
+    while time.perf_counter() < end_time:
+        for _ in range(100):
+            sender.send_burst()
+        burst_count += 100
+    cpu_time = get_cpu_time() - cpu_start
+    return burst_count * traffic_gen.BURST_COUNT / cpu_time
+
+def get_args():
+    p = argparse.ArgumentParser("Benchmark the traffic generator burst senders.")
+    p.add_argument("-sizes", dest="packet_sizes", type=int, nargs="+", default=[64, 1024, 8192])
+    p.add_argument("-paths", dest="path_count", type=int, default=1)
+    p.add_argument("-duration", dest="duration", type=float, default=2.0)
+    return p.parse_args()
+
+def main():
+    args = get_args()
+    sink = socket.socket(type=socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    sink_port = sink.getsockname()[1]
+
+    print("%-10s %8s %14s %10s" % ("sender", "size", "pkts/cpu-sec", "speedup"))
+    for packet_size in args.packet_sizes:
+        baseline = None
+        for sender_name, send_mode, sender_cons in SENDERS:
+            flow = FlowParameters( dest_port         = sink_port
+                                 , dest_addr         = "127.0.0.1"
+                                 , prob_mat          = [1.0 / args.path_count] * args.path_count
+                                 , traffic_model     = TrafficModels.UNIFORM
+                                 , packet_len        = packet_size
+                                 , tag_value         = list(range(1, args.path_count + 1))
+                                 , source_addr       = "127.0.0.1"
+                                 , send_mode         = send_mode or SendModes.SENDTO
+                                 )
+            sender = sender_cons(flow)
+            if send_mode != None and sender.send_mode != send_mode:
+                print("%-10s %8d %14s" % (sender_name, packet_size, "unsupported"))
+                sender.close()
+                continue
+            throughput = measure_throughput(sender, args.duration)
+            sender.close()
+            baseline = baseline or throughput
+            print("%-10s %8d %14.0f %9.2fx" %
+                    (sender_name, packet_size, throughput, throughput / baseline))
+    sink.close()
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@
 
 import socket               as socket                   
 import time                 as time
-import random               as random
 import argparse             as argparse
 import os                   as os
 import signal               as signal
@@ -14,6 +13,15 @@ import scipy.stats          as stats
 import json                 as json
 import operator             as op
 import pathlib              as path
+import heapq                as heapq
+import numpy                as np
+import ctypes               as ctypes
+import errno                as errno
+import struct               as struct
+import multiprocessing      as mp
+import live_counters        as live_counters
+import mmsg                 as mmsg
+import flow_metrics         as flow_metrics
 
 from enum               import Enum
 from functools          import reduce
@@ -30,6 +38,9 @@ class PrecomputedTapDistribution:
         self._rate_idx = (self._rate_idx + 1) % len(self._rates_list)
         return rate_to_return
 
+    def take(self, count):
+        return [next(self) for _ in range(count)]
+
 class TrafficModels(Enum):
     UNIFORM                 = 0
     TRUNC_NORM              = 1
@@ -59,6 +70,25 @@ class TrafficModels(Enum):
         
         return e_val
 
+class SendModes(Enum):
+    SENDTO                  = 0
+    SENDMMSG                = 1
+    UDP_GSO                 = 2
+    AUTO                    = 3
+
+    @staticmethod
+    def from_str(string_rep):
+        string_rep = string_rep.lower()
+        if string_rep == "sendto":
+            return SendModes.SENDTO
+        elif string_rep == "sendmmsg":
+            return SendModes.SENDMMSG
+        elif string_rep == "udp_gso" or string_rep == "gso":
+            return SendModes.UDP_GSO
+        elif string_rep == "auto":
+            return SendModes.AUTO
+        raise ValueError("Could not parse string: %s" % string_rep)
+
 class FlowParameters:
     def __init__( self
                 , dest_port         = 0
@@ -74,6 +104,7 @@ class FlowParameters:
                 , transmit_rates    = None
                 , source_addr       = None
                 , flow_id           = 0
+                , send_mode         = SendModes.SENDTO
                 ):
         # UDP destination port of the flow
         self.dest_port          = dest_port
@@ -106,6 +137,9 @@ class FlowParameters:
         self.data_str           = b"x" * self.packet_len
         # The ID of this particular flow
         self.flow_id            = flow_id
+        # How each burst is handed to the kernel. SENDMMSG and UDP_GSO send a burst in one
+        # system call per path and fall back to SENDTO where they are not supported.
+        self.send_mode          = send_mode
 
     def __str__(self):
         s = ""
@@ -122,6 +156,7 @@ class FlowParameters:
                   , f"Transmit Rates : {self.transmit_rates}"
                   , f"Source Address : {self.source_addr}"
                   , f"Flow ID        : {self.flow_id}"
+                  , f"Send Mode      : {self.send_mode}"
                   ]
         s = reduce(lambda s1, s2 : s1 + "\n" + s2, str_rep)
         return s
@@ -131,9 +166,18 @@ class FlowParameters:
 
 pkt_count = defaultdict(int)
 flow_params = None
-sock_dict = None
+flow_senders = None
 BURST_COUNT = 10
 INSTANCE_ID = None
+# Index of this process among the traffic_gen workers, None when running as a single process.
+WORKER_ID = None
+worker_procs = []
+# Publishes pkt_count to a live counter file, flow_num -> (slot index, bytes per burst)
+counter_writer = None
+counter_slots = {}
+# time.sleep can overshoot by the kernel timer slack (50us by default on Linux) so the
+# final part of each wait is spent spinning on time.perf_counter() instead.
+SPIN_THRESHOLD = 80e-6
 
 # Considers the list of flows to be zero indexed and takes into account
 # that test flows use DSCP values in the range [1, 2**6)
@@ -176,52 +220,58 @@ def uniform_paramaters(mu, sigma2):
     a = 2 * mu - b
     return (a, b)
 
-def sample_distr(distr):
-    return distr.rvs()
-
-def select_tx_rate(args, old_rate, distr):
-    tx_rate = 0
-    if args.traffic_model == TrafficModels.UNIFORM:
-        tx_rate = sample_distr(distr)
-    elif args.traffic_model == TrafficModels.TRUNC_NORM:
-        tx_rate = sample_distr(distr)
-    elif args.traffic_model == TrafficModels.RANDOM_SAMPLING:
-        if random.choice([0,1]) == 0:
-            tx_rate = sample_distr(distr)
+class RateSchedule:
+    """
+    Produces the transmission rate of a flow for each time slice. Rates are drawn from the
+    flow's distribution RATE_BLOCK_SIZE at a time with a single vectorized rvs call, so 
+    moving to the next time slice only indexes into the current block instead of calling
+    into scipy for every flow at every slice boundary.
+    """
+
+    RATE_BLOCK_SIZE = 1024
+
+    def __init__(self, flow, block_size=None):
+        self._traffic_model = flow.traffic_model
+        self._mean_rate     = flow.tx_rate
+        self._distr         = create_distribution(flow.tx_rate, flow.variance, 
+                flow.traffic_model, flow.transmit_rates)
+        self._block_size    = block_size or RateSchedule.RATE_BLOCK_SIZE
+        self._rates         = []
+        self._rate_idx      = 0
+        self._draw_rates()
+
+    def _draw_rates(self):
+        if self._traffic_model == TrafficModels.PRECOMPUTED:
+            rates = self._distr.take(self._block_size)
         else:
-            tx_rate = old_rate
-    elif args.traffic_model == TrafficModels.TRUNC_NORM_SYMMETRIC:
-        tx_rate = sample_distr(distr)
-    elif args.traffic_model == TrafficModels.GAMMA:
-        tx_rate = sample_distr(distr)
-    elif args.traffic_model == TrafficModels.PRECOMPUTED:
-        tx_rate = next(distr)
-
-    return tx_rate
-
-# Takes a one dimensional matrix of length k as an argument and returns
-# the DSCP value that a packet should be tagged with. 
-#
-# The i_th entry of <prob_matrix> contains the proportion of the flow 
-# (udp stream) that should be sent over path i, thus the constraint: 
-#
-#       \sigma_i=0^k{prob_matrix_i} = 1
-#
-# should hold for all instances of prob_matrix
-def select_dscp(prob_matrix, tag_values):
-    random_pick = random.uniform(0, 1)
-    accumulator = 0.0
-
-    for flow_num, proportion in enumerate(prob_matrix):
-        accumulator = accumulator + proportion
-        if (random_pick <= accumulator):
-            return calc_dscp_val(flow_num, tag_values)
-
-def set_dscp(sock, dscp):
-    sock.setsockopt(socket.SOL_IP, socket.IP_TOS, dscp)
+            rates = self._distr.rvs(size=self._block_size)
+            if self._traffic_model == TrafficModels.RANDOM_SAMPLING:
+                # Each slice either takes a fresh sample or falls back to the mean rate
+                # of the flow.
+                keep_mean = np.random.randint(0, 2, size=self._block_size) == 1
+                rates = np.where(keep_mean, self._mean_rate, rates)
+        self._rates = np.asarray(rates, dtype=np.float64).tolist()
+        self._rate_idx = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._rate_idx >= len(self._rates):
+            self._draw_rates()
+        rate = self._rates[self._rate_idx]
+        self._rate_idx += 1
+        return rate
 
 def get_args():
-    path_to_args_file = path.Path(reduce(op.add, sys.argv[1:]))
+    p = argparse.ArgumentParser("Generate traffic for multipath routing experiments.")
+    p.add_argument("args_file", nargs="+", help="JSON file listing the flows to generate.")
+    p.add_argument("-workers", dest="worker_count", type=int, default=1,
+            help="Number of processes to spread the flows over.")
+    p.add_argument("-cpus", dest="cpus", type=int, nargs="+", default=None,
+            help="CPUs to pin the workers to. Defaults to every CPU this process may use.")
+    args = p.parse_args()
+    path_to_args_file = path.Path(reduce(op.add, args.args_file))
     # TODO: Pass the instance id explicitly
     global INSTANCE_ID
     INSTANCE_ID = int(str(path_to_args_file).split("-")[3])
@@ -231,55 +281,76 @@ def get_args():
     # arg_dicts = json.loads(arg_str)
     for d in argument_dicts:
         d['traffic_model'] = TrafficModels.from_str(d['traffic_model'])
+        if "send_mode" in d:
+            d["send_mode"] = SendModes.from_str(d["send_mode"])
     fp_list = { i: FlowParameters(**d) for i, d in enumerate(argument_dicts) }
-    return fp_list
+    return fp_list, args.worker_count, args.cpus
 
 def inc_pkt_count(flow_num):
     global pkt_count
     pkt_count[flow_num] = pkt_count[flow_num] + BURST_COUNT
+    if counter_writer != None:
+        slot_idx, burst_bytes = counter_slots[flow_num]
+        counter_writer.add_packets(slot_idx, BURST_COUNT, burst_bytes)
+
+def create_counter_writer(flow_params, senders):
+    global counter_writer
+    global counter_slots
+    src_host_id = next(iter(flow_params.values())).src_host
+    counter_writer = live_counters.LiveCounterWriter(
+            live_counters.get_sender_counter_path(src_host_id, INSTANCE_ID, WORKER_ID),
+            live_counters.CounterKinds.SENDER, capacity=len(flow_params))
+    counter_slots = {}
+    for flow_num, fp in flow_params.items():
+        slot_idx = counter_writer.add_slot(flow_num, fp.flow_id, fp.source_addr, 
+                senders[flow_num].get_source_port(), fp.dest_addr, fp.dest_port)
+        counter_slots[flow_num] = (slot_idx, BURST_COUNT * fp.packet_len)
 
 def compute_inter_pkt_delay(pkt_len, tx_rate, time_slice_duration):
     """
     Doesn't actually compute the inter-packet delay, computes the delay that would 
     be required to allow 10 packets to be transmitted.
     """
-    if tx_rate == 0.0:
+    if tx_rate <= 0.0:
         return time_slice_duration
     return (float(pkt_len) / float(tx_rate)) * float(BURST_COUNT)
 
-def wait(t):
-    start = time.perf_counter()
-    # @TODO: It's probably fine that the traffic gen application pretty much consumes a core, but
-    # it might be worth looking into making this more efficient.
-    while (time.perf_counter() - start) < t:
+def wait_until(deadline):
+    """
+    Block until time.perf_counter() reaches deadline. Sleeps through all but the last
+    SPIN_THRESHOLD seconds of the wait and busy waits for the remainder, so the generator
+    only occupies a core for the final few tens of microseconds before each burst.
+    """
+    remaining = deadline - time.perf_counter()
+    if remaining > SPIN_THRESHOLD:
+        time.sleep(remaining - SPIN_THRESHOLD)
+    while time.perf_counter() < deadline:
         pass
 
-def transmit(sock_list, ipd_list, duration, flow_params):
-    # for idx, flow in enumerate(flow_params.values()):
-    #     ipd_set = ipd_list[idx]
-    #     for _ in range(10):
-    #         sock_list[idx].sendto(flow.data_str, (flow.dest_addr, flow.dest_port))
-
-    ipds = { i : (sock_list[i], ipd_list[i]) for i in range(len(ipd_list)) }
-    start_time = time.time()
-    wait_time = min(ipds.values(), key=lambda t : t[1])
-    while (time.time() - start_time) < duration:
-        loop_start = time.perf_counter()
-        expired = [ i for i, (_, t) in ipds.items() if t <= 0.0 ]
-        for i in expired:
-            flow = ipds[i]
-
-            for _ in range(BURST_COUNT):
-                dscp_val = select_dscp(flow_params[i].prob_mat, flow_params[i].tag_value)
-                set_dscp(flow[0], dscp_val)
-                flow[0].sendto(flow_params[i].data_str, (flow_params[i].dest_addr, flow_params[i].dest_port))
-            inc_pkt_count(i)
-            ipds[i] = (ipds[i][0], ipd_list[i])
-        t_offset = max(0.0, time.perf_counter() - loop_start)
-        wait_time = min(ipds.values(), key=lambda t : t[1])[1] - t_offset
-        wait(wait_time)
-        actual_wait = time.perf_counter() - loop_start
-        ipds = { i: (s, t - actual_wait) for i, (s, t) in ipds.items() }
+def wait(t):
+    wait_until(time.perf_counter() + t)
+
+def transmit(flow_senders, ipds, duration):
+    """
+    Send a burst of BURST_COUNT packets for flow i every ipds[i] seconds for duration
+    seconds, where ipds maps each flow number to its inter-burst delay. The next send
+    deadline of each flow is kept in a min-heap so finding the next flow that is due, and
+    rescheduling it, is O(log flows). Deadlines advance by a whole inter-burst delay each
+    time so that scheduling jitter does not accumulate.
+    """
+    start_time = time.perf_counter()
+    end_time = start_time + duration
+    deadlines = [(start_time + ipd, i) for i, ipd in ipds.items()]
+    heapq.heapify(deadlines)
+    # A generator that has fallen behind catches up on missed bursts, but never sends
+    # past the end of the time slice.
+    while deadlines and deadlines[0][0] < end_time and time.perf_counter() < end_time:
+        deadline, i = deadlines[0]
+        wait_until(deadline)
+        flow_senders[i].send_burst()
+        inc_pkt_count(i)
+        heapq.heapreplace(deadlines, (deadline + ipds[i], i))
+    wait_until(end_time)
 
 def create_socket(source_address):
     the_socket = socket.socket(type=socket.SOCK_DGRAM)
@@ -287,34 +358,377 @@ def create_socket(source_address):
         the_socket.bind((source_address, 0))
     return the_socket
 
+def create_path_sockets(source_address, dscp_values):
+    """
+    Create one socket per path with its DSCP value already set. All of the sockets are
+    bound to the same source port using SO_REUSEPORT so that the receiver still sees a
+    single flow.
+
+    The first socket is bound to an ephemeral port without SO_REUSEPORT, which the kernel
+    only hands out if no other socket holds it, and SO_REUSEPORT is set once it is bound so
+    that the other paths can join it. Binding it with SO_REUSEPORT already set could give
+    two flows the same source port.
+    """
+    path_socks = []
+    source_port = 0
+    for dscp_val in dscp_values:
+        the_socket = socket.socket(type=socket.SOCK_DGRAM)
+        if source_port != 0:
+            the_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        the_socket.setsockopt(socket.SOL_IP, socket.IP_TOS, dscp_val)
+        the_socket.bind((source_address or "", source_port))
+        if source_port == 0:
+            the_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            source_port = the_socket.getsockname()[1]
+        path_socks.append(the_socket)
+    return path_socks
+
+# Linux UDP generic segmentation offload, see linux/udp.h
+SOL_UDP             = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT         = getattr(socket, "UDP_SEGMENT", 103)
+UDP_MAX_SEGMENTS    = 64
+UDP_MAX_PAYLOAD     = 65507
+
+class MMsgBatch:
+    """
+    A pre-built array of max_count messages to the same destination that can be handed
+    to sendmmsg on any socket. Each message has its own copy of data_str in payload, at
+    offset i * len(data_str), so that headers can be written into it before sending.
+    """
+
+    def __init__(self, data_str, destination, max_count):
+        dest_addr, dest_port = destination
+        self._sendmmsg  = mmsg.load_sendmmsg()
+        self._max_count = max_count
+        self._data      = ctypes.create_string_buffer(data_str * max_count, 
+                len(data_str) * max_count)
+        self._sockaddr  = ctypes.create_string_buffer(struct.pack("=H", socket.AF_INET) + 
+                struct.pack("!H", dest_port) + socket.inet_aton(dest_addr) + bytes(8), 16)
+        self._iovs      = (mmsg.IOVec * max_count)()
+        self._msgs      = (mmsg.MMsgHdr * max_count)()
+        for msg_idx, msg in enumerate(self._msgs):
+            self._iovs[msg_idx].iov_base    = ctypes.addressof(self._data) + msg_idx * len(data_str)
+            self._iovs[msg_idx].iov_len     = len(data_str)
+            msg.msg_hdr.msg_name    = ctypes.addressof(self._sockaddr)
+            msg.msg_hdr.msg_namelen = 16
+            msg.msg_hdr.msg_iov     = ctypes.pointer(self._iovs[msg_idx])
+            msg.msg_hdr.msg_iovlen  = 1
+        self._msgs_addr = ctypes.addressof(self._msgs)
+        self.payload    = memoryview(self._data).cast("B")
+
+    def send(self, fd, count):
+        """
+        Send the first count messages. If a sendmmsg call fails the OSError raised has a
+        sent_count attribute with the number of messages that were sent before it.
+
+        RETURNS
+            count
+        """
+        msg_idx = 0
+        while msg_idx < count:
+            sent_count = self._sendmmsg(fd, self._msgs_addr + msg_idx * ctypes.sizeof(mmsg.MMsgHdr),
+                    min(count - msg_idx, self._max_count), 0)
+            if sent_count < 0:
+                err = ctypes.get_errno()
+                ex = OSError(err, os.strerror(err))
+                ex.sent_count = msg_idx
+                raise ex
+            msg_idx += sent_count
+        return msg_idx
+
+def supports_sendmmsg(destination):
+    try:
+        socket.inet_aton(destination[0])
+    except OSError:
+        return False
+    return mmsg.load_sendmmsg() is not None
+
+def get_max_gso_segments(packet_len):
+    return min(UDP_MAX_SEGMENTS, UDP_MAX_PAYLOAD // packet_len) if packet_len > 0 else 0
+
+def enable_udp_gso(the_socket, packet_len):
+    """
+    Have the kernel split every datagram sent on the_socket into packet_len byte packets.
+    Returns False if UDP GSO is not supported.
+    """
+    if get_max_gso_segments(packet_len) < 2:
+        return False
+    try:
+        the_socket.setsockopt(SOL_UDP, UDP_SEGMENT, packet_len)
+    except OSError:
+        return False
+    return True
+
+class FlowSender:
+    """
+    Sends the bursts of a single flow. Each path has its own pre-tagged socket so that
+    sending a packet is a single sendto call, and the path of each packet is drawn from 
+    prob_mat in blocks of PATH_BLOCK_SIZE rather than one random pick at a time.
+
+    With SendModes.SENDMMSG or SendModes.UDP_GSO the packets of a burst that take the 
+    same path are sent with a single system call: a sendmmsg of identical messages, or
+    one GSO datagram that the kernel segments into packet_len byte packets. Modes that 
+    are not supported fall back to the next one, ending with a sendto per packet.
+
+    If packets are long enough, each one starts with a flow_metrics header holding the
+    flow ID, the DSCP tag of its path, its sequence number and the time it was sent. The
+    header is packed into a reused buffer, and packets sent in one system call share the
+    same send time.
+    """
+
+    PATH_BLOCK_SIZE = 4096
+
+    def __init__(self, flow):
+        self._data_str      = flow.data_str
+        self._destination   = (flow.dest_addr, flow.dest_port)
+        self._path_tags     = [calc_dscp_val(path_idx, flow.tag_value) 
+                for path_idx in range(len(flow.prob_mat))]
+        self._path_socks    = create_path_sockets(flow.source_addr, self._path_tags)
+        self._flow_id       = flow.flow_id & 0xFFFFFFFF
+        self._seq_num       = 0
+        self._add_header    = len(self._data_str) >= flow_metrics.HEADER_SIZE
+        self._payload       = bytearray(self._data_str)
+        self._path_sendtos  = [the_socket.sendto for the_socket in self._path_socks]
+        self._cumulative    = np.cumsum(flow.prob_mat)
+        self._path_choices  = []
+        self._choice_idx    = 0
+        self._send_mode     = self._select_send_mode(flow.send_mode)
+
+    @property
+    def send_mode(self):
+        return self._send_mode
+
+    @property
+    def seq_count(self):
+        """
+        The number of packets that have been given a sequence number.
+        """
+        return self._seq_num
+
+    def _select_send_mode(self, requested_mode):
+        if requested_mode in [SendModes.UDP_GSO, SendModes.AUTO]:
+            if all(enable_udp_gso(the_socket, len(self._data_str)) 
+                    for the_socket in self._path_socks):
+                self._max_segments = get_max_gso_segments(len(self._data_str))
+                self._gso_payload = memoryview(bytearray(self._data_str * self._max_segments))
+                return SendModes.UDP_GSO
+            self._disable_udp_gso()
+        if requested_mode in [SendModes.SENDMMSG, SendModes.UDP_GSO, SendModes.AUTO]:
+            if supports_sendmmsg(self._destination):
+                self._mmsg_batch = MMsgBatch(self._data_str, self._destination, BURST_COUNT)
+                self._path_fds = [the_socket.fileno() for the_socket in self._path_socks]
+                return SendModes.SENDMMSG
+        return SendModes.SENDTO
+
+    def _disable_udp_gso(self):
+        for the_socket in self._path_socks:
+            try:
+                the_socket.setsockopt(SOL_UDP, UDP_SEGMENT, 0)
+            except OSError:
+                pass
+
+    def get_source_port(self):
+        return self._path_socks[0].getsockname()[1]
+
+    def _draw_paths(self):
+        # Each packet takes the first path whose cumulative proportion is at least the
+        # random pick.
+        picks = np.random.uniform(0, 1, FlowSender.PATH_BLOCK_SIZE)
+        self._path_choices = np.minimum(np.searchsorted(self._cumulative, picks),
+                len(self._path_socks) - 1).tolist()
+        self._choice_idx = 0
+
+    def next_paths(self, count):
+        if self._choice_idx + count > len(self._path_choices):
+            self._draw_paths()
+        path_choices = self._path_choices[self._choice_idx:self._choice_idx + count]
+        self._choice_idx += count
+        return path_choices
+
+    def _add_headers(self, payload, path_idx, packet_count, send_time_ns):
+        pack_into, packet_len = flow_metrics.HEADER_STRUCT.pack_into, len(self._data_str)
+        path_tag, flow_id, seq_num = self._path_tags[path_idx], self._flow_id, self._seq_num
+        for packet_idx in range(packet_count):
+            pack_into(payload, packet_idx * packet_len, flow_metrics.HEADER_MAGIC,
+                    flow_metrics.HEADER_VERSION, path_tag, flow_id, seq_num + packet_idx,
+                    send_time_ns)
+
+    def _send_each(self, path_choices):
+        path_sendtos, destination = self._path_sendtos, self._destination
+        if not self._add_header:
+            data_str = self._data_str
+            for path_idx in path_choices:
+                path_sendtos[path_idx](data_str, destination)
+            return
+        pack_into, payload = flow_metrics.HEADER_STRUCT.pack_into, self._payload
+        path_tags, flow_id, seq_num = self._path_tags, self._flow_id, self._seq_num
+        for path_idx in path_choices:
+            pack_into(payload, 0, flow_metrics.HEADER_MAGIC, flow_metrics.HEADER_VERSION,
+                    path_tags[path_idx], flow_id, seq_num, time.time_ns())
+            seq_num += 1
+            path_sendtos[path_idx](payload, destination)
+        self._seq_num = seq_num
+
+    def send_burst(self, count=BURST_COUNT):
+        path_choices = self.next_paths(count)
+        if self._send_mode == SendModes.SENDTO:
+            self._send_each(path_choices)
+            return
+
+        if len(self._path_socks) == 1:
+            path_counts = [len(path_choices)]
+        else:
+            path_counts = [0] * len(self._path_socks)
+            for path_idx in path_choices:
+                path_counts[path_idx] += 1
+        for path_idx, path_count in enumerate(path_counts):
+            if path_count > 0:
+                self._send_batch(path_idx, path_count)
+
+    def _send_batch(self, path_idx, path_count):
+        try:
+            if self._send_mode == SendModes.UDP_GSO:
+                while path_count > 0:
+                    segment_count = min(path_count, self._max_segments)
+                    if self._add_header:
+                        self._add_headers(self._gso_payload, path_idx, segment_count, 
+                                time.time_ns())
+                    self._path_sendtos[path_idx](
+                            self._gso_payload[:segment_count * len(self._data_str)], 
+                            self._destination)
+                    self._seq_num += segment_count
+                    path_count -= segment_count
+            else:
+                if self._add_header:
+                    self._add_headers(self._mmsg_batch.payload, path_idx, path_count, 
+                            time.time_ns())
+                self._mmsg_batch.send(self._path_fds[path_idx], path_count)
+                self._seq_num += path_count
+        except OSError as ex:
+            # GSO is refused with EINVAL/EIO if a segment does not fit in the path MTU or
+            # the device cannot checksum it, after which every later send would fail too.
+            if ex.errno not in [errno.EINVAL, errno.EIO, errno.ENOSYS, errno.EOPNOTSUPP]:
+                raise
+            # Only resend the packets of a partially sent sendmmsg batch that did not go out,
+            # with the sequence numbers they were given.
+            sent_count = getattr(ex, "sent_count", 0)
+            self._seq_num += sent_count
+            path_count -= sent_count
+            if self._send_mode == SendModes.UDP_GSO:
+                self._disable_udp_gso()
+                self._send_mode = self._select_send_mode(SendModes.SENDMMSG)
+            else:
+                self._send_mode = SendModes.SENDTO
+            self._send_each([path_idx] * path_count)
+
+    def close(self):
+        for the_socket in self._path_socks:
+            the_socket.close()
+
 def generate_traffic(flow_params):
 
-    socks = {i: create_socket(flow_params[i].source_addr) for i in flow_params.keys()}
-    global sock_dict
-    sock_dict = socks
-    rvs = {i: create_distribution(fp.tx_rate, fp.variance, fp.traffic_model, fp.transmit_rates) 
-            for i, fp in flow_params.items()}
+    senders = {i: FlowSender(fp) for i, fp in flow_params.items()}
+    global flow_senders
+    flow_senders = senders
+    create_counter_writer(flow_params, senders)
+    rate_schedules = {i: RateSchedule(fp) for i, fp in flow_params.items()}
+    time_slice = next(iter(flow_params.values())).time_slice
     while True:
-        ipd_list = []
-        for i, fp in flow_params.items():
-            r = select_tx_rate(fp, fp.tx_rate, rvs[i])
-            ipd_list.append(compute_inter_pkt_delay(fp.packet_len, r, fp.time_slice))
-        transmit(socks, ipd_list, flow_params[0].time_slice, flow_params)
+        ipds = {i: compute_inter_pkt_delay(fp.packet_len, next(rate_schedules[i]), fp.time_slice)
+                for i, fp in flow_params.items()}
+        counter_writer.heartbeat()
+        transmit(senders, ipds, time_slice)
+
+def compute_expected_pps(flow):
+    if flow.traffic_model == TrafficModels.PRECOMPUTED and flow.transmit_rates:
+        mean_rate = sum(flow.transmit_rates) / float(len(flow.transmit_rates))
+    else:
+        mean_rate = flow.tx_rate
+    return max(float(mean_rate), 0.0) / max(flow.packet_len, 1)
+
+def shard_flows(flow_params, worker_count):
+    """
+    Split the flows into at most worker_count shards with as even an expected packet rate
+    as possible. Flows are taken in decreasing order of expected packets per second and
+    each is assigned to the shard with the lowest total so far.
+
+    RETURNS
+        [flow_num -> FlowParameters], one dictionary per non-empty shard
+    """
+    worker_count = max(1, min(worker_count, len(flow_params)))
+    shard_loads = [(0.0, worker_id) for worker_id in range(worker_count)]
+    shards = [{} for _ in range(worker_count)]
+    for flow_num, fp in sorted(flow_params.items(), 
+            key=lambda item: compute_expected_pps(item[1]), reverse=True):
+        shard_load, worker_id = heapq.heappop(shard_loads)
+        shards[worker_id][flow_num] = fp
+        heapq.heappush(shard_loads, (shard_load + compute_expected_pps(fp), worker_id))
+    return [shard for shard in shards if shard]
+
+def run_worker(worker_id, cpu, shard):
+    global WORKER_ID
+    global flow_params
+    WORKER_ID = worker_id
+    flow_params = shard
+    # A forked worker starts with a copy of the parent's random state, reseed so that the
+    # workers do not all draw the same rates and paths.
+    np.random.seed()
+    signal.signal(signal.SIGINT, handle_sig_int)
+    if cpu != None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+    generate_traffic(shard)
+
+def start_workers(shards, cpus):
+    """
+    Run each shard in its own process, with worker i pinned to cpus[i % len(cpus)].
+    """
+    if cpus is None and hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    ctx = mp.get_context("fork")
+    for worker_id, shard in enumerate(shards):
+        cpu = cpus[worker_id % len(cpus)] if cpus else None
+        worker_proc = ctx.Process(target=run_worker, args=(worker_id, cpu, shard))
+        worker_proc.start()
+        worker_procs.append(worker_proc)
+
+def get_sender_file_path(src_host_id, worker_id=None):
+    if worker_id is None:
+        return f"/tmp/sender_{src_host_id}-{INSTANCE_ID}.p"
+    return f"/tmp/sender_{src_host_id}-{INSTANCE_ID}-worker-{worker_id}.p"
 
 def handle_sig_int(signum, frame):
+    # A worker may be interrupted both by the terminal and by its parent.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
     flow_info = {}
     src_host_id = None
     for flow_num, fp in flow_params.items():
+        src_host_id = fp.src_host # TODO: Store canonical src_host id
+        if WORKER_ID is None and worker_procs:
+            continue
         flow_info[flow_num] = {}
         flow_info[flow_num]["pkt_count"]    = pkt_count[flow_num]
-        flow_info[flow_num]["src_port"]     = sock_dict[flow_num].getsockname()[1]
+        flow_info[flow_num]["src_port"]     = flow_senders[flow_num].get_source_port()
         flow_info[flow_num]["src_host"]     = fp.src_host
         flow_info[flow_num]["dst_ip"]       = fp.dest_addr
         flow_info[flow_num]["flow_id"]      = fp.flow_id
-        src_host_id = fp.src_host # TODO: Store canonical src_host id
-
-    file_path = f"/tmp/sender_{src_host_id}-{INSTANCE_ID}.p"
-    with open(file_path, "wb") as fd:
+        flow_info[flow_num]["seq_count"]    = flow_senders[flow_num].seq_count
+
+    if WORKER_ID is None and worker_procs:
+        # Stop the workers and merge their results into the same format as a single
+        # process would have produced.
+        for worker_proc in worker_procs:
+            if worker_proc.is_alive():
+                os.kill(worker_proc.pid, signal.SIGINT)
+        for worker_id, worker_proc in enumerate(worker_procs):
+            worker_proc.join()
+            worker_file_path = path.Path(get_sender_file_path(src_host_id, worker_id))
+            if worker_file_path.exists():
+                with worker_file_path.open("rb") as fd:
+                    flow_info.update(pickle.load(fd))
+                worker_file_path.unlink()
+        flow_info = {flow_num: flow_info[flow_num] for flow_num in sorted(flow_info)}
+
+    with open(get_sender_file_path(src_host_id, WORKER_ID), "wb") as fd:
         pickle.dump(flow_info, fd)
     exit()
 
@@ -328,9 +742,14 @@ def set_log_level(log_level):
 def main():
     global flow_params
     global src_port
-    flow_params = get_args()
-    
-    generate_traffic(flow_params)
+    flow_params, worker_count, cpus = get_args()
+
+    if worker_count <= 1:
+        generate_traffic(flow_params)
+    else:
+        start_workers(shard_flows(flow_params, worker_count), cpus)
+        for worker_proc in worker_procs:
+            worker_proc.join()
 
 if __name__ == '__main__':
     set_log_level(lg.INFO)
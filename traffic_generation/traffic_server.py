@@ -6,47 +6,511 @@ import signal           as signal
 import os               as os
 import pickle           as pickle
 import argparse         as argparse
+import ctypes           as ctypes
+import errno            as errno
+import struct           as struct
+import time             as time
+import pathlib          as path
+import multiprocessing  as mp
+import live_counters    as live_counters
+import flow_metrics     as flow_metrics
 
+from enum               import Enum
 from collections        import defaultdict
+from mmsg               import IOVec, MsgHdr, MMsgHdr, load_recvmmsg
 
-# pkt_counts :: (src_addr, src_port) -> recv_count
-byte_counts = defaultdict(int)
+class RecvModes(Enum):
+    RECVFROM                = 0
+    RECVMMSG                = 1
+    AUTO                    = 2
+
+    @staticmethod
+    def from_str(string_rep):
+        string_rep = string_rep.lower()
+        if string_rep == "recvfrom":
+            return RecvModes.RECVFROM
+        elif string_rep == "recvmmsg":
+            return RecvModes.RECVMMSG
+        elif string_rep == "auto":
+            return RecvModes.AUTO
+        raise ValueError("Could not parse string: %s" % string_rep)
+
+# Large enough for any UDP datagram
+RECV_BUFFER_SIZE = 65536
+# Maximum number of packets taken from the socket between updates of the live counters
+RECV_BATCH_SIZE = 64
+MSG_WAITFORONE = getattr(socket, "MSG_WAITFORONE", 0x10000)
+SOCKADDR_IN_SIZE = 16
+TRAFFIC_SERVER_PORT = 50000
+# Has the kernel attach the number of packets it has dropped on a socket to each packet
+# received from it, see socket(7)
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+DROP_COUNT_CMSG_SPACE = socket.CMSG_SPACE(4)
+
+# Per source counters, shared with the SIGINT handler
+source_counters = None
+receiver = None
 args = None
+WORKER_ID = None
+worker_procs = []
+# Publishes source_counters to a live counter file
+counter_writer = None
 
 def get_args():
     p = argparse.ArgumentParser('Receive traffic for multipath routing experminets.')
-    p.add_argument('-host', dest='host_num', metavar='<host_num>', nargs=1, 
+    p.add_argument('-host', dest='host_num', metavar='<host_num>', nargs=1,
             help='host number', required=True)
     p.add_argument("-source_addr", dest="source_addr", metavar="<source_addr>", nargs=1,
             help="Source address to bind to.", required=True)
+    p.add_argument("-recv_mode", dest="recv_mode", metavar="<recv_mode>", default="auto",
+            help="One of recvfrom, recvmmsg or auto.")
+    p.add_argument("-workers", dest="worker_count", metavar="<worker_count>", type=int,
+            default=1, help="Number of processes to receive on, each with its own socket.")
+    p.add_argument("-cpus", dest="cpus", metavar="<cpu>", type=int, nargs="+", default=None,
+            help="CPUs to pin the workers to, defaults to every CPU the server may run on.")
+    p.add_argument("-flow_metrics", dest="track_flows", action="store_true",
+            help="Measure the loss, reordering, latency and jitter of each flow.")
     args = p.parse_args()
-    return int(args.host_num[0]), args.source_addr[0]
+    return (int(args.host_num[0]), args.source_addr[0], RecvModes.from_str(args.recv_mode),
+            args.worker_count, args.cpus, args.track_flows)
+
+class SourceCounters:
+    """
+    Class: SourceCounters
+    Purpose: Packet and byte counts of each source, stored in lists indexed by the order
+    in which the sources were first seen. source_index maps a key for the source (either
+    the (src_addr, src_port) tuple or the raw sockaddr of recvmmsg) to its index, so
+    counting a packet is a dict lookup and two list updates.
+
+    If track_flows is set, packets that start with a flow_metrics header are also passed
+    to add_header, which tracks the loss, reordering, latency and jitter of each (source,
+    flow ID). This costs several times as much as counting the packet, so it is off by
+    default.
+    """
+
+    def __init__(self, counter_writer=None, track_flows=False):
+        self.source_index       = {}
+        self.sources            = []
+        self.packet_counts      = []
+        self.byte_counts        = []
+        self._counter_writer    = counter_writer
+        self.track_flows        = track_flows
+        self._counter_slots     = []
+        self._published_packets = []
+        self._published_bytes   = []
+        # (source_idx, flow_id) -> FlowMetrics
+        self.flow_metrics       = {}
+
+    def add_source(self, key, source):
+        source_idx = len(self.sources)
+        self.source_index[key] = source_idx
+        self.sources.append(source)
+        self.packet_counts.append(0)
+        self.byte_counts.append(0)
+        self._published_packets.append(0)
+        self._published_bytes.append(0)
+        self._counter_slots.append(self._counter_writer.add_slot(src_ip=source[0],
+            src_port=source[1]) if self._counter_writer != None else None)
+        return source_idx
+
+    def publish(self):
+        """
+        Add the packets counted since the last call to the live counters.
+        """
+        if self._counter_writer == None:
+            return
+        now = time.time()
+        for source_idx, slot_idx in enumerate(self._counter_slots):
+            packet_delta = self.packet_counts[source_idx] - self._published_packets[source_idx]
+            if packet_delta > 0 and slot_idx != None:
+                byte_delta = self.byte_counts[source_idx] - self._published_bytes[source_idx]
+                self._counter_writer.add_packets(slot_idx, packet_delta, byte_delta, now)
+                self._published_packets[source_idx] += packet_delta
+                self._published_bytes[source_idx] += byte_delta
+
+    def add_header(self, source_idx, recv_buffer, offset, recv_time_ns):
+        header = flow_metrics.unpack_header(recv_buffer, offset)
+        if header is None:
+            return
+        path_tag, flow_id, seq_num, send_time_ns = header
+        metrics = self.flow_metrics.get((source_idx, flow_id))
+        if metrics is None:
+            metrics = self.flow_metrics[(source_idx, flow_id)] = flow_metrics.FlowMetrics(flow_id)
+        metrics.add(path_tag, seq_num, send_time_ns, recv_time_ns)
+
+    def get_flow_metrics(self):
+        """
+        RETURNS
+            (src_addr, src_port, flow_id) -> flow_metrics.FlowMetrics.to_dict()
+        """
+        return {self.sources[source_idx] + (flow_id,): metrics.to_dict()
+                for (source_idx, flow_id), metrics in self.flow_metrics.items()}
+
+    def get_packet_counts(self):
+        """
+        RETURNS
+            (src_addr, src_port) -> recv_count
+        """
+        return dict(zip(self.sources, self.packet_counts))
+
+def enable_drop_reporting(the_socket):
+    """
+    Returns False if the kernel cannot report the packets it drops on the_socket.
+    """
+    try:
+        the_socket.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+    except OSError:
+        return False
+    return True
+
+def read_socket_drop_count(the_socket, proc_file_path="/proc/net/udp"):
+    """
+    The number of packets the kernel has dropped on the_socket so far. Unlike the count
+    reported through SO_RXQ_OVFL, this includes drops after the last packet received.
+
+    RETURNS
+        The drop count, or None if it could not be read.
+    """
+    try:
+        socket_inode = str(os.fstat(the_socket.fileno()).st_ino)
+        with open(proc_file_path) as fd:
+            next(fd)
+            for line in fd:
+                fields = line.split()
+                if fields[9] == socket_inode:
+                    return int(fields[-1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+def set_receive_timeout(the_socket, timeout):
+    """
+    Have blocking receives on the_socket give up after timeout seconds. Unlike
+    socket.settimeout this leaves the socket in blocking mode for recvmmsg.
+    """
+    the_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+            struct.pack("@ll", int(timeout), int((timeout % 1) * 10**6)))
+
+def create_socket(source_addr, reuse_port=False):
+    """
+    Create the socket that traffic is received on. With reuse_port every process that
+    binds a socket to the same address shares the traffic, the kernel hashes each flow
+    to one of the sockets.
+    """
+    the_socket = socket.socket(type=socket.SOCK_DGRAM)
+    if reuse_port:
+        the_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    the_socket.bind((source_addr, TRAFFIC_SERVER_PORT))
+    return the_socket
+
+def decode_sockaddr_key(key):
+    raw_sockaddr = struct.pack("=Q", key)
+    return socket.inet_ntoa(raw_sockaddr[4:8]), struct.unpack("!H", raw_sockaddr[2:4])[0]
+
+class Receiver:
+    """
+    Class: Receiver
+    Purpose: Receives packets from an IPv4 UDP socket into preallocated buffers and counts
+    them in a SourceCounters. With RecvModes.RECVFROM each packet is read by a
+    recvfrom_into call, with RecvModes.RECVMMSG up to batch_size packets are read by a
+    single recvmmsg call. RecvModes.AUTO uses recvmmsg where it is available.
+
+    If SO_RXQ_OVFL is enabled on the socket, drop_count is the number of packets the
+    kernel had dropped on the socket when the most recent packet was queued.
+    """
+
+    def __init__(self, the_socket, counters, recv_mode=RecvModes.AUTO,
+            batch_size=RECV_BATCH_SIZE):
+        self._socket        = the_socket
+        self._counters      = counters
+        self._batch_size    = batch_size
+        self._buffer        = bytearray(RECV_BUFFER_SIZE)
+        self._report_drops  = bool(the_socket.getsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL))
+        self._drop_count    = 0
+        self._recv_mode     = self._select_recv_mode(recv_mode)
+
+    @property
+    def recv_mode(self):
+        return self._recv_mode
+
+    @property
+    def drop_count(self):
+        return self._drop_count
+
+    def get_final_drop_count(self):
+        final_drop_count = read_socket_drop_count(self._socket)
+        return max(self._drop_count, final_drop_count or 0)
+
+    def _select_recv_mode(self, requested_mode):
+        if requested_mode in [RecvModes.RECVMMSG, RecvModes.AUTO] and load_recvmmsg() != None:
+            self._create_mmsg_buffers()
+            return RecvModes.RECVMMSG
+        return RecvModes.RECVFROM
+
+    def _create_mmsg_buffers(self):
+        batch_size = self._batch_size
+        self._recvmmsg  = load_recvmmsg()
+        self._fd        = self._socket.fileno()
+        self._data      = ctypes.create_string_buffer(batch_size * RECV_BUFFER_SIZE)
+        self._names     = (ctypes.c_uint64 * (batch_size * SOCKADDR_IN_SIZE // 8))()
+        self._iovs      = (IOVec * batch_size)()
+        self._msgs      = (MMsgHdr * batch_size)()
+        for msg_idx, msg in enumerate(self._msgs):
+            self._iovs[msg_idx].iov_base    = ctypes.addressof(self._data) + msg_idx * RECV_BUFFER_SIZE
+            self._iovs[msg_idx].iov_len     = RECV_BUFFER_SIZE
+            msg.msg_hdr.msg_name    = ctypes.addressof(self._names) + msg_idx * SOCKADDR_IN_SIZE
+            msg.msg_hdr.msg_namelen = SOCKADDR_IN_SIZE
+            msg.msg_hdr.msg_iov     = ctypes.pointer(self._iovs[msg_idx])
+            msg.msg_hdr.msg_iovlen  = 1
+        if self._report_drops:
+            self._control = ctypes.create_string_buffer(batch_size * DROP_COUNT_CMSG_SPACE)
+            for msg_idx, msg in enumerate(self._msgs):
+                msg.msg_hdr.msg_control = (ctypes.addressof(self._control) +
+                        msg_idx * DROP_COUNT_CMSG_SPACE)
+                msg.msg_hdr.msg_controllen = DROP_COUNT_CMSG_SPACE
+            # msg_controllen is overwritten with the length of the control data received,
+            # so it is restored from this template after every call.
+            self._controllens = (ctypes.c_uint64 * batch_size)(*([DROP_COUNT_CMSG_SPACE] * batch_size))
+        self._msgs_ptr  = ctypes.cast(self._msgs, ctypes.c_void_p)
+        # The first eight bytes of a sockaddr_in (family, port and address) read as one
+        # integer identify the source without building a tuple for each packet.
+        self._name_keys = memoryview(self._names).cast("B").cast("Q")
+        self._msg_words = memoryview(self._msgs).cast("B").cast("I")
+        self._len_stride = ctypes.sizeof(MMsgHdr) // 4
+        self._len_offset = MMsgHdr.msg_len.offset // 4
+        self._msg_qwords = memoryview(self._msgs).cast("B").cast("Q")
+        self._controllen_offset = MsgHdr.msg_controllen.offset // 8
+
+    def receive(self):
+        """
+        Block until at least one packet arrives, count up to batch_size packets and then
+        publish the counts.
+
+        RETURNS
+            The number of packets received, 0 if the call timed out or was interrupted.
+        """
+        if self._recv_mode == RecvModes.RECVMMSG:
+            received_count = self._receive_mmsg()
+        else:
+            received_count = self._receive_from()
+        if received_count > 0:
+            self._counters.publish()
+        return received_count
+
+    def _receive_from(self):
+        recvfrom_into, recv_buffer = self._socket.recvfrom_into, self._buffer
+        counters = self._counters
+        source_index, packet_counts, byte_counts = (counters.source_index,
+                counters.packet_counts, counters.byte_counts)
+        track_flows = counters.track_flows
+        try:
+            if self._report_drops:
+                byte_count, ancdata, _, source = self._socket.recvmsg_into([recv_buffer],
+                        DROP_COUNT_CMSG_SPACE)
+                self._update_drop_count(ancdata)
+            else:
+                byte_count, source = recvfrom_into(recv_buffer)
+        except (BlockingIOError, InterruptedError):
+            return 0
+        received_count = 0
+        try:
+            while True:
+                source_idx = source_index.get(source)
+                if source_idx == None:
+                    source_idx = counters.add_source(source, source)
+                packet_counts[source_idx] += 1
+                byte_counts[source_idx] += byte_count
+                if track_flows and byte_count >= flow_metrics.HEADER_SIZE:
+                    counters.add_header(source_idx, recv_buffer, 0, time.time_ns())
+                received_count += 1
+                if received_count >= self._batch_size:
+                    break
+                byte_count, source = recvfrom_into(recv_buffer, 0, socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            pass
+        return received_count
+
+    def _receive_mmsg(self):
+        received_count = self._recvmmsg(self._fd, self._msgs_ptr, self._batch_size,
+                MSG_WAITFORONE, None)
+        if received_count < 0:
+            err = ctypes.get_errno()
+            if err in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR]:
+                return 0
+            raise OSError(err, os.strerror(err))
+        if self._report_drops:
+            self._read_mmsg_drop_count(received_count - 1)
+        counters = self._counters
+        source_index, packet_counts, byte_counts = (counters.source_index,
+                counters.packet_counts, counters.byte_counts)
+        name_keys = self._name_keys[0:2 * received_count:2].tolist()
+        msg_lens = self._msg_words[self._len_offset:
+                self._len_offset + received_count * self._len_stride:self._len_stride].tolist()
+        for key, byte_count in zip(name_keys, msg_lens):
+            source_idx = source_index.get(key)
+            if source_idx == None:
+                source_idx = counters.add_source(key, decode_sockaddr_key(key))
+            packet_counts[source_idx] += 1
+            byte_counts[source_idx] += byte_count
+        if counters.track_flows:
+            self._add_mmsg_headers(name_keys, msg_lens)
+        return received_count
+
+    def _add_mmsg_headers(self, name_keys, msg_lens):
+        counters, source_index = self._counters, self._counters.source_index
+        # Packets read by one call share a receive time.
+        recv_time_ns = time.time_ns()
+        for msg_idx, (key, byte_count) in enumerate(zip(name_keys, msg_lens)):
+            if byte_count >= flow_metrics.HEADER_SIZE:
+                counters.add_header(source_index[key], self._data, msg_idx * RECV_BUFFER_SIZE,
+                        recv_time_ns)
+
+    def _update_drop_count(self, ancdata):
+        for cmsg_level, cmsg_type, cmsg_data in ancdata:
+            if cmsg_level == socket.SOL_SOCKET and cmsg_type == SO_RXQ_OVFL:
+                self._drop_count = max(self._drop_count, struct.unpack("=I", cmsg_data[:4])[0])
+
+    def _read_mmsg_drop_count(self, msg_idx):
+        # The kernel only attaches the drop count once a packet has been dropped. The count
+        # is cumulative so only the last message of the batch is read.
+        if self._msgs[msg_idx].msg_hdr.msg_controllen >= socket.CMSG_LEN(4):
+            cmsg_len, cmsg_level, cmsg_type, dropped_count = struct.unpack_from("=QiiI",
+                    self._control, msg_idx * DROP_COUNT_CMSG_SPACE)
+            if cmsg_level == socket.SOL_SOCKET and cmsg_type == SO_RXQ_OVFL:
+                self._drop_count = max(self._drop_count, dropped_count)
+        self._msg_qwords[self._controllen_offset::ctypes.sizeof(MMsgHdr) // 8] = \
+                memoryview(self._controllens).cast("B").cast("Q")
+
+    def close(self):
+        if self._recv_mode == RecvModes.RECVMMSG:
+            self._name_keys.release()
+            self._msg_words.release()
+            self._msg_qwords.release()
+
+def get_receiver_file_path(host_id, worker_id=None):
+    if worker_id is None:
+        return "/tmp/receiver_%d.p" % host_id
+    return "/tmp/receiver_%d-worker-%d.p" % (host_id, worker_id)
+
+def get_stats_file_path(host_id):
+    """
+    The drop counts and per-flow metrics are kept out of the receiver file, whose
+    (src_addr, src_port) -> recv_count format existing results depend on. The hosts
+    collect them into the "receiver-stats" entry of each host's results.
+    """
+    return "/tmp/receiver_%d-stats.p" % host_id
+
+def get_results():
+    """
+    RETURNS
+        ((src_addr, src_port) -> recv_count, drop_count,
+         (src_addr, src_port, flow_id) -> flow metrics) for this process.
+    """
+    if receiver is None:
+        return {}, 0, {}
+    return (source_counters.get_packet_counts(), receiver.get_final_drop_count(),
+            source_counters.get_flow_metrics())
 
 def handle_sig_int(signum, frame):
     global args
-    packets_received = { s : bc for s, bc in byte_counts.items() }
+    # A worker may be interrupted both by the terminal and by its parent.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if WORKER_ID != None:
+        with open(get_receiver_file_path(args, WORKER_ID), "wb") as fd:
+            pickle.dump(get_results(), fd)
+        exit()
+
+    if worker_procs:
+        # Stop the workers and merge their results into the same format as a single
+        # process would have produced.
+        packets_received = defaultdict(int)
+        worker_drop_counts = []
+        # Every packet of a flow is hashed to the same worker.
+        flows = {}
+        for worker_proc in worker_procs:
+            if worker_proc.is_alive():
+                os.kill(worker_proc.pid, signal.SIGINT)
+        for worker_id, worker_proc in enumerate(worker_procs):
+            worker_proc.join()
+            worker_file_path = path.Path(get_receiver_file_path(args, worker_id))
+            worker_drop_count = 0
+            if worker_file_path.exists():
+                with worker_file_path.open("rb") as fd:
+                    worker_packets_received, worker_drop_count, worker_flows = pickle.load(fd)
+                for source, packet_count in worker_packets_received.items():
+                    packets_received[source] += packet_count
+                flows.update(worker_flows)
+                worker_file_path.unlink()
+            worker_drop_counts.append(worker_drop_count)
+        packets_received = dict(packets_received)
+    else:
+        packets_received, drop_count, flows = get_results()
+        worker_drop_counts = [drop_count]
     # Should decide on a better IPC mechanism than just named files since
     # the communication becomes dependent on the structure of the host filesystem.
-    # The IPC mechanism should ideally work across machine boundaries as well as on 
+    # The IPC mechanism should ideally work across machine boundaries as well as on
     # the same machine.
-    with open("/tmp/receiver_%d.p" % args, "wb") as fd:
+    with open(get_receiver_file_path(args), "wb") as fd:
         pickle.dump(packets_received, fd)
+    with open(get_stats_file_path(args), "wb") as fd:
+        pickle.dump({ "drop_count"          : sum(worker_drop_counts)
+                    , "worker_drop_counts"  : worker_drop_counts
+                    , "flows"               : flows
+                    }, fd)
     # pp.pprint(packets_received)
     exit()
 
-def inc_pkt_counts(src, bc):
-    # byte_counts[src] = byte_counts[src] + bc
-    byte_counts[src] += 1
+def receive_traffic(source_addr, recv_mode, track_flows=False, reuse_port=False):
+    global counter_writer
+    global source_counters
+    global receiver
+    counter_writer = live_counters.LiveCounterWriter(
+            live_counters.get_receiver_counter_path(args, WORKER_ID),
+            live_counters.CounterKinds.RECEIVER)
+    source_counters = SourceCounters(counter_writer, track_flows)
+    sock = create_socket(source_addr, reuse_port)
+    enable_drop_reporting(sock)
+    # Wake up while idle so that readers can tell a live receiver from a dead one.
+    set_receive_timeout(sock, live_counters.HEARTBEAT_INTERVAL)
+    receiver = Receiver(sock, source_counters, recv_mode)
+
+    while True:
+        receiver.receive()
+        counter_writer.heartbeat()
+
+def run_worker(worker_id, cpu, source_addr, recv_mode, track_flows):
+    global WORKER_ID
+    WORKER_ID = worker_id
+    signal.signal(signal.SIGINT, handle_sig_int)
+    if cpu != None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+    receive_traffic(source_addr, recv_mode, track_flows, reuse_port=True)
+
+def start_workers(worker_count, cpus, source_addr, recv_mode, track_flows):
+    """
+    Receive in worker_count processes, with worker i pinned to cpus[i % len(cpus)]. Each
+    worker binds its own SO_REUSEPORT socket so the kernel spreads the flows over them.
+    """
+    if cpus is None and hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    ctx = mp.get_context("fork")
+    for worker_id in range(worker_count):
+        cpu = cpus[worker_id % len(cpus)] if cpus else None
+        worker_proc = ctx.Process(target=run_worker,
+                args=(worker_id, cpu, source_addr, recv_mode, track_flows))
+        worker_proc.start()
+        worker_procs.append(worker_proc)
 
 def main():
     global args
-    args, source_addr = get_args()
-    sock = socket.socket(type=socket.SOCK_DGRAM)
-    sock.bind((source_addr, 50000))
+    args, source_addr, recv_mode, worker_count, cpus, track_flows = get_args()
 
-    while True:
-        data, (addr, port_no) = sock.recvfrom(1048576)
-        inc_pkt_counts((addr, port_no), len(data))
+    if worker_count <= 1:
+        receive_traffic(source_addr, recv_mode, track_flows)
+    else:
+        start_workers(worker_count, cpus, source_addr, recv_mode, track_flows)
+        for worker_proc in worker_procs:
+            worker_proc.join()
 
 def register_handlers():
     signal.signal(signal.SIGINT, handle_sig_int)